@@ -2,31 +2,90 @@
 """
 Connected Montreal AI Marketing Analyzer
 Reads daily-report.json and generates actionable proposals.
+
+Each rule declares the report fields it reads. Against the last persisted
+state a run re-evaluates only rules whose inputs (or code) changed, reuses
+the others' proposals, and reports the delta: proposals added, changed and
+resolved. Proposal IDs derive from the rule and the proposal's subject, so
+the same finding keeps its ID from run to run.
 """
 
+import argparse
 import json
 import os
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Dict, Any
 
+from lead_scoring import score_leads
+from pipeline import fingerprint
+
+STATE_DIR = os.environ.get("ANALYZER_STATE_DIR", os.path.dirname(os.path.abspath(__file__)))
+WORK_QUEUE_SIZE = 50
+
+# (rule method, report sections passed to it, fields it reads). "today" and
+# "month" are clock inputs for rules whose output depends on the date.
+RULES = [
+    ("_analyze_ad_conversion", ("posthog", "airtable"),
+     ("attribution.landing_pages", "attribution.leads_attributed", "posthog.ad_landing_pages", "airtable.new_leads_7d")),
+    ("_analyze_pipeline_closure", ("airtable",), ("airtable.pipeline", "month")),
+    ("_analyze_followup_cadence", ("airtable",), ("airtable.active_leads", "airtable.leads_needing_followup", "today")),
+    ("_analyze_content_depth", ("posthog", "airtable"),
+     ("posthog.top_pages", "posthog.total_pageviews_7d", "airtable.new_leads_7d")),
+    ("_analyze_traffic_sources", ("posthog",), ("posthog.traffic_sources",)),
+]
+# Analyzer attributes a rule sets besides proposals, restored when the rule is skipped
+RULE_OUTPUTS = {"_analyze_followup_cadence": ("work_queue", "work_queue_total")}
+
+
+def _code_fingerprint(code):
+    """Bytecode and constants of a rule, so editing a rule re-runs it."""
+    consts = [_code_fingerprint(c) if hasattr(c, "co_code") else repr(c) for c in code.co_consts]
+    return fingerprint([code.co_code.hex(), consts, code.co_names])
+
+
+def state_path(consumer: str) -> str:
+    """State file for one consumer (cli, server, pipeline): each delta is relative to its own last run."""
+    return os.path.join(STATE_DIR, f".analyzer_state.{consumer}.json")
+
+
+def load_state(path: str) -> Dict[str, Any]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state: Dict[str, Any], path: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
 class MarketingAnalyzer:
-    def __init__(self, report_path: str):
-        """Initialize analyzer with daily report data."""
-        with open(report_path, 'r') as f:
-            self.data = json.load(f)
+    def __init__(self, report_path: str = None, data: Dict[str, Any] = None):
+        """Initialize analyzer with daily report data (a report dict, or a path to one)."""
+        if data is None:
+            with open(report_path, 'r') as f:
+                data = json.load(f)
+        self.data = data
         self.proposals = []
-        self.proposal_counter = 0
+        self.work_queue = []
+        self.work_queue_total = 0
+        self.state = {}
+        self.delta = {"added": [], "changed": [], "resolved": [], "unchanged": 0}
+        self.rules_run = []
+        self.rules_reused = []
     
-    def generate_id(self, base: str) -> str:
-        """Generate unique proposal ID."""
-        self.proposal_counter += 1
-        return f"{base}-{self.proposal_counter}"
+    def generate_id(self, base: str, subject: str = "") -> str:
+        """Stable proposal ID: the rule's base plus a hash of what the proposal is about."""
+        return f"{base}-{fingerprint([base, subject])[:8]}"
     
     def add_proposal(self, id_base: str, priority: str, category: str, 
-                     issue: str, solution: str, effort: str, impact: str):
-        """Add a proposal to the list."""
+                     issue: str, solution: str, effort: str, impact: str, subject: str = ""):
+        """Add a proposal to the list. subject distinguishes proposals a rule can raise more than once."""
         proposal = {
-            "id": self.generate_id(id_base),
+            "id": self.generate_id(id_base, subject),
             "priority": priority,
             "category": category,
             "issue": issue,
@@ -36,30 +95,78 @@ class MarketingAnalyzer:
         }
         self.proposals.append(proposal)
     
-    def analyze(self) -> List[Dict[str, Any]]:
-        """Run all analysis rules."""
-        posthog = self.data.get('posthog', {})
-        airtable = self.data.get('airtable', {})
-        
-        # Rule 1: Ad landing pages getting traffic but low lead conversion
-        self._analyze_ad_conversion(posthog, airtable)
-        
-        # Rule 2: Pipeline stuck in quoted stage
-        self._analyze_pipeline_closure(airtable)
-        
-        # Rule 3: Leads needing followup
-        self._analyze_followup_cadence(airtable)
-        
-        # Rule 4: Homepage dominates traffic → content depth issue
-        self._analyze_content_depth(posthog, airtable)
-        
-        # Rule 5: Direct traffic analysis
-        self._analyze_traffic_sources(posthog)
-        
+    def _input(self, path: str):
+        if path == "today":
+            return date.today().isoformat()
+        if path == "month":
+            return date.today().strftime('%Y-%m')
+        value = self.data
+        for part in path.split('.'):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+    
+    def analyze(self, state: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Run the analysis rules. With the previous run's state, rules whose
+        inputs are unchanged reuse their proposals; self.state is the new
+        state and self.delta the difference from the previous proposals."""
+        previous = (state or {}).get("rules", {})
+        rules = {}
+        for name, sections, inputs in RULES:
+            method = getattr(self, name)
+            key = fingerprint([_code_fingerprint(method.__code__), {path: self._input(path) for path in inputs}])
+            prev = previous.get(name)
+            if prev and prev["key"] == key:
+                self.proposals += prev["proposals"]
+                for attr, value in prev.get("outputs", {}).items():
+                    setattr(self, attr, value)
+                self.rules_reused.append(name)
+                rules[name] = prev
+                continue
+            start = len(self.proposals)
+            method(*(self.data.get(section, {}) for section in sections))
+            self.rules_run.append(name)
+            outputs = {attr: getattr(self, attr) for attr in RULE_OUTPUTS.get(name, ())}
+            if "work_queue" in outputs:
+                outputs["work_queue"] = outputs["work_queue"][:WORK_QUEUE_SIZE]
+            rules[name] = {"key": key, "proposals": self.proposals[start:], "outputs": outputs}
+        self.state = {"rules": rules}
+        self._diff([p for r in previous.values() for p in r["proposals"]])
         return self.proposals
     
+    def _diff(self, old_proposals: List[Dict[str, Any]]):
+        old = {p["id"]: p for p in old_proposals}
+        new = {p["id"]: p for p in self.proposals}
+        for pid, proposal in new.items():
+            if pid not in old:
+                self.delta["added"].append(proposal)
+            elif proposal != old[pid]:
+                self.delta["changed"].append(proposal)
+            else:
+                self.delta["unchanged"] += 1
+        self.delta["resolved"] = [p for pid, p in old.items() if pid not in new]
+    
     def _analyze_ad_conversion(self, posthog: Dict, airtable: Dict):
         """Rule 1: Check ad landing page conversion."""
+        attributed = [p for p in self.data.get('attribution', {}).get('landing_pages', [])
+                      if p['ad_visitors'] > 50 and p['leads'] / p['ad_visitors'] < 0.05]
+        if attributed:
+            # Joined per-page numbers: ad visitors on this page who became leads
+            page = attributed[0]
+            url, visitors, leads = page['landing'], page['ad_visitors'], page['leads']
+            self.add_proposal(
+                id_base="low-conversion-ad-landing",
+                subject=url,
+                priority="high",
+                category="ads",
+                issue=f"Ad landing page {url} had {visitors} ad visitors but only {leads} became leads (conversion {leads / visitors:.1%})",
+                solution=f"A/B test {url}: (1) Add social proof section with 3 testimonials + '500+ parties planned' counter; (2) Change headline to 'Montreal's #1 Bachelor Party Planners' (test vs current); (3) Simplify CTA button to 'Get Your Quote in 2 Minutes'; (4) Add FAQ section above fold addressing top objections (price, flexibility, rain plan)",
+                effort="1hr",
+                impact="Estimated +20-30% conversion rate = 8-12 additional leads/week"
+            )
+            return
+        if self.data.get('attribution', {}).get('leads_attributed'):
+            return  # attributed pages all convert fine
+
         ad_pages = posthog.get('ad_landing_pages', [])
         new_leads = airtable.get('new_leads_7d', 0)
         total_ad_views = sum(page['views'] for page in ad_pages)
@@ -72,6 +179,7 @@ class MarketingAnalyzer:
             
             self.add_proposal(
                 id_base="low-conversion-ad-landing",
+                subject=url,
                 priority="high",
                 category="ads",
                 issue=f"Ad landing page {url} gets {views} clicks/week but only {new_leads} new leads in 7 days across all channels (conversion rate ~{int(new_leads/total_ad_views*100)}%)",
@@ -98,18 +206,21 @@ class MarketingAnalyzer:
             )
     
     def _analyze_followup_cadence(self, airtable: Dict):
-        """Rule 4: Check leads needing followup."""
-        leads = airtable.get('leads_needing_followup', [])
+        """Rule 4: Check leads needing followup (scores the full active pipeline when available)."""
+        leads = airtable.get('active_leads') or airtable.get('leads_needing_followup', [])
+        self.work_queue = score_leads(leads)
+        self.work_queue_total = len(self.work_queue)
         if len(leads) > 3:
-            # Count overdue (>2 weeks without contact)
-            overdue = sum(1 for lead in leads 
-                         if (datetime.now() - datetime.fromisoformat(lead['last_contact'])).days > 14)
+            # Overdue = tier C (>2 weeks without contact, or no usable contact date)
+            overdue = sum(1 for lead in self.work_queue if lead['tier'] == 'C')
+            known = sorted(lead['days_since_contact'] for lead in self.work_queue if lead['days_since_contact'] is not None)
+            span = f"Last contact ranges from {known[0]} to {known[-1]} days ago" if known else "No recorded contact dates"
             
             self.add_proposal(
                 id_base="followup-backlog",
                 priority="high",
                 category="leads",
-                issue=f"{len(leads)} leads waiting for followup ({overdue} overdue by 2+ weeks). Last contact dates range from 1/6 to 2/24, blocking pipeline movement",
+                issue=f"{len(leads)} leads waiting for followup ({overdue} overdue by 2+ weeks). {span}, blocking pipeline movement",
                 solution=f"Clear the backlog: (1) Tier leads: A=contacted <7 days, B=7-14 days, C=>14 days; (2) This week: call all 'C' tier (overdue) with personal apology + re-quote; (3) Implement CRM rule: all quoted leads get auto-followup on Day 7 and Day 14; (4) Weekly 'pipeline review' call: Oren + Rod discuss each quoted lead's blocker",
                 effort="1hr",
                 impact="Expected to convert 3-5 of stalled leads = $15-30K in revenue"
@@ -171,14 +282,41 @@ class MarketingAnalyzer:
                 )
 
 
+REPORT_PATH = os.path.expanduser("~/Projects/connected-brain/data/daily-report.json")
+PROPOSALS_PATH = os.path.expanduser("~/Projects/connected-brain/data/proposals.json")
+PRIORITY_ORDER = {'high': 0, 'medium': 1, 'low': 2}
+
+
+def build_proposals(report: Dict[str, Any], state_file: str = None) -> Dict[str, Any]:
+    """Analyze a report dict and return the proposals.json payload, including
+    the delta since the state persisted at state_file (None: no state)."""
+    analyzer = MarketingAnalyzer(data=report)
+    proposals = analyzer.analyze(load_state(state_file) if state_file else None)
+    if state_file:
+        save_state(analyzer.state, state_file)
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "report_generated_at": report.get("generated_at"),
+        "proposals": sorted(proposals, key=lambda p: PRIORITY_ORDER[p['priority']]),
+        "delta": analyzer.delta,
+        "rules": {"evaluated": analyzer.rules_run, "reused": analyzer.rules_reused},
+        "work_queue": analyzer.work_queue[:WORK_QUEUE_SIZE],
+        "work_queue_total": analyzer.work_queue_total
+    }
+
+
+def save_proposals(output_data: Dict[str, Any], output_path: str = PROPOSALS_PATH):
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(output_data, f, indent=2)
+
+
 def main():
     """Main execution."""
-    report_path = os.path.expanduser("~/Projects/connected-brain/data/daily-report.json")
-    output_path = os.path.expanduser("~/Projects/connected-brain/data/proposals.json")
-    
-    # Load and analyze
-    analyzer = MarketingAnalyzer(report_path)
-    proposals = analyzer.analyze()
+    with open(REPORT_PATH, 'r') as f:
+        output_data = build_proposals(json.load(f), state_path("cli"))
+    sorted_proposals = output_data["proposals"]
+    work_queue = output_data["work_queue"]
     
     # Print to console
     print(f"\n{'='*80}")
@@ -187,15 +325,14 @@ def main():
     print(f"{'='*80}\n")
     
     print(f"📊 SUMMARY")
-    print(f"  Total Proposals: {len(proposals)}")
-    print(f"  High Priority: {sum(1 for p in proposals if p['priority'] == 'high')}")
-    print(f"  Medium Priority: {sum(1 for p in proposals if p['priority'] == 'medium')}")
+    print(f"  Total Proposals: {len(sorted_proposals)}")
+    print(f"  High Priority: {sum(1 for p in sorted_proposals if p['priority'] == 'high')}")
+    print(f"  Medium Priority: {sum(1 for p in sorted_proposals if p['priority'] == 'medium')}")
+    delta = output_data["delta"]
+    print(f"  Since last run: {len(delta['added'])} new, {len(delta['changed'])} changed, {len(delta['resolved'])} resolved")
+    print(f"  Rules re-evaluated: {len(output_data['rules']['evaluated'])} of {len(RULES)}")
     print(f"\n{'-'*80}\n")
     
-    # Sort by priority
-    priority_order = {'high': 0, 'medium': 1, 'low': 2}
-    sorted_proposals = sorted(proposals, key=lambda p: priority_order[p['priority']])
-    
     for i, prop in enumerate(sorted_proposals, 1):
         print(f"🎯 PROPOSAL {i}: {prop['id'].upper()}")
         print(f"   Priority: {prop['priority'].upper()} | Category: {prop['category'].upper()}")
@@ -204,18 +341,27 @@ def main():
         print(f"   Effort: {prop['effort']} | Impact: {prop['expected_impact']}")
         print(f"\n{'-'*80}\n")
     
-    # Save to JSON
-    output_data = {
-        "generated_at": datetime.now().isoformat(),
-        "proposals": sorted_proposals
-    }
+    if work_queue:
+        print(f"📞 FOLLOW-UP QUEUE (top 10 of {output_data['work_queue_total']})")
+        for lead in work_queue[:10]:
+            print(f"   {lead['score']:6.1f}  [{lead['tier']}] {lead.get('name', '')} — {lead.get('status', '')}")
+        print(f"\n{'-'*80}\n")
     
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    with open(output_path, 'w') as f:
-        json.dump(output_data, f, indent=2)
+    # Save to JSON
+    save_proposals(output_data)
     
-    print(f"✅ Proposals saved to {output_path}")
+    print(f"✅ Proposals saved to {PROPOSALS_PATH}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Connected Montreal AI marketing analyzer")
+    parser.add_argument("--profile", nargs="?", const="", metavar="DIR",
+                        help="profile this run; writes .prof + upstream timeline (default dir: ./profiles)")
+    args = parser.parse_args()
+    if args.profile is not None:
+        import profiling
+        with profiling.Profile("analyzer", args.profile or None) as prof:
+            main()
+        print(f"\n🔬 Profile → {prof.prof_path}\n   Timeline → {prof.timeline_path}")
+    else:
+        main()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - dashboard asset build
+Splits dashboard.html into a small HTML shell plus one CSS and one JS bundle,
+minifies them, names the bundles by content hash and writes gzip and brotli
+variants next to each file. Runs at server startup (and whenever
+dashboard.html changes); `python assets.py` builds the same output ahead of time.
+"""
+
+import gzip
+import hashlib
+import json
+import re
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+SOURCE = Path(__file__).parent / "dashboard.html"
+OUT_DIR = Path(__file__).parent / "static" / "dist"
+URL_PREFIX = "/assets/"
+
+MIMETYPES = {".css": "text/css; charset=utf-8", ".js": "application/javascript; charset=utf-8",
+             ".html": "text/html; charset=utf-8"}
+
+
+# ── Minifiers (used when rjsmin / rcssmin aren't installed) ──────────
+
+def minify_css(css):
+    if rcssmin is not None:
+        return rcssmin.cssmin(css)
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+_REGEX_PREFIX = set("(,=:[!&|?{};+-*%<>~^")
+
+
+def minify_js(js):
+    """Drop comments, indentation and blank lines. Newlines are kept so
+    automatic semicolon insertion behaves exactly as in the source; string,
+    template-literal and regex contents pass through untouched."""
+    if rjsmin is not None:
+        return rjsmin.jsmin(js)
+    out, i, n = [], 0, len(js)
+    line_start = True       # only whitespace emitted since the last newline
+    template_depth = []     # brace depth at each open ${ … } inside a template literal
+    braces = 0
+
+    def last_significant():
+        for chunk in reversed(out):
+            s = chunk.rstrip()
+            if s:
+                return s
+        return ""
+
+    while i < n:
+        c = js[i]
+        if c == "\n":
+            if not line_start:
+                out.append("\n")
+            line_start = True
+            i += 1
+        elif c in " \t\r":
+            j = i
+            while j < n and js[j] in " \t\r":
+                j += 1
+            if not line_start and j < n and js[j] != "\n":
+                out.append(" ")
+            i = j
+        elif js.startswith("//", i):
+            while i < n and js[i] != "\n":
+                i += 1
+        elif js.startswith("/*", i):
+            end = js.find("*/", i + 2)
+            i = n if end < 0 else end + 2
+        elif c in "'\"":
+            j = i + 1
+            while j < n and js[j] != c and js[j] != "\n":
+                j += 2 if js[j] == "\\" else 1
+            out.append(js[i:j + 1])
+            line_start = False
+            i = j + 1
+        elif c == "`" or (c == "}" and template_depth and template_depth[-1] == braces):
+            # Template literal body (or its continuation after a ${…} expression)
+            if c == "}":
+                template_depth.pop()
+            j = i + 1
+            while j < n and js[j] != "`" and not js.startswith("${", j):
+                j += 2 if js[j] == "\\" else 1
+            if js.startswith("${", j):
+                template_depth.append(braces)
+                j += 1
+            out.append(js[i:j + 1])
+            line_start = False
+            i = j + 1
+        elif c == "/":
+            prev = last_significant()
+            if not prev or prev[-1] in _REGEX_PREFIX or re.search(r"\b(return|typeof|case|in|of)$", prev):
+                j, in_class = i + 1, False
+                while j < n and js[j] != "\n" and (in_class or js[j] != "/"):
+                    if js[j] == "\\":
+                        j += 1
+                    elif js[j] == "[":
+                        in_class = True
+                    elif js[j] == "]":
+                        in_class = False
+                    j += 1
+                j += 1
+                while j < n and js[j].isalpha():   # flags
+                    j += 1
+                out.append(js[i:j])
+                i = j
+            else:
+                out.append(c)
+                i += 1
+            line_start = False
+        else:
+            if c == "{":
+                braces += 1
+            elif c == "}":
+                braces -= 1
+            out.append(c)
+            line_start = False
+            i += 1
+    return "".join(out).strip()
+
+
+def minify_html(html):
+    """Strip comments and indentation; <textarea>/<pre> contents are left alone."""
+    html = re.sub(r"<!--.*?-->", "", html, flags=re.S)
+    parts = re.split(r"(<(?:textarea|pre)\b.*?</(?:textarea|pre)>)", html, flags=re.S | re.I)
+    for k in range(0, len(parts), 2):
+        parts[k] = "\n".join(line.strip() for line in parts[k].splitlines() if line.strip())
+    return "".join(parts)
+
+
+# ── Build ────────────────────────────────────────────────────────────
+
+def split_dashboard(html):
+    """Return (shell_html, css, js). Top-level <style>/<script> blocks are pulled out
+    in document order; the shell keeps one <link> and one deferred <script> in their place."""
+    styles, scripts, shell = [], [], []
+    lower = html.lower()
+    pos = 0
+    for m in re.finditer(r"<(style|script)\b([^>]*)>", html, re.I):
+        if m.start() < pos or "src=" in m.group(2):
+            continue   # inside a block we already consumed, or an external script
+        name = m.group(1).lower()
+        end = lower.find(f"</{name}>", m.end())
+        if end < 0:
+            break
+        shell.append(html[pos:m.start()])
+        blocks = styles if name == "style" else scripts
+        if not blocks:
+            shell.append("\x00CSS\x00" if name == "style" else "\x00JS\x00")
+        blocks.append(html[m.end():end])
+        pos = end + len(name) + 3
+    shell.append(html[pos:])
+    return "".join(shell), "\n".join(styles), "\n;\n".join(scripts)
+
+
+def _hashed(stem, suffix, body):
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{suffix}"
+
+
+def compress(body):
+    """{encoding: bytes} for every variant worth serving."""
+    variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11)
+    return variants
+
+
+def build(source=SOURCE, out_dir=OUT_DIR):
+    """Build the bundles and write them (plus .gz/.br) to out_dir.
+
+    Returns {"shell": {encoding: bytes}, "shell_etag": str,
+             "files": {name: {"mimetype": str, "variants": {encoding: bytes}}}}."""
+    shell, css, js = split_dashboard(Path(source).read_text())
+    files = {}
+    css_body = minify_css(css).encode()
+    js_body = minify_js(js).encode()
+    css_name = _hashed("dashboard", ".css", css_body)
+    js_name = _hashed("dashboard", ".js", js_body)
+    files[css_name] = css_body
+    files[js_name] = js_body
+    shell = minify_html(shell)
+    shell = shell.replace("\x00CSS\x00", f'<link rel="stylesheet" href="{URL_PREFIX}{css_name}">')
+    shell = shell.replace("\x00JS\x00", f'<script src="{URL_PREFIX}{js_name}" defer></script>')
+    shell_body = shell.encode()
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    built = {"shell": compress(shell_body), "shell_etag": hashlib.sha256(shell_body).hexdigest()[:16], "files": {}}
+    for name, body in files.items():
+        variants = compress(body)
+        built["files"][name] = {"mimetype": MIMETYPES[Path(name).suffix], "variants": variants}
+        for enc, data in variants.items():
+            suffix = {"identity": "", "gzip": ".gz", "br": ".br"}[enc]
+            (out_dir / (name + suffix)).write_bytes(data)
+    (out_dir / "index.html").write_bytes(shell_body)
+    # Drop bundles from previous builds
+    for old in out_dir.glob("dashboard.*"):
+        if old.name.split(".gz")[0].split(".br")[0] not in files:
+            old.unlink()
+    (out_dir / "manifest.json").write_text(json.dumps(
+        {"css": css_name, "js": js_name,
+         "sizes": {name: {enc: len(v) for enc, v in built["files"][name]["variants"].items()} for name in files}},
+        indent=2))
+    return built
+
+
+def negotiate(accept_encoding, variants):
+    """Pick the best encoding the client accepts (br > gzip > identity)."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        bits = part.strip().split(";")
+        q = 1.0
+        for b in bits[1:]:
+            if b.strip().startswith("q="):
+                try:
+                    q = float(b.strip()[2:])
+                except ValueError:
+                    q = 0.0
+        if bits[0]:
+            accepted[bits[0].strip().lower()] = q
+    for enc in ("br", "gzip"):
+        if enc in variants and accepted.get(enc, accepted.get("*", 0)) > 0:
+            return enc
+    return "identity"
+
+
+if __name__ == "__main__":
+    result = build()
+    for name, info in result["files"].items():
+        sizes = ", ".join(f"{enc} {len(v):,}B" for enc, v in info["variants"].items())
+        print(f"✅ {name}: {sizes}")
+    sizes = ", ".join(f"{enc} {len(v):,}B" for enc, v in result["shell"].items())
+    print(f"✅ shell: {sizes}")
+    if brotli is None:
+        print("⚠️  brotli not installed — only gzip variants written")
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - ad-click → lead attribution
+Hash indexes over PostHog events (distinct ID, email, phone, gclid) and
+Airtable leads (email, phone, Source of lead), joined locally. Each visitor's
+first ad touch gives the landing page and campaign; a lead is attributed to
+the touch of the visitor it matches. Events and leads can be added in any
+order and any number of batches: only leads touched by a batch are re-joined,
+so the per-page/per-campaign counts stay current without rescanning history.
+"""
+
+from collections import Counter
+
+from sms_store import normalize_phone
+
+PAID_MEDIUMS = {"cpc", "ppc", "paid", "paidsearch", "paid_social", "paidsocial"}
+NO_CAMPAIGN = "(none)"
+
+
+def _props(event):
+    return event.get("properties") or {}
+
+
+def ad_touch(props):
+    """(landing_page, campaign, click_id) for a paid visit, else None.
+    Same rule as the collector's ad_landing_pages (gclid or utm_source=google), plus paid utm_medium."""
+    gclid = props.get("gclid") or props.get("$gclid") or ""
+    source = (props.get("$utm_source") or props.get("utm_source") or "").lower()
+    medium = (props.get("$utm_medium") or props.get("utm_medium") or "").lower()
+    if not (gclid or props.get("fbclid") or source == "google" or medium in PAID_MEDIUMS):
+        return None
+    campaign = props.get("$utm_campaign") or props.get("utm_campaign") or NO_CAMPAIGN
+    return props.get("$pathname") or "/", campaign, gclid
+
+
+def _email(val):
+    val = str(val or "").strip().lower()
+    return val if "@" in val else ""
+
+
+def event_contacts(event):
+    """Emails/phones an event reveals (form fields, $set on identify, person properties)."""
+    props = _props(event)
+    person = (event.get("person") or {}).get("properties") or {}
+    sets = props.get("$set") or {}
+    emails = {_email(src.get("email")) for src in (props, sets, person)}
+    phones = {normalize_phone(src.get("phone")) for src in (props, sets, person) if src.get("phone")}
+    return emails - {""}, phones - {""}
+
+
+class AttributionIndex:
+    def __init__(self):
+        self.parent = {}        # distinct_id -> merged-into distinct_id ($identify aliases)
+        self.touch = {}         # root distinct_id -> first ad touch {"landing", "campaign", "ts"}
+        self.by_email = {}      # email -> root distinct_id
+        self.by_phone = {}
+        self.by_gclid = {}
+        self.contacts = {}      # root distinct_id -> {"emails": set, "phones": set, "gclids": set}
+        self.leads = {}         # lead_id -> {"email", "phone", "source", "gclid", "created"}
+        self.lead_ids_by = {"email": {}, "phone": {}, "gclid": {}}
+        self.attributed = {}    # lead_id -> (landing, campaign)
+        self.visitors_by_landing = Counter()
+        self.visitors_by_campaign = Counter()
+        self.leads_by_landing = Counter()
+        self.leads_by_campaign = Counter()
+        self.events_indexed = 0
+        self.last_event_ts = ""
+
+    # ── Visitors ─────────────────────────────────────────────────────
+
+    def _root(self, did):
+        path = []
+        while did in self.parent:
+            path.append(did)
+            did = self.parent[did]
+        for p in path:      # path compression
+            self.parent[p] = did
+        return did
+
+    def _set_touch(self, root, touch):
+        old = self.touch.get(root)
+        if old and old["ts"] <= touch["ts"]:
+            return False
+        if old:
+            self.visitors_by_landing[old["landing"]] -= 1
+            self.visitors_by_campaign[old["campaign"]] -= 1
+        self.touch[root] = touch
+        self.visitors_by_landing[touch["landing"]] += 1
+        self.visitors_by_campaign[touch["campaign"]] += 1
+        return True
+
+    def _link(self, root, emails=(), phones=(), gclids=()):
+        c = self.contacts.setdefault(root, {"emails": set(), "phones": set(), "gclids": set()})
+        for kind, index, values in (("emails", self.by_email, emails), ("phones", self.by_phone, phones),
+                                    ("gclids", self.by_gclid, gclids)):
+            for v in values:
+                index[v] = root
+                c[kind].add(v)
+
+    def _merge(self, anon, ident):
+        """$identify: fold the anonymous visitor into the identified one."""
+        ra, rb = self._root(anon), self._root(ident)
+        if ra == rb:
+            return rb
+        self.parent[ra] = rb
+        moved = self.contacts.pop(ra, None)
+        if moved:
+            self._link(rb, moved["emails"], moved["phones"], moved["gclids"])
+        old = self.touch.pop(ra, None)
+        if old:
+            self.visitors_by_landing[old["landing"]] -= 1
+            self.visitors_by_campaign[old["campaign"]] -= 1
+            self._set_touch(rb, old)
+        return rb
+
+    def add_events(self, events):
+        """Index a batch of PostHog events; re-joins only leads whose visitor changed."""
+        dirty = set()
+        for e in events:
+            did = e.get("distinct_id")
+            if not did:
+                continue
+            props = _props(e)
+            ts = e.get("timestamp") or ""
+            self.events_indexed += 1
+            if ts > self.last_event_ts:
+                self.last_event_ts = ts
+            anon = props.get("$anon_distinct_id")
+            root = self._merge(anon, did) if e.get("event") == "$identify" and anon else self._root(did)
+            emails, phones = event_contacts(e)
+            if emails or phones:
+                self._link(root, emails, phones)
+                dirty.add(root)
+            t = ad_touch(props)
+            if t:
+                landing, campaign, gclid = t
+                if gclid:
+                    self._link(root, gclids=[gclid])
+                if self._set_touch(root, {"landing": landing, "campaign": campaign, "ts": ts}) or gclid:
+                    dirty.add(root)
+            elif anon:
+                dirty.add(root)
+        self._rejoin_visitors(dirty)
+
+    def _rejoin_visitors(self, roots):
+        lead_ids = set()
+        for root in {self._root(r) for r in roots}:
+            c = self.contacts.get(root, {})
+            for kind, key in (("emails", "email"), ("phones", "phone"), ("gclids", "gclid")):
+                for v in c.get(kind, ()):
+                    lead_ids |= self.lead_ids_by[key].get(v, set())
+        for lead_id in lead_ids:
+            self._attribute(lead_id)
+
+    # ── Leads ────────────────────────────────────────────────────────
+
+    def add_leads(self, leads):
+        """Index leads (dicts with id, email, phone, source, created_on[, gclid]); new or changed ones are joined."""
+        for lead in leads:
+            lead_id = lead.get("id")
+            if not lead_id:
+                continue
+            entry = {"email": _email(lead.get("email")), "phone": normalize_phone(lead.get("phone")),
+                     "gclid": lead.get("gclid") or "", "source": lead.get("source") or "(unknown)",
+                     "created": str(lead.get("created_on") or "")[:10]}
+            old = self.leads.get(lead_id)
+            if old == entry:
+                continue
+            if old:
+                for kind in ("email", "phone", "gclid"):
+                    self.lead_ids_by[kind].get(old[kind], set()).discard(lead_id)
+            self.leads[lead_id] = entry
+            for kind in ("email", "phone", "gclid"):
+                if entry[kind]:
+                    self.lead_ids_by[kind].setdefault(entry[kind], set()).add(lead_id)
+            self._attribute(lead_id)
+
+    def _attribute(self, lead_id):
+        lead = self.leads[lead_id]
+        touch = None
+        for kind, index in (("gclid", self.by_gclid), ("email", self.by_email), ("phone", self.by_phone)):
+            root = index.get(lead[kind]) if lead[kind] else None
+            t = self.touch.get(self._root(root)) if root else None
+            # A touch after the lead came in didn't produce it
+            if t and not (lead["created"] and t["ts"][:10] > lead["created"]):
+                touch = t
+                break
+        new = (touch["landing"], touch["campaign"]) if touch else None
+        old = self.attributed.get(lead_id)
+        if new == old:
+            return
+        if old:
+            self.leads_by_landing[old[0]] -= 1
+            self.leads_by_campaign[old[1]] -= 1
+        if new:
+            self.attributed[lead_id] = new
+            self.leads_by_landing[new[0]] += 1
+            self.leads_by_campaign[new[1]] += 1
+        else:
+            self.attributed.pop(lead_id, None)
+
+    # ── Output ───────────────────────────────────────────────────────
+
+    @staticmethod
+    def _rows(key, visitors, leads, limit):
+        rows = []
+        for name in set(visitors) | set(leads):
+            v, n = visitors.get(name, 0), leads.get(name, 0)
+            if v or n:
+                rows.append({key: name, "ad_visitors": v, "leads": n,
+                             "conversion": round(n / v, 4) if v else None})
+        rows.sort(key=lambda r: (r["ad_visitors"], r["leads"]), reverse=True)
+        return rows[:limit]
+
+    def report(self, limit=20):
+        by_source = {}
+        for lead_id, lead in self.leads.items():
+            s = by_source.setdefault(lead["source"], {"leads": 0, "attributed": 0})
+            s["leads"] += 1
+            s["attributed"] += lead_id in self.attributed
+        return {
+            "landing_pages": self._rows("landing", self.visitors_by_landing, self.leads_by_landing, limit),
+            "campaigns": self._rows("campaign", self.visitors_by_campaign, self.leads_by_campaign, limit),
+            "by_source": dict(sorted(by_source.items(), key=lambda kv: kv[1]["leads"], reverse=True)),
+            "ad_visitors": len(self.touch),
+            "leads_total": len(self.leads),
+            "leads_attributed": len(self.attributed),
+            "events_indexed": self.events_indexed,
+            "last_event_ts": self.last_event_ts,
+        }
+
+    # ── Persistence (visitor side only; leads are re-added from the live snapshot) ──
+
+    def to_state(self):
+        return {
+            "parent": self.parent, "touch": self.touch,
+            "contacts": {r: {k: sorted(v) for k, v in c.items()} for r, c in self.contacts.items()},
+            "events_indexed": self.events_indexed, "last_event_ts": self.last_event_ts,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        idx = cls()
+        idx.parent = dict(state.get("parent") or {})
+        for root, touch in (state.get("touch") or {}).items():
+            idx._set_touch(root, touch)
+        for root, c in (state.get("contacts") or {}).items():
+            idx._link(root, c.get("emails", ()), c.get("phones", ()), c.get("gclids", ()))
+        idx.events_indexed = state.get("events_indexed", 0)
+        idx.last_event_ts = state.get("last_event_ts", "")
+        return idx
+
+
+def merge_reports(by_market, limit=20):
+    """Combine per-market attribution reports; rows are tagged with their market."""
+    out = {"landing_pages": [], "campaigns": [], "by_source": {}, "ad_visitors": 0,
+           "leads_total": 0, "leads_attributed": 0, "events_indexed": 0}
+    for key, rep in by_market.items():
+        if not rep:
+            continue
+        out["landing_pages"] += [{**r, "market": key} for r in rep["landing_pages"]]
+        out["campaigns"] += [{**r, "market": key} for r in rep["campaigns"]]
+        for src, s in rep["by_source"].items():
+            agg = out["by_source"].setdefault(src, {"leads": 0, "attributed": 0})
+            agg["leads"] += s["leads"]
+            agg["attributed"] += s["attributed"]
+        for k in ("ad_visitors", "leads_total", "leads_attributed", "events_indexed"):
+            out[k] += rep[k]
+    for k in ("landing_pages", "campaigns"):
+        out[k] = sorted(out[k], key=lambda r: (r["ad_visitors"], r["leads"]), reverse=True)[:limit]
+    return out
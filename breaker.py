@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - per-upstream circuit breakers
+Every upstream_request() call is checked against its upstream's breaker. After
+BREAKER_FAILURES consecutive failures (connection errors, timeouts, 5xx, 429)
+the breaker opens and calls fail immediately with CircuitOpenError. After
+BREAKER_RESET seconds a limited number of probe calls go through; one success
+closes the breaker again. Callers then serve their last good data and flag
+it with mark_stale() so the response can say it is stale.
+"""
+
+import contextvars
+import os
+import threading
+import time
+
+import requests
+
+import metrics
+
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.environ.get("BREAKER_RESET", 30))      # seconds open before probing
+BREAKER_PROBES = int(os.environ.get("BREAKER_PROBES", 1))       # concurrent probe calls while half-open
+
+STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling an upstream whose breaker is open.
+    Subclasses ConnectionError so existing `except requests.RequestException` paths handle it."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET, probes=BREAKER_PROBES):
+        self.name = name
+        self.threshold = failures
+        self.reset_after = reset_after
+        self.max_probes = probes
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_after:
+                self.state = "half_open"
+                self.probes = 0
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and self.probes < self.max_probes:
+                self.probes += 1
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            if self.state == "half_open":
+                self.probes = max(self.probes - 1, 0)
+                if ok:
+                    self._close()
+                else:
+                    self._open()
+            elif ok:
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.state == "closed" and self.failures >= self.threshold:
+                    self._open()
+
+    def _open(self):
+        self.state = "open"
+        self.opened_at = time.monotonic()
+        metrics.inc("cm_breaker_transitions_total", upstream=self.name, state="open")
+        print(f"⚠️  Circuit open for {self.name} — failing fast for {self.reset_after:.0f}s")
+
+    def _close(self):
+        self.state = "closed"
+        self.failures = 0
+        metrics.inc("cm_breaker_transitions_total", upstream=self.name, state="closed")
+        print(f"✅ Circuit closed for {self.name}")
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures,
+                    "open_for": round(time.monotonic() - self.opened_at, 1) if self.state != "closed" else 0}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get(upstream):
+    with _breakers_lock:
+        if upstream not in _breakers:
+            _breakers[upstream] = CircuitBreaker(upstream)
+        return _breakers[upstream]
+
+
+def states():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: b.snapshot() for name, b in breakers.items()}
+
+
+def _guard(upstream, target, method, url):
+    if not get(upstream).allow():
+        metrics.inc("cm_breaker_rejected_total", upstream=upstream, target=target)
+        raise CircuitOpenError(f"{upstream} circuit open — skipping {method} {url.split('?', 1)[0]}")
+
+
+def _record(upstream, target, method, url, status, start, elapsed):
+    failed = status == "error" or status == "429" or status.startswith("5")
+    get(upstream).record(not failed)
+
+
+metrics._call_guards.append(_guard)
+metrics._call_listeners.append(_record)
+
+
+# ── Stale marks ──────────────────────────────────────────────
+# A mutable set per request, so marks made on worker threads (which run in
+# copies of the request's context) are still visible to the request.
+_stale = contextvars.ContextVar("stale_sources", default=None)
+
+
+def begin_request():
+    _stale.set(set())
+
+
+def mark_stale(source):
+    marks = _stale.get()
+    if marks is not None:
+        marks.add(source)
+    metrics.inc("cm_stale_served_total", source=source)
+
+
+def stale_sources():
+    return sorted(_stale.get() or ())
+
+
+metrics.describe("cm_breaker_rejected_total", "Upstream calls refused because the circuit was open")
+metrics.describe("cm_breaker_transitions_total", "Circuit breaker state changes by upstream")
+metrics.describe("cm_stale_served_total", "Responses served from last good data after an upstream failure")
+metrics.gauge("cm_breaker_state",
+              lambda: {(("upstream", name),): STATE_VALUES[s["state"]] for name, s in states().items()},
+              "Circuit state per upstream (0 closed, 1 half-open, 2 open)")
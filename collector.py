@@ -1,49 +1,66 @@
 #!/usr/bin/env python3
 """
 Connected Montreal - AI Marketing Data Collector
-Pulls data from PostHog and Airtable, generates daily report
+Pulls data from PostHog and Airtable for every market concurrently and
+generates per-market and combined daily reports
 """
 
-import requests
+import argparse
+import contextvars
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from collections import Counter
 from pathlib import Path
 
+import attribution
+import markets
+from metrics import upstream_request
+
+OUTPUT_DIR = Path(os.path.expanduser("~/Projects/connected-brain/data"))
+COMBINED_REPORT = OUTPUT_DIR / "daily-report.json"
+
+
+def market_report_path(market_key):
+    return OUTPUT_DIR / f"daily-report.{market_key}.json"
+
 
 class DataCollector:
-    def __init__(self):
-        self.posthog_api_key = "phx_10r8mxfGxYI4gU863o057kfjjHrUPsiwpOipfPofxCRBV77P"
+    def __init__(self, market=None):
+        self.market = market or markets.get_market()
+        self.posthog_api_key = os.environ.get("POSTHOG_API_KEY") or "phx_10r8mxfGxYI4gU863o057kfjjHrUPsiwpOipfPofxCRBV77P"
         self.posthog_host = "https://us.posthog.com"
-        self.posthog_project = 259946  # connectedmontreal.com
+        self.posthog_project = self.market["posthog_project"]
 
         airtable_token_file = Path("/Users/orenborn/.openclaw/workspaces/connected-montreal/.airtable-token")
-        self.airtable_token = airtable_token_file.read_text().strip() if airtable_token_file.exists() else None
-        self.base_id = "appHT9Re4l53GO16t"
-        self.customers_table = "tbl4P7tqdonXv5vcY"
+        self.airtable_token = (airtable_token_file.read_text().strip() if airtable_token_file.exists()
+                               else os.environ.get("AIRTABLE_TOKEN") or None)
+        self.base_id = self.market["airtable_base"]
+        self.customers_table = self.market["customers_table"]
 
         self.end_date = datetime.now(timezone.utc)
         self.start_date = self.end_date - timedelta(days=7)
-        self.output_path = Path(os.path.expanduser("~/Projects/connected-brain/data/daily-report.json"))
+        self.output_path = market_report_path(self.market["key"])
+        # Raw inputs for the attribution join, filled in by the two fetches
+        self._events = []
+        self._attribution_leads = []
+
+    def _request(self, upstream, method, url, **kwargs):
+        """upstream_request paced by this market's limiter for that upstream."""
+        markets.limiter(self.market["key"], upstream).wait()
+        return upstream_request(upstream, method, url, **kwargs)
 
     def get_posthog_data(self):
         headers = {"Authorization": f"Bearer {self.posthog_api_key}"}
         result = {"top_pages": [], "traffic_sources": [], "total_pageviews_7d": 0, "avg_daily_pageviews": 0, "ad_landing_pages": []}
+        if not self.posthog_project:
+            return result
 
         try:
-            all_events = []
-            url = f"{self.posthog_host}/api/projects/{self.posthog_project}/events/"
-            params = {"event": "$pageview", "limit": 1000, "after": self.start_date.strftime("%Y-%m-%dT%H:%M:%S")}
-
-            while url:
-                r = requests.get(url, headers=headers, params=params, timeout=15)
-                if r.status_code != 200:
-                    break
-                data = r.json()
-                all_events.extend(data.get("results", []))
-                url = data.get("next")
-                params = {}  # next URL already has params
+            all_events = self._fetch_events(headers, "$pageview")
+            # $identify ties anonymous visitors to the emails leads are matched on
+            self._events = all_events + self._fetch_events(headers, "$identify")
 
             result["total_pageviews_7d"] = len(all_events)
             result["avg_daily_pageviews"] = round(len(all_events) / 7, 1)
@@ -65,76 +82,121 @@ class DataCollector:
             result["ad_landing_pages"] = [{"url": url, "views": count} for url, count in ad_pages.most_common(5)]
 
         except Exception as e:
-            print(f"❌ PostHog error: {e}")
+            print(f"❌ [{self.market['name']}] PostHog error: {e}")
 
         return result
 
-    def get_airtable_data(self):
-        result = {"new_leads_7d": 0, "pipeline": {"new": 0, "quoted": 0, "booked": 0, "no_go": 0}, "leads_needing_followup": [], "total_pipeline_value": 0}
-        if not self.airtable_token:
-            return result
-
+    def _fetch_events(self, headers, event):
+        events = []
+        url = f"{self.posthog_host}/api/projects/{self.posthog_project}/events/"
+        params = {"event": event, "limit": 1000, "after": self.start_date.strftime("%Y-%m-%dT%H:%M:%S")}
+        while url:
+            r = self._request("posthog", "GET", url, target="events", headers=headers, params=params, timeout=15)
+            if r.status_code != 200:
+                break
+            data = r.json()
+            events.extend(data.get("results", []))
+            url = data.get("next")
+            params = {}  # next URL already has params
+        return events
+
+    # Only these fields are read below; everything else stays on Airtable's side
+    CUSTOMER_FIELDS = ["Status", "Name", "Grand Total", "Service Total", "Status Update Date", "First Contact Date",
+                       "DOA", "People", "Source of lead", "Email", "Phone"]
+    ACTIVE_FORMULA = "AND({Status}!='No Go',{Status}!='')"
+    EXCLUDED_FORMULA = "OR({Status}='No Go',{Status}='')"
+
+    def _iter_customers(self, formula, fields):
+        """Yield customer records page by page, filtered and projected server-side."""
         headers = {"Authorization": f"Bearer {self.airtable_token}"}
-        records = []
         url = f"https://api.airtable.com/v0/{self.base_id}/{self.customers_table}"
         offset = None
+        while True:
+            params = [("pageSize", "100"), ("filterByFormula", formula)]
+            params += [("fields[]", f) for f in fields]
+            if offset:
+                params.append(("offset", offset))
+            r = self._request("airtable", "GET", url, target="customers", headers=headers, params=params, timeout=15)
+            if r.status_code == 422 and fields:
+                # A projected field was renamed/removed in Airtable — fall back to all fields
+                print(f"⚠️  [{self.market['name']}] Airtable rejected field list, retrying without projection: {r.text[:200]}")
+                fields = []
+                continue
+            if r.status_code != 200:
+                print(f"⚠️  [{self.market['name']}] Airtable error {r.status_code}")
+                return
+            data = r.json()
+            yield from data.get("records", [])
+            offset = data.get("offset")
+            if not offset:
+                return
+
+    def _is_new(self, rec):
+        try:
+            created_dt = datetime.fromisoformat(rec.get("createdTime", "").replace("Z", "+00:00"))
+            return created_dt >= self.start_date
+        except ValueError:
+            return False
+
+    def get_airtable_data(self):
+        result = {"new_leads_7d": 0, "pipeline": {"new": 0, "quoted": 0, "booked": 0, "no_go": 0}, "leads_needing_followup": [], "active_leads": [], "total_pipeline_value": 0}
+        if not (self.airtable_token and self.base_id and self.customers_table):
+            return result
+
+        status_map = {"New Request": "new", "talked to/ quoted": "quoted", "Booked": "booked", "No Go": "no_go"}
 
         try:
-            while True:
-                params = {"pageSize": 100}
-                if offset:
-                    params["offset"] = offset
-                r = requests.get(url, headers=headers, params=params, timeout=15)
-                if r.status_code != 200:
-                    print(f"⚠️  Airtable error {r.status_code}")
-                    break
-                data = r.json()
-                records.extend(data.get("records", []))
-                offset = data.get("offset")
-                if not offset:
-                    break
-
-            status_map = {"New Request": "new", "talked to/ quoted": "quoted", "Booked": "booked", "No Go": "no_go"}
-
-            for rec in records:
+            # Active leads: streamed, only the fields we use
+            for rec in self._iter_customers(self.ACTIVE_FORMULA, self.CUSTOMER_FIELDS):
                 fields = rec.get("fields", {})
                 status = fields.get("Status", "")
-                created = rec.get("createdTime", "")
 
                 # New leads in last 7 days
-                try:
-                    created_dt = datetime.fromisoformat(created.replace("Z", "+00:00"))
-                    if created_dt >= self.start_date:
-                        result["new_leads_7d"] += 1
-                except:
-                    pass
+                if self._is_new(rec):
+                    result["new_leads_7d"] += 1
 
                 # Pipeline counts
                 bucket = status_map.get(status)
                 if bucket:
                     result["pipeline"][bucket] += 1
 
+                self._attribution_leads.append({
+                    "id": rec.get("id", ""), "email": fields.get("Email", ""), "phone": fields.get("Phone", ""),
+                    "source": fields.get("Source of lead", ""), "created_on": rec.get("createdTime", ""),
+                })
+
                 # Pipeline value (Grand Total field)
-                if status not in ["No Go", ""]:
-                    val = fields.get("Grand Total") or fields.get("Service Total") or 0
-                    try:
-                        result["total_pipeline_value"] += float(str(val).replace(",", "").replace("$", "")) if val else 0
-                    except:
-                        pass
-
-                # Leads needing followup (New or Quoted)
+                val = fields.get("Grand Total") or fields.get("Service Total") or 0
+                try:
+                    result["total_pipeline_value"] += float(str(val).replace(",", "").replace("$", "")) if val else 0
+                except ValueError:
+                    pass
+
+                # Leads needing followup (New or Quoted): all go to active_leads for
+                # scoring, the first 10 to the summary list
                 if status in ["New Request", "talked to/ quoted"]:
                     name = fields.get("Name", "Unknown")
                     followup_date = fields.get("Status Update Date", fields.get("First Contact Date", "Unknown"))
-                    result["leads_needing_followup"].append({
-                        "name": name, "status": status, "last_contact": str(followup_date)
+                    lead = {"name": name, "status": status, "last_contact": str(followup_date)}
+                    if len(result["leads_needing_followup"]) < 10:
+                        result["leads_needing_followup"].append(lead)
+                    result["active_leads"].append({
+                        **lead, "id": rec.get("id", ""), "doa": fields.get("DOA", ""),
+                        "people": fields.get("People", ""), "source": fields.get("Source of lead", ""),
+                        "created_on": rec.get("createdTime", ""),
                     })
 
-            result["leads_needing_followup"] = result["leads_needing_followup"][:10]
+            # No Go / blank: count-only pass (Status field + createdTime)
+            for rec in self._iter_customers(self.EXCLUDED_FORMULA, ["Status"]):
+                if rec.get("fields", {}).get("Status") == "No Go":
+                    result["pipeline"]["no_go"] += 1
+                if self._is_new(rec):
+                    result["new_leads_7d"] += 1
+
             result["total_pipeline_value"] = round(result["total_pipeline_value"], 2)
 
         except Exception as e:
-            print(f"❌ Airtable error: {e}")
+            print(f"❌ [{self.market['name']}] Airtable error: {e}")
 
         return result
 
@@ -161,50 +223,142 @@ class DataCollector:
             "opportunities": opps or ["Keep monitoring — more data needed"]
         }
 
-    def run(self):
-        print("🚀 Connected Montreal Data Collector")
-        print(f"   Period: {self.start_date.date()} → {self.end_date.date()}\n")
-
-        print("📊 Fetching PostHog...")
-        ph = self.get_posthog_data()
-        print(f"   ✅ {ph['total_pageviews_7d']} pageviews, {len(ph['top_pages'])} pages tracked")
+    def collect(self):
+        """Fetch PostHog and Airtable side by side and return this market's report."""
+        name = self.market["name"]
+        print(f"📡 [{name}] Fetching PostHog + Airtable...")
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            ph_future = pool.submit(contextvars.copy_context().run, self.get_posthog_data)
+            at_future = pool.submit(contextvars.copy_context().run, self.get_airtable_data)
+            ph, at = ph_future.result(), at_future.result()
+        print(f"   ✅ [{name}] {ph['total_pageviews_7d']} pageviews, {sum(at['pipeline'].values())} leads in pipeline")
 
-        print("📋 Fetching Airtable...")
-        at = self.get_airtable_data()
-        print(f"   ✅ {sum(at['pipeline'].values())} total leads in pipeline")
+        index = attribution.AttributionIndex()
+        index.add_events(self._events)
+        index.add_leads(self._attribution_leads)
 
-        insights = self.generate_insights(ph, at)
-
-        report = {
+        return {
             "generated_at": datetime.now().isoformat(),
             "period_days": 7,
+            "market": self.market["key"],
             "posthog": ph,
             "airtable": at,
-            "insights": insights
+            "attribution": index.report(),
+            "insights": self.generate_insights(ph, at)
         }
 
-        self.output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.output_path, "w") as f:
-            json.dump(report, f, indent=2)
-
-        print(f"\n✅ Saved → {self.output_path}")
-        print("\n" + "="*50)
-        print("SUMMARY")
-        print("="*50)
-        print(f"🌐 Traffic (7d): {ph['total_pageviews_7d']} pageviews, ~{ph['avg_daily_pageviews']}/day")
-        if ph["top_pages"]:
-            print("   Top pages:")
-            for p in ph["top_pages"][:5]:
-                print(f"   • {p['url']} — {p['views']} views")
-        print(f"\n👥 Pipeline: {at['new_leads_7d']} new | {at['pipeline']['quoted']} quoted | {at['pipeline']['booked']} booked | ${at['total_pipeline_value']:,.0f} value")
-        print(f"\n⚠️  Issues:")
-        for i in insights["issues"]:
-            print(f"   • {i}")
-        print(f"\n💡 Opportunities:")
-        for o in insights["opportunities"]:
-            print(f"   • {o}")
+
+def _tagged(items, market_key):
+    return [{**item, "market": market_key} for item in items]
+
+
+def combine_reports(reports):
+    """Merge per-market reports into one report with the same shape (plus a markets section)."""
+    ph = {"top_pages": [], "traffic_sources": [], "total_pageviews_7d": 0, "avg_daily_pageviews": 0, "ad_landing_pages": []}
+    at = {"new_leads_7d": 0, "pipeline": {"new": 0, "quoted": 0, "booked": 0, "no_go": 0},
+          "leads_needing_followup": [], "active_leads": [], "total_pipeline_value": 0}
+    insights = {"issues": [], "opportunities": []}
+    sources = Counter()
+    multi = len(reports) > 1
+    for key, report in reports.items():
+        name = markets.MARKETS.get(key, {}).get("name", key)
+        p, a = report["posthog"], report["airtable"]
+        ph["total_pageviews_7d"] += p["total_pageviews_7d"]
+        ph["avg_daily_pageviews"] = round(ph["avg_daily_pageviews"] + p["avg_daily_pageviews"], 1)
+        ph["top_pages"] += _tagged(p["top_pages"], key)
+        ph["ad_landing_pages"] += _tagged(p["ad_landing_pages"], key)
+        for s in p["traffic_sources"]:
+            sources[s["source"]] += s["sessions"]
+        at["new_leads_7d"] += a["new_leads_7d"]
+        for bucket, count in a["pipeline"].items():
+            at["pipeline"][bucket] = at["pipeline"].get(bucket, 0) + count
+        at["leads_needing_followup"] += _tagged(a["leads_needing_followup"], key)
+        at["active_leads"] += _tagged(a["active_leads"], key)
+        at["total_pipeline_value"] = round(at["total_pipeline_value"] + a["total_pipeline_value"], 2)
+        for kind in ("issues", "opportunities"):
+            insights[kind] += [f"[{name}] {line}" if multi else line for line in report["insights"][kind]]
+    ph["top_pages"] = sorted(ph["top_pages"], key=lambda p: p["views"], reverse=True)[:10]
+    ph["ad_landing_pages"] = sorted(ph["ad_landing_pages"], key=lambda p: p["views"], reverse=True)[:5]
+    ph["traffic_sources"] = [{"source": src, "sessions": cnt} for src, cnt in sources.most_common(8)]
+    return {
+        "generated_at": datetime.now().isoformat(),
+        "period_days": 7,
+        "markets": sorted(reports),
+        "posthog": ph,
+        "airtable": at,
+        "attribution": attribution.merge_reports({k: r.get("attribution") for k, r in reports.items()}),
+        "insights": insights,
+    }
+
+
+def write_report(path, report):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def collect_markets(market_keys=None, write=True):
+    """Collect every (or the given) configured market concurrently; write per-market
+    reports plus the combined daily-report.json (unless write=False). Returns the combined report."""
+    selected = [markets.MARKETS[k] for k in market_keys] if market_keys else markets.active_markets()
+    collectors = [DataCollector(m) for m in selected]
+    if not collectors:
+        raise ValueError("No configured markets — set <MARKET>_POSTHOG_PROJECT / _AIRTABLE_BASE / _AIRTABLE_TABLE")
+    start, end = collectors[0].start_date, collectors[0].end_date
+    print("🚀 Connected Montreal Data Collector")
+    print(f"   Markets: {', '.join(c.market['name'] for c in collectors)}")
+    print(f"   Period: {start.date()} → {end.date()}\n")
+
+    # One worker per market; each market's own limiters keep it inside its API budgets
+    with ThreadPoolExecutor(max_workers=len(collectors), thread_name_prefix="market") as pool:
+        futures = {c.market["key"]: pool.submit(contextvars.copy_context().run, c.collect) for c in collectors}
+        reports = {key: f.result() for key, f in futures.items()}
+
+    combined = combine_reports(reports)
+    if write:
+        for c in collectors:
+            write_report(c.output_path, reports[c.market["key"]])
+            print(f"✅ Saved → {c.output_path}")
+        write_report(COMBINED_REPORT, combined)
+        print(f"✅ Saved → {COMBINED_REPORT}")
+    return combined
+
+
+def print_summary(report):
+    ph, at, insights = report["posthog"], report["airtable"], report["insights"]
+    print("\n" + "="*50)
+    print("SUMMARY")
+    print("="*50)
+    print(f"🌐 Traffic (7d): {ph['total_pageviews_7d']} pageviews, ~{ph['avg_daily_pageviews']}/day")
+    if ph["top_pages"]:
+        print("   Top pages:")
+        for p in ph["top_pages"][:5]:
+            where = f" ({markets.MARKETS[p['market']]['name']})" if p.get("market") in markets.MARKETS else ""
+            print(f"   • {p['url']}{where} — {p['views']} views")
+    print(f"\n👥 Pipeline: {at['new_leads_7d']} new | {at['pipeline']['quoted']} quoted | {at['pipeline']['booked']} booked | ${at['total_pipeline_value']:,.0f} value")
+    print(f"\n⚠️  Issues:")
+    for i in insights["issues"]:
+        print(f"   • {i}")
+    print(f"\n💡 Opportunities:")
+    for o in insights["opportunities"]:
+        print(f"   • {o}")
 
 
 if __name__ == "__main__":
-    collector = DataCollector()
-    collector.run()
+    parser = argparse.ArgumentParser(description="Connected Montreal data collector")
+    parser.add_argument("--market", action="append", choices=sorted(markets.MARKETS), metavar="KEY",
+                        help="collect only this market (repeatable; default: every configured market)")
+    parser.add_argument("--profile", nargs="?", const="", metavar="DIR",
+                        help="profile this run; writes .prof + upstream timeline (default dir: ./profiles)")
+    args = parser.parse_args()
+    try:
+        if args.profile is not None:
+            import profiling
+            with profiling.Profile("collector", args.profile or None) as prof:
+                report = collect_markets(args.market)
+            print(f"\n🔬 Profile → {prof.prof_path}\n   Timeline → {prof.timeline_path}")
+        else:
+            report = collect_markets(args.market)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+    print_summary(report)
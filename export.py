@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - streaming bulk export
+Leads (every customer record, No Go included), itinerary events and daily
+traffic aggregates as CSV, NDJSON or Parquet. Rows are streamed as each
+upstream page arrives, so memory stays flat however long the history is.
+Every row carries a `cursor`; passing the last one received as `after`
+restarts an interrupted export right after that row.
+
+    python export.py leads --format csv -o leads.csv
+    python export.py leads --format csv -o leads.csv --resume
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+import markets
+import metrics
+from metrics import upstream_request
+from ratelimit import RateLimiter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+AIRTABLE_TOKEN = os.environ.get("AIRTABLE_TOKEN", "")
+POSTHOG_API_KEY = os.environ.get("POSTHOG_API_KEY", "")
+EVENTS_TABLE = "tblLuq2c0C405bP3g"  # itinerary events (same table as server.EVENTS_TABLE)
+
+EXPORT_SINCE = os.environ.get("EXPORT_SINCE", "2018-01-01")          # first day an Airtable export scans
+EXPORT_RATE_PER_SEC = float(os.environ.get("EXPORT_RATE_PER_SEC", 2))  # leaves the rest of each budget to live traffic
+EXPORT_BATCH = 500              # rows per CSV/NDJSON flush and per Parquet row group
+WINDOW_MAX_RECORDS = 1000       # Airtable records held at once; a busier window is split
+WINDOW_MIN = timedelta(hours=1)
+WINDOW_MAX = timedelta(days=90)
+TRAFFIC_DAYS = 90               # default traffic range
+TRAFFIC_CHUNK_DAYS = 7          # days per PostHog query
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Exports only borrow a slice of each upstream's budget, on top of the
+# market limiter they share with everything else.
+_export_limiters = {}
+_export_limiters_lock = threading.Lock()
+
+
+def _wait(market_key, upstream):
+    with _export_limiters_lock:
+        key = (market_key, upstream)
+        if key not in _export_limiters:
+            _export_limiters[key] = RateLimiter(EXPORT_RATE_PER_SEC)
+        own = _export_limiters[key]
+    own.wait()
+    markets.limiter(market_key, upstream).wait()
+
+
+def _first(val):
+    return (val[0] if val else "") if isinstance(val, list) else val
+
+
+def _iso(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+# ── Airtable sources ─────────────────────────────────────────
+
+def _airtable_window(market, table, fields, start, end, limit=None):
+    """All records created in [start, end), in cursor order; None as soon as
+    more than `limit` have arrived (the caller splits the window)."""
+    formula = f"AND(NOT(IS_BEFORE(CREATED_TIME(),'{_iso(start)}')),IS_BEFORE(CREATED_TIME(),'{_iso(end)}'))"
+    url = f"https://api.airtable.com/v0/{market['airtable_base']}/{table}"
+    headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
+    records, offset = [], None
+    while True:
+        params = [("pageSize", "100"), ("filterByFormula", formula)] + [("fields[]", f) for f in fields]
+        if offset:
+            params.append(("offset", offset))
+        _wait(market["key"], "airtable")
+        r = upstream_request("airtable", "GET", url, target="export", headers=headers, params=params, timeout=30)
+        if not r.ok:
+            raise RuntimeError(f"Airtable returned {r.status_code}")
+        d = r.json()
+        records.extend(d.get("records", []))
+        if limit is not None and len(records) > limit:
+            metrics.inc("cm_export_window_splits_total")
+            return None
+        offset = d.get("offset")
+        if not offset:
+            break
+    return sorted(records, key=lambda rec: (rec.get("createdTime", ""), rec.get("id", "")))
+
+
+def _airtable_records(market, table, fields, after=None):
+    """(cursor, record) pairs by creation time. Records are fetched in
+    creation-time windows (no sort field needed) that widen while sparse, up
+    to WINDOW_MAX, and are split before use once they pass WINDOW_MAX_RECORDS,
+    so at most one bounded window of records is ever held."""
+    if not (AIRTABLE_TOKEN and market["airtable_base"] and table):
+        raise ValueError(f"Airtable is not configured for {market['name']}")
+    after_key = tuple(after.split("|", 1)) if after else None
+    start = (datetime.fromisoformat(after_key[0].replace("Z", "+00:00")) if after_key
+             else datetime.fromisoformat(EXPORT_SINCE).replace(tzinfo=timezone.utc))
+    return _airtable_windows(market, table, fields, after_key, start)
+
+
+def _airtable_windows(market, table, fields, after_key, start):
+    now = datetime.now(timezone.utc)
+    window = timedelta(days=30)
+    while start <= now:
+        end = start + window
+        # At the minimum width the window is taken whole so the export always advances
+        records = _airtable_window(market, table, fields, start, end,
+                                   limit=WINDOW_MAX_RECORDS if window > WINDOW_MIN else None)
+        if records is None:
+            window = max(window / 2, WINDOW_MIN)
+            continue
+        for rec in records:
+            key = (rec.get("createdTime", ""), rec.get("id", ""))
+            if after_key and key <= after_key:
+                continue
+            yield "|".join(key), rec
+        if len(records) < WINDOW_MAX_RECORDS // 4:
+            window = min(window * 2, WINDOW_MAX)
+        start = end
+
+
+LEAD_COLUMNS = [("id", "str"), ("created", "str"), ("status", "str"), ("first_name", "str"),
+                ("last_name", "str"), ("email", "str"), ("phone", "str"), ("source", "str"),
+                ("doa", "str"), ("people", "int"), ("grand_total", "float"), ("contact_type", "str")]
+LEAD_EXPORT_FIELDS = ["Status", "First Name", "Last Name", "Email", "Phone", "Source of lead",
+                      "DOA", "People", "Grand Total", "Contact Type"]
+
+
+def lead_rows(market, after=None, **_):
+    return _lead_rows(_airtable_records(market, market["customers_table"], LEAD_EXPORT_FIELDS, after))
+
+
+def _lead_rows(records):
+    for cursor, rec in records:
+        f = rec.get("fields", {})
+        yield cursor, {
+            "id": rec["id"], "created": rec.get("createdTime", ""), "status": f.get("Status", ""),
+            "first_name": f.get("First Name", ""), "last_name": f.get("Last Name", ""),
+            "email": f.get("Email", ""), "phone": f.get("Phone", ""), "source": f.get("Source of lead", ""),
+            "doa": f.get("DOA", ""), "people": f.get("People"), "grand_total": f.get("Grand Total"),
+            "contact_type": f.get("Contact Type", ""),
+        }
+
+
+ITINERARY_COLUMNS = [("id", "str"), ("created", "str"), ("party_id", "str"), ("day_number", "int"),
+                     ("date", "str"), ("name", "str"), ("type", "str"), ("start_time", "str"),
+                     ("quantity", "float"), ("duration", "str")]
+ITINERARY_EXPORT_FIELDS = ["Party Main Contact", "Day Number", "Date", "Name (from Experience)", "Type",
+                           "Start Time", "Quantity", "Duration"]
+
+
+def itinerary_rows(market, after=None, **_):
+    if market["key"] != markets.DEFAULT_MARKET:
+        raise ValueError("Itineraries are only kept for the default market")
+    return _itinerary_rows(_airtable_records(market, EVENTS_TABLE, ITINERARY_EXPORT_FIELDS, after))
+
+
+def _itinerary_rows(records):
+    for cursor, rec in records:
+        f = rec.get("fields", {})
+        yield cursor, {
+            "id": rec["id"], "created": rec.get("createdTime", ""),
+            "party_id": _first(f.get("Party Main Contact", "")), "day_number": f.get("Day Number"),
+            "date": f.get("Date", ""), "name": _first(f.get("Name (from Experience)", "")),
+            "type": _first(f.get("Type", "")), "start_time": _first(f.get("Start Time", "")),
+            "quantity": _first(f.get("Quantity")), "duration": _first(f.get("Duration", "")),
+        }
+
+
+# ── PostHog source ───────────────────────────────────────────
+
+TRAFFIC_COLUMNS = [("day", "str"), ("page", "str"), ("source", "str"), ("pageviews", "int"), ("visitors", "int")]
+TRAFFIC_QUERY = """
+SELECT toDate(timestamp) AS day, properties.$pathname AS page,
+       coalesce(nullIf(properties.$utm_source, ''), nullIf(properties.$referring_domain, ''), 'direct') AS source,
+       count() AS pageviews, count(DISTINCT distinct_id) AS visitors
+FROM events
+WHERE event = '$pageview' AND timestamp >= toDateTime('{start}') AND timestamp < toDateTime('{end}')
+GROUP BY day, page, source
+ORDER BY day, page, source
+LIMIT 100000
+"""
+
+
+def traffic_rows(market, after=None, since=None, **_):
+    if not (POSTHOG_API_KEY and market["posthog_project"]):
+        raise ValueError(f"PostHog is not configured for {market['name']}")
+    after_key = tuple(after.split("|", 2)) if after else None
+    day = date.fromisoformat(after_key[0]) if after_key else (
+        date.fromisoformat(since) if since else date.today() - timedelta(days=TRAFFIC_DAYS))
+    return _traffic_rows(market, after_key, day)
+
+
+def _traffic_rows(market, after_key, day):
+    """Pageviews and unique visitors per day × page × source, queried a chunk
+    of days at a time and aggregated by PostHog (events never leave it)."""
+    url = f"https://us.posthog.com/api/projects/{market['posthog_project']}/query/"
+    headers = {"Authorization": f"Bearer {POSTHOG_API_KEY}"}
+    while day <= date.today():
+        end = day + timedelta(days=TRAFFIC_CHUNK_DAYS)
+        query = TRAFFIC_QUERY.format(start=f"{day} 00:00:00", end=f"{end} 00:00:00")
+        _wait(market["key"], "posthog")
+        r = upstream_request("posthog", "POST", url, target="query", headers=headers,
+                             json={"query": {"kind": "HogQLQuery", "query": query}}, timeout=60)
+        if not r.ok:
+            raise RuntimeError(f"PostHog returned {r.status_code}")
+        rows = sorted((str(d), p or "/", s) + tuple(rest) for d, p, s, *rest in r.json().get("results", []))
+        for d, page, source, views, visitors in rows:
+            key = (d, page, source)
+            if after_key and key <= after_key:
+                continue
+            yield "|".join(key), {"day": d, "page": page, "source": source,
+                                  "pageviews": views, "visitors": visitors}
+        day = end
+
+
+DATASETS = {
+    "leads": (LEAD_COLUMNS, lead_rows),
+    "itineraries": (ITINERARY_COLUMNS, itinerary_rows),
+    "traffic": (TRAFFIC_COLUMNS, traffic_rows),
+}
+
+
+# ── Writers ──────────────────────────────────────────────────
+
+def _coerce(val, kind):
+    if val in (None, ""):
+        return None
+    try:
+        if kind == "str":
+            return str(val)
+        num = float(str(val).replace(",", "").replace("$", ""))
+        return int(num) if kind == "int" else num
+    except (TypeError, ValueError):
+        return None if kind != "str" else str(val)
+
+
+def _batches(rows, columns):
+    batch = []
+    for cursor, row in rows:
+        batch.append({"cursor": cursor, **{name: _coerce(row.get(name), kind) for name, kind in columns}})
+        if len(batch) >= EXPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_chunks(batches, columns, header):
+    names = ["cursor"] + [name for name, _ in columns]
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=names, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+        yield buf.getvalue().encode()
+    for batch in batches:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(batch)
+        yield buf.getvalue().encode()
+
+
+def _ndjson_chunks(batches):
+    for batch in batches:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch).encode()
+
+
+class _Sink(io.RawIOBase):
+    """Write-only stream the Parquet writer fills; drained after every row group."""
+    def __init__(self):
+        self.chunks, self.pos = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.pos
+
+    def drain(self):
+        out, self.chunks = b"".join(self.chunks), []
+        return out
+
+
+def _parquet_chunks(batches, columns):
+    types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64()}
+    schema = pa.schema([("cursor", pa.string())] + [(name, types[kind]) for name, kind in columns])
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for batch in batches:
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def stream(dataset, fmt="csv", market=None, after=None, since=None, header=True):
+    """The export as an iterator of byte chunks. Bad arguments raise ValueError
+    here, before anything is fetched; upstream failures surface mid-stream."""
+    if dataset not in DATASETS:
+        raise ValueError(f"dataset must be one of {', '.join(DATASETS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    if fmt == "parquet" and pq is None:
+        raise ValueError("Parquet export needs pyarrow (pip install pyarrow)")
+    m = markets.get_market(market)
+    if m is None:
+        raise ValueError(f"Unknown market: {market}")
+    columns, source = DATASETS[dataset]
+
+    def counted(rows):
+        for item in rows:
+            metrics.inc("cm_export_rows_total", dataset=dataset, format=fmt)
+            yield item
+
+    batches = _batches(counted(source(m, after=after, since=since)), columns)
+    if fmt == "csv":
+        return _csv_chunks(batches, columns, header)
+    if fmt == "ndjson":
+        return _ndjson_chunks(batches)
+    return _parquet_chunks(batches, columns)
+
+
+def last_cursor(path, fmt):
+    """Cursor of the last complete row in a CSV/NDJSON export file (for --resume)."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 65536, 0))
+        lines = f.read().decode("utf-8", "replace").splitlines(keepends=True)
+    complete = [l for l in lines if l.endswith("\n") and l.strip()]
+    if not complete:
+        return None
+    last = complete[-1]
+    if fmt == "ndjson":
+        return json.loads(last).get("cursor")
+    row = next(csv.reader([last]))
+    return row[0] if row and row[0] != "cursor" else None
+
+
+metrics.describe("cm_export_rows_total", "Rows streamed by bulk exports")
+metrics.describe("cm_export_window_splits_total", "Airtable export windows abandoned and split for holding too many records")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream leads, itineraries or traffic to CSV/NDJSON/Parquet")
+    parser.add_argument("dataset", choices=sorted(DATASETS))
+    parser.add_argument("--format", choices=sorted(FORMATS), default="csv")
+    parser.add_argument("--market", help="market key (default market if omitted)")
+    parser.add_argument("--after", help="resume after this cursor")
+    parser.add_argument("--since", help="traffic: first day (YYYY-MM-DD)")
+    parser.add_argument("-o", "--output", help="output file (stdout if omitted)")
+    parser.add_argument("--resume", action="store_true", help="append to --output after its last row (CSV/NDJSON)")
+    args = parser.parse_args()
+
+    after, mode = args.after, "wb"
+    if args.resume:
+        if not args.output or args.format == "parquet":
+            parser.error("--resume needs --output and a CSV or NDJSON format")
+        if os.path.exists(args.output):
+            after, mode = last_cursor(args.output, args.format) or after, "ab"
+            # Drop a partial trailing line so the appended rows start clean
+            with open(args.output, "rb+") as f:
+                size = f.seek(0, os.SEEK_END)
+                start = f.seek(max(size - 65536, 0))
+                tail = f.read()
+                if b"\n" in tail:
+                    f.truncate(start + tail.rfind(b"\n") + 1)
+    try:
+        chunks = stream(args.dataset, args.format, args.market, after, args.since, header=mode == "wb")
+    except ValueError as e:
+        parser.error(str(e))
+    out = open(args.output, mode) if args.output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+            out.flush()
+    finally:
+        if args.output:
+            out.close()
+    if args.output:
+        print(f"✅ {args.dataset} → {args.output}" + (f" (resumed after {after})" if after else ""), file=sys.stderr)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - attachment image proxy
+Airtable attachment URLs are signed, expire after a few hours and point at
+the full-size original. Quote pages link to /img/<attachment id>/<width>.<ext>
+instead: the original is fetched once (in the background as soon as a page
+references it) and kept on disk under its attachment ID, and each width is
+resized once into WebP/JPEG. Attachment IDs never change for a given file,
+so responses are cacheable forever.
+"""
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlparse
+
+import metrics
+from metrics import upstream_request
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+IMAGE_DIR = Path(os.environ.get("IMAGE_DIR", Path(__file__).parent / ".images"))
+WIDTHS = (480, 960, 1360)          # quote pages are 680px wide: 1x/2x plus a small-phone size
+FORMATS = {"webp": "image/webp", "jpg": "image/jpeg"}
+QUALITY = {"webp": 80, "jpg": 82}
+MAX_ORIGINAL_BYTES = 25 * 1024 * 1024
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+ATTACHMENT_ID = re.compile(r"^att[A-Za-z0-9]{8,32}$")
+# Attachment downloads only ever go to Airtable's own hosts
+ALLOWED_HOSTS = (".airtable.com", ".airtableusercontent.com")
+
+_index = {"loaded": False, "items": {}}   # attachment id -> {"url", "type", "source"}
+_index_lock = threading.Lock()
+_fetch_locks = {}
+_prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="img-prefetch")
+_resolver = None
+
+
+class AttachmentTooLarge(ValueError):
+    pass
+
+
+def set_resolver(fn):
+    """fn(source, attachment_id) -> fresh attachment dict or None; used when a stored URL has expired."""
+    global _resolver
+    _resolver = fn
+
+
+def _index_path():
+    return IMAGE_DIR / "index.json"
+
+
+def _load_index():
+    if not _index["loaded"]:
+        try:
+            _index["items"] = json.loads(_index_path().read_text())
+        except (OSError, ValueError):
+            _index["items"] = {}
+        _index["loaded"] = True
+
+
+def _save_index():
+    IMAGE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = _index_path().with_suffix(".tmp")
+    tmp.write_text(json.dumps(_index["items"]))
+    os.replace(tmp, _index_path())
+
+
+def _allowed(url):
+    host = urlparse(url).hostname or ""
+    return urlparse(url).scheme == "https" and any(host.endswith(h) or host == h[1:] for h in ALLOWED_HOSTS)
+
+
+def _original_path(att_id):
+    return IMAGE_DIR / att_id / "original"
+
+
+def register(attachment, source=None):
+    """Remember an Airtable attachment (dict with id/url/type) and start caching
+    its original. source identifies where to re-read it from if the URL expires."""
+    att_id, url = attachment.get("id", ""), attachment.get("url", "")
+    if not ATTACHMENT_ID.match(att_id) or not _allowed(url):
+        return False
+    with _index_lock:
+        _load_index()
+        known = _index["items"].get(att_id)
+        if not known or known["url"] != url:
+            _index["items"][att_id] = {"url": url, "type": attachment.get("type", ""), "source": source}
+            _save_index()
+    if not _original_path(att_id).exists():
+        _prefetch_pool.submit(_safe_original, att_id)
+    return True
+
+
+def proxy_url(attachment, width=WIDTHS[-1], fmt="webp", source=None):
+    """Proxy URL for an attachment, or its raw URL if it can't be proxied."""
+    if not register(attachment, source):
+        return attachment.get("url", "")
+    return f"/img/{attachment['id']}/{width}.{fmt}"
+
+
+def srcset(attachment, fmt="webp"):
+    return ", ".join(f"/img/{attachment['id']}/{w}.{fmt} {w}w" for w in WIDTHS)
+
+
+def _download(url):
+    r = upstream_request("airtable_cdn", "GET", url, target="attachment", timeout=30, stream=True)
+    if not r.ok:
+        return None, r.status_code
+    body = BytesIO()
+    for chunk in r.iter_content(64 * 1024):
+        body.write(chunk)
+        if body.tell() > MAX_ORIGINAL_BYTES:
+            raise AttachmentTooLarge(f"attachment over {MAX_ORIGINAL_BYTES} bytes")
+    return body.getvalue(), r.status_code
+
+
+def _lock_for(key):
+    with _index_lock:
+        return _fetch_locks.setdefault(key, threading.Lock())
+
+
+def original(att_id):
+    """Original bytes from disk, downloading them once if needed. None if unknown or gone."""
+    path = _original_path(att_id)
+    if path.exists():
+        return path.read_bytes()
+    with _lock_for(att_id):
+        if path.exists():
+            return path.read_bytes()
+        with _index_lock:
+            _load_index()
+            item = _index["items"].get(att_id)
+        if not item:
+            return None
+        data, status = _download(item["url"])
+        if data is None and status in (400, 401, 403, 404, 410) and _resolver and item.get("source"):
+            # Signed URL expired: re-read the record for a fresh one
+            fresh = _resolver(item["source"], att_id)
+            if fresh and _allowed(fresh.get("url", "")):
+                with _index_lock:
+                    item["url"] = fresh["url"]
+                    _save_index()
+                data, status = _download(fresh["url"])
+        if data is None:
+            return None
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name("original.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        metrics.inc("cm_image_requests_total", result="fetched")
+        return data
+
+
+def _safe_original(att_id):
+    try:
+        original(att_id)
+    except Exception as e:
+        print(f"⚠️  Attachment prefetch failed for {att_id}: {e}")
+
+
+def _resize(data, width, fmt):
+    img = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if fmt == "jpg" or img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    out = BytesIO()
+    if fmt == "webp":
+        img.save(out, "WEBP", quality=QUALITY[fmt], method=4)
+    else:
+        img.save(out, "JPEG", quality=QUALITY[fmt], optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def variant(att_id, width, fmt):
+    """(bytes, mimetype) for one size/format, generated once and then read
+    from disk. Without Pillow the original is served as-is. None if unavailable."""
+    if not ATTACHMENT_ID.match(att_id) or width not in WIDTHS or fmt not in FORMATS:
+        return None
+    if Image is None:
+        data = original(att_id)
+        if data is None:
+            return None
+        with _index_lock:
+            mimetype = _index["items"].get(att_id, {}).get("type") or "application/octet-stream"
+        return data, mimetype
+    path = IMAGE_DIR / att_id / f"{width}.{fmt}"
+    if path.exists():
+        metrics.inc("cm_image_requests_total", result="hit")
+        return path.read_bytes(), FORMATS[fmt]
+    with _lock_for(f"{att_id}/{width}.{fmt}"):
+        if not path.exists():
+            data = original(att_id)
+            if data is None:
+                return None
+            # Per-variant name: 480.webp and 480.jpg are built under different locks
+            tmp = path.with_name(f"{width}.{fmt}.tmp")
+            tmp.write_bytes(_resize(data, width, fmt))
+            os.replace(tmp, path)
+            metrics.inc("cm_image_requests_total", result="generated")
+    return path.read_bytes(), FORMATS[fmt]
+
+
+metrics.describe("cm_image_requests_total", "Attachment image proxy: originals fetched, variants generated, disk hits")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - in-memory lead indexes for /api/leads
+Built once per live-data snapshot: hash indexes for equality filters,
+pre-sorted orderings for range filters, sorting and keyset pagination.
+"""
+
+import base64
+import bisect
+import json
+from datetime import date
+
+SORTABLE = ("created_on", "doa", "people", "first_name", "last_name", "status")
+
+
+def _parse_date(val):
+    try:
+        return date.fromisoformat(str(val)[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_int(val):
+    try:
+        return int(float(val))
+    except (TypeError, ValueError):
+        return None
+
+
+def _sort_value(lead, field):
+    if field == "doa":
+        return _parse_date(lead.get("doa"))
+    if field == "people":
+        return _parse_int(lead.get("people"))
+    v = lead.get(field)
+    return str(v).lower() if v not in (None, "") else None
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    key = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return (key[0], key[1], key[2])
+
+
+class LeadIndex:
+    def __init__(self, leads):
+        self.leads = leads
+        self.by_status = {}
+        self.by_source = {}
+        for pos, lead in enumerate(leads):
+            self.by_status.setdefault(lead.get("status", ""), set()).add(pos)
+            self.by_source.setdefault(lead.get("source", "") or "", set()).add(pos)
+        # Per sortable field: keys sorted ascending as (has_value, value, id) plus aligned positions.
+        # Blanks sort first, and id breaks ties so keyset cursors are unambiguous.
+        self.orders = {}
+        for field in SORTABLE:
+            keyed = []
+            for pos, lead in enumerate(leads):
+                v = _sort_value(lead, field)
+                keyed.append(((0, "", lead.get("id", "")) if v is None else (1, v, lead.get("id", "")), pos))
+            keyed.sort(key=lambda kp: kp[0])
+            self.orders[field] = ([k for k, _ in keyed], [p for _, p in keyed])
+
+    def _range(self, field, lo, hi):
+        """Positions whose field value is within [lo, hi] (either bound optional)."""
+        keys, positions = self.orders[field]
+        start = bisect.bisect_left(keys, (1, lo, "")) if lo is not None else bisect.bisect_left(keys, (1,))
+        end = bisect.bisect_right(keys, (1, hi, "￿")) if hi is not None else len(keys)
+        return set(positions[start:end])
+
+    def query(self, status=None, source=None, doa_from=None, doa_to=None, people_min=None, people_max=None,
+              sort="created_on", descending=False, cursor=None, limit=50):
+        """Return (leads_page, next_cursor, total_matches)."""
+        candidates = None
+
+        def narrow(found):
+            nonlocal candidates
+            candidates = found if candidates is None else candidates & found
+
+        if status:
+            narrow(set().union(*(self.by_status.get(s, set()) for s in status)))
+        if source:
+            narrow(set().union(*(self.by_source.get(s, set()) for s in source)))
+        if doa_from or doa_to:
+            narrow(self._range("doa", _parse_date(doa_from) if doa_from else None,
+                               _parse_date(doa_to) if doa_to else None))
+        if people_min is not None or people_max is not None:
+            narrow(self._range("people", people_min, people_max))
+
+        keys, positions = self.orders[sort]
+        total = len(positions) if candidates is None else len(candidates)
+        if descending:
+            idx = bisect.bisect_left(keys, decode_cursor(cursor)) - 1 if cursor else len(keys) - 1
+            step_range = range(idx, -1, -1)
+        else:
+            idx = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            step_range = range(idx, len(keys))
+
+        page, last_key = [], None
+        for i in step_range:
+            pos = positions[i]
+            if candidates is not None and pos not in candidates:
+                continue
+            if len(page) == limit:
+                return page, encode_cursor(list(last_key)), total
+            page.append(self.leads[pos])
+            last_key = keys[i]
+        return page, None, total
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - lead follow-up scoring
+Scores every active lead from days since last contact, days until arrival,
+party size, source and status, and returns a ranked follow-up work queue.
+Inputs are extracted per lead in Python (date parsing, cached per distinct
+date); the scoring arithmetic then runs as one NumPy pass over the columns.
+"""
+
+import math
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+import numpy as np
+
+# Relative value of a lead by where it came from (lower-cased substring match)
+SOURCE_WEIGHTS = {"referral": 1.1, "repeat": 1.1, "google": 1.0, "instagram": 0.9, "facebook": 0.9, "tiktok": 0.85}
+DEFAULT_SOURCE_WEIGHT = 0.8
+# New requests need a first reply fastest; booked parties rarely need chasing
+STATUS_WEIGHTS = {"New Request": 1.2, "talked to/ quoted": 1.0, "Booked - Deposit": 0.3, "Booked": 0.2}
+
+OVERDUE_DAYS = 14        # matches the analyzer's "C tier"
+ARRIVAL_HORIZON = 30.0   # days; urgency decays with this time constant
+MAX_PARTY = 20
+
+_ISO = re.compile(r"^\d{4}-\d{2}-\d{2}")
+_US = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})")
+
+
+def _iso_day(val):
+    """'2026-08-07…' or '8/7/2026' → '2026-08-07'; anything else (e.g. 'Unknown') → None."""
+    if isinstance(val, (int, float)) and val > 1e11:  # ms epoch (SMS store)
+        return datetime.fromtimestamp(val / 1000).date().isoformat()
+    s = str(val or "").strip()
+    if _ISO.match(s):
+        return s[:10]
+    m = _US.match(s)
+    if m:
+        return f"{m.group(3)}-{int(m.group(1)):02d}-{int(m.group(2)):02d}"
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _ordinal(iso_day):
+    # Leads share a small set of distinct dates; parse each once
+    try:
+        return date.fromisoformat(iso_day).toordinal()
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def _source_weight(source):
+    s = source.lower()
+    for key, w in SOURCE_WEIGHTS.items():
+        if key in s:
+            return w
+    return DEFAULT_SOURCE_WEIGHT
+
+
+def _people(val):
+    try:
+        return max(float(val), 0.0)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def _columns(leads, today):
+    """Per-lead inputs as plain lists; dates as day offsets from today (None = unknown)."""
+    base = today.toordinal()
+
+    def offset(val):
+        d = _iso_day(val)
+        o = _ordinal(d) if d else None
+        return None if o is None else o - base
+
+    since, until, people, src_w, status_w = [], [], [], [], []
+    for lead in leads:
+        contacted = offset(lead.get("last_contact"))
+        if contacted is None:
+            contacted = offset(lead.get("created_on"))
+        since.append(None if contacted is None else -contacted)
+        until.append(offset(lead.get("doa")))
+        people.append(_people(lead.get("people")))
+        src_w.append(_source_weight(str(lead.get("source") or "")))
+        status_w.append(STATUS_WEIGHTS.get(lead.get("status"), 0.8))
+    return since, until, people, src_w, status_w
+
+
+def _score(since, until, people, src_w, status_w):
+    nan = float("nan")
+    since = np.array([nan if v is None else v for v in since], dtype=float)
+    until = np.array([nan if v is None else v for v in until], dtype=float)
+    people = np.array(people, dtype=float)
+    # Never contacted / unknown → treat as fully overdue
+    staleness = np.where(np.isnan(since), 1.0, np.clip(since / OVERDUE_DAYS, 0.0, 1.0))
+    # Closer arrival → more urgent; past arrival → nothing left to sell; unknown → neutral
+    urgency = np.where(np.isnan(until), 0.3,
+                       np.where(until < 0, 0.0, np.exp(-np.clip(until, 0, None) / ARRIVAL_HORIZON)))
+    size = np.where(np.isnan(people), 0.3, np.clip(np.log1p(people) / math.log1p(MAX_PARTY), 0.0, 1.0))
+    score = 100.0 * np.array(status_w) * np.array(src_w) * (0.4 * staleness + 0.35 * urgency + 0.25 * size)
+    return score.round(2).tolist()
+
+
+def tier(days_since):
+    if days_since is None or days_since > OVERDUE_DAYS:
+        return "C"
+    return "A" if days_since < 7 else "B"
+
+
+def score_leads(leads, today=None):
+    """Return leads ranked by follow-up priority (highest first), each annotated with
+    score, tier, days_since_contact and days_until_arrival."""
+    if not leads:
+        return []
+    today = today or date.today()
+    since, until, people, src_w, status_w = _columns(leads, today)
+    scores = _score(since, until, people, src_w, status_w)
+    ranked = []
+    for lead, score, s, u in zip(leads, scores, since, until):
+        ranked.append({**lead, "score": score, "tier": tier(s),
+                       "days_since_contact": s, "days_until_arrival": u})
+    ranked.sort(key=lambda l: l["score"], reverse=True)
+    return ranked
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - market registry
+Every city the business runs in has its own PostHog project and Airtable
+base/customers table. MARKETS lists the enabled keys (default "montreal,austin");
+each key is configured with <KEY>_POSTHOG_PROJECT, <KEY>_AIRTABLE_BASE,
+<KEY>_AIRTABLE_TABLE and <KEY>_CITY. Montreal falls back to the original
+POSTHOG_PROJECT / AIRTABLE_BASE / AIRTABLE_TABLE variables.
+"""
+
+import os
+import threading
+
+from ratelimit import RateLimiter
+
+DEFAULT_MARKET = "montreal"
+
+# Known markets; env vars fill in or override any of these
+BUILTIN_MARKETS = {
+    "montreal": {
+        "name": "Montreal",
+        "city": "Montreal, QC",
+        "posthog_project": os.environ.get("POSTHOG_PROJECT", "259946"),
+        "airtable_base": os.environ.get("AIRTABLE_BASE", "appHT9Re4l53GO16t"),
+        "customers_table": os.environ.get("AIRTABLE_TABLE", "tbl4P7tqdonXv5vcY"),
+    },
+    "austin": {
+        "name": "Austin",
+        "city": "Austin, TX",
+    },
+}
+
+# Per-market request budgets. Airtable allows 5 requests/s per base.
+AIRTABLE_RATE_PER_SEC = float(os.environ.get("AIRTABLE_RATE_PER_SEC", 5))
+POSTHOG_RATE_PER_SEC = float(os.environ.get("POSTHOG_RATE_PER_SEC", 4))
+
+
+def _load():
+    markets = {}
+    keys = [k.strip().lower() for k in os.environ.get("MARKETS", "montreal,austin").split(",") if k.strip()]
+    for key in keys:
+        env = key.upper()
+        market = {"key": key, "name": key.title(), "city": "",
+                  "posthog_project": "", "airtable_base": "", "customers_table": "",
+                  **BUILTIN_MARKETS.get(key, {})}
+        for field, var in (("name", "NAME"), ("city", "CITY"), ("posthog_project", "POSTHOG_PROJECT"),
+                           ("airtable_base", "AIRTABLE_BASE"), ("customers_table", "AIRTABLE_TABLE")):
+            market[field] = os.environ.get(f"{env}_{var}", market[field])
+        markets[key] = market
+    return markets
+
+
+MARKETS = _load()
+
+
+def configured(market):
+    """A market can be collected once it has at least one data source."""
+    return bool(market.get("posthog_project") or (market.get("airtable_base") and market.get("customers_table")))
+
+
+def active_markets():
+    return [m for m in MARKETS.values() if configured(m)]
+
+
+def get_market(key=None):
+    """Market dict for key (default market when key is empty); None if unknown."""
+    return MARKETS.get((key or DEFAULT_MARKET).lower())
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter(market_key, upstream):
+    """Shared RateLimiter for one market's calls to one upstream ("airtable"/"posthog")."""
+    with _limiters_lock:
+        key = (market_key, upstream)
+        if key not in _limiters:
+            rate = AIRTABLE_RATE_PER_SEC if upstream == "airtable" else POSTHOG_RATE_PER_SEC
+            _limiters[key] = RateLimiter(rate)
+        return _limiters[key]
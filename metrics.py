@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - lightweight in-process metrics
+Counters and histograms kept in plain dicts behind one lock, rendered in
+Prometheus text format by server.py's /metrics route.
+"""
+
+import bisect
+import threading
+import time
+
+import requests
+
+# Seconds — covers fast cache hits up to the 90s Ollama timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 90)
+
+_lock = threading.Lock()
+_counters = {}     # name -> {labels_tuple: value}
+_histograms = {}   # name -> {labels_tuple: [bucket_counts, sum, count]}
+_gauges = {}       # name -> callable returning {labels_tuple: value}
+_help = {}
+_buckets = {}
+
+# Callbacks invoked after every upstream call: fn(upstream, target, method, url, status, start, elapsed)
+_call_listeners = []
+# Checks run before every upstream call: fn(upstream, target, method, url); raise to refuse the call
+_call_guards = []
+
+
+def _key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def describe(name, text, buckets=None):
+    _help[name] = text
+    if buckets:
+        _buckets[name] = tuple(buckets)
+
+
+def inc(name, amount=1, **labels):
+    k = _key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[k] = series.get(k, 0) + amount
+
+
+def observe(name, value, **labels):
+    k = _key(labels)
+    buckets = _buckets.get(name, DEFAULT_BUCKETS)
+    idx = bisect.bisect_left(buckets, value)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        h = series.get(k)
+        if h is None:
+            h = series[k] = [[0] * len(buckets), 0.0, 0]
+        if idx < len(buckets):
+            h[0][idx] += 1
+        h[1] += value
+        h[2] += 1
+
+
+def gauge(name, fn, text=""):
+    """Register a gauge computed at scrape time. fn() -> {labels_tuple: value}."""
+    _gauges[name] = fn
+    if text:
+        _help[name] = text
+
+
+def counter_value(name, **labels):
+    with _lock:
+        return _counters.get(name, {}).get(_key(labels), 0)
+
+
+class timer:
+    """Context manager recording elapsed seconds into a histogram."""
+    def __init__(self, name, **labels):
+        self.name, self.labels = name, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def upstream_request(upstream, method, url, target="", **kwargs):
+    """requests.request() wrapper that records count, latency and status per upstream.
+    Exceptions are counted with status="error" and re-raised unchanged."""
+    for guard in _call_guards:
+        guard(upstream, target, method, url)
+    start = time.perf_counter()
+    status = "error"
+    try:
+        r = requests.request(method, url, **kwargs)
+        status = str(r.status_code)
+        return r
+    finally:
+        elapsed = time.perf_counter() - start
+        inc("cm_upstream_requests_total", upstream=upstream, target=target, status=status)
+        observe("cm_upstream_request_seconds", elapsed, upstream=upstream, target=target)
+        for listener in _call_listeners:
+            try:
+                listener(upstream, target, method, url, status, start, elapsed)
+            except Exception:
+                pass
+
+
+def _fmt_labels(k, extra=None):
+    items = list(k) + (list(extra) if extra else [])
+    if not items:
+        return ""
+    parts = []
+    for lk, lv in items:
+        lv = str(lv).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{lk}="{lv}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _fmt_num(v):
+    if isinstance(v, float):
+        if v == float("inf"):
+            return "+Inf"
+        return repr(round(v, 6))
+    return str(v)
+
+
+def render():
+    """Return every metric in Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        counters = {n: dict(s) for n, s in _counters.items()}
+        histograms = {n: {k: [list(h[0]), h[1], h[2]] for k, h in s.items()} for n, s in _histograms.items()}
+    out = []
+    for name in sorted(counters):
+        if name in _help:
+            out.append(f"# HELP {name} {_help[name]}")
+        out.append(f"# TYPE {name} counter")
+        for k, v in sorted(counters[name].items()):
+            out.append(f"{name}{_fmt_labels(k)} {_fmt_num(v)}")
+    for name in sorted(histograms):
+        buckets = _buckets.get(name, DEFAULT_BUCKETS)
+        if name in _help:
+            out.append(f"# HELP {name} {_help[name]}")
+        out.append(f"# TYPE {name} histogram")
+        for k, (counts, total, count) in sorted(histograms[name].items()):
+            cumulative = 0
+            for le, c in zip(buckets, counts):
+                cumulative += c
+                out.append(f"{name}_bucket{_fmt_labels(k, [('le', _fmt_num(float(le)))])} {cumulative}")
+            out.append(f"{name}_bucket{_fmt_labels(k, [('le', '+Inf')])} {count}")
+            out.append(f"{name}_sum{_fmt_labels(k)} {_fmt_num(total)}")
+            out.append(f"{name}_count{_fmt_labels(k)} {count}")
+    for name in sorted(_gauges):
+        try:
+            series = _gauges[name]()
+        except Exception:
+            continue
+        if name in _help:
+            out.append(f"# HELP {name} {_help[name]}")
+        out.append(f"# TYPE {name} gauge")
+        for k, v in sorted(series.items()):
+            out.append(f"{name}{_fmt_labels(k)} {_fmt_num(v)}")
+    return "\n".join(out) + "\n"
+
+
+describe("cm_http_request_seconds", "Flask route latency in seconds")
+describe("cm_upstream_request_seconds", "Upstream call latency in seconds")
+describe("cm_upstream_requests_total", "Upstream calls by upstream, target and HTTP status")
+describe("cm_cache_requests_total", "Cache lookups by cache and result (hit/miss)")
+describe("cm_cache_refresh_seconds", "Time spent rebuilding a cache")
+describe("cm_http_requests_total", "Flask responses by route, method and status")
+describe("cm_airtable_pages_total", "Airtable list pages fetched")
+describe("cm_webhook_notifications_total", "Airtable webhook notifications by outcome")
+describe("cm_sms_bulk_messages_total", "Bulk SMS messages by final status")
+describe("cm_webhook_records_total", "Records evicted or patched from webhook payloads")
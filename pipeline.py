@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - collect → analyze pipeline
+Runs the collector and analyzer in-process as a small dependency graph on a
+schedule. A step is skipped when the fingerprint of its inputs matches its
+last run, and every step's latest output stays in memory (the server serves
+proposals from it). `python pipeline.py` runs the same pipeline as a daemon.
+"""
+
+import argparse
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+PIPELINE_INTERVAL = int(os.environ.get("PIPELINE_INTERVAL", 3600))  # seconds; 0 disables the server's scheduler
+
+
+def fingerprint(value):
+    """Stable hash of a step's inputs; run timestamps are ignored so identical data matches."""
+    if isinstance(value, dict):
+        value = {k: v for k, v in value.items() if k != "generated_at"}
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class Step:
+    """One node: fn(**{dep: dep_output}) -> output. `key` adds extra fingerprint
+    material (e.g. today's date for date-relative scoring). An `always` step runs
+    on every pass because it does its own incremental work."""
+    def __init__(self, name, fn, deps=(), key=None, always=False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.key = key
+        self.always = always
+
+
+class Pipeline:
+    def __init__(self, steps):
+        self.steps = self._ordered(steps)
+        self.outputs = {}
+        self.fingerprints = {}
+        self.status = {s.name: {"status": "pending", "runs": 0, "skips": 0} for s in self.steps}
+        self._lock = threading.Lock()   # one run at a time
+
+    @staticmethod
+    def _ordered(steps):
+        """Topological order; raises ValueError on unknown deps or cycles."""
+        by_name = {s.name: s for s in steps}
+        ordered, state = [], {}
+
+        def visit(step):
+            if state.get(step.name) == "done":
+                return
+            if state.get(step.name) == "visiting":
+                raise ValueError(f"Pipeline cycle at {step.name}")
+            state[step.name] = "visiting"
+            for dep in step.deps:
+                if dep not in by_name:
+                    raise ValueError(f"{step.name} depends on unknown step {dep}")
+                visit(by_name[dep])
+            state[step.name] = "done"
+            ordered.append(step)
+
+        for s in steps:
+            visit(s)
+        return ordered
+
+    def run(self):
+        """Run every step in order; returns {step: "ran"|"skipped"|"failed"}."""
+        result = {}
+        with self._lock:
+            for step in self.steps:
+                if any(result.get(d) == "failed" for d in step.deps):
+                    result[step.name] = "failed"
+                    self.status[step.name].update(status="blocked")
+                    continue
+                inputs = {d: self.outputs[d] for d in step.deps}
+                fp = None
+                if step.deps:
+                    fp = fingerprint({"inputs": {d: fingerprint(v) for d, v in inputs.items()},
+                                      "key": step.key() if step.key else None})
+                st = self.status[step.name]
+                if (not step.always and fp is not None and fp == self.fingerprints.get(step.name)
+                        and step.name in self.outputs):
+                    result[step.name] = "skipped"
+                    st.update(status="skipped", skips=st["skips"] + 1, checked_at=time.time())
+                    metrics.inc("cm_pipeline_steps_total", step=step.name, result="skipped")
+                    continue
+                st.update(status="running", started_at=time.time())
+                start = time.perf_counter()
+                try:
+                    self.outputs[step.name] = step.fn(**inputs)
+                except Exception as e:
+                    result[step.name] = "failed"
+                    st.update(status="failed", error=str(e), seconds=round(time.perf_counter() - start, 3))
+                    metrics.inc("cm_pipeline_steps_total", step=step.name, result="failed")
+                    print(f"⚠️  Pipeline step {step.name} failed: {e}")
+                    continue
+                self.fingerprints[step.name] = fp
+                result[step.name] = "ran"
+                st.pop("error", None)
+                st.update(status="done", runs=st["runs"] + 1, finished_at=time.time(),
+                          seconds=round(time.perf_counter() - start, 3))
+                metrics.inc("cm_pipeline_steps_total", step=step.name, result="ran")
+        return result
+
+
+class Scheduler:
+    """Runs a pipeline every `interval` seconds on a daemon thread; run_now() wakes it early."""
+    def __init__(self, pipeline, interval=PIPELINE_INTERVAL):
+        self.pipeline = pipeline
+        self.interval = interval
+        self.last_run = None
+        self.last_result = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _loop(self):
+        while True:
+            self.tick()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def tick(self):
+        self.last_result = self.pipeline.run()
+        self.last_run = time.time()
+        return self.last_result
+
+    def start(self):
+        if self._thread is None:
+            ctx = contextvars.copy_context()
+            self._thread = threading.Thread(target=ctx.run, args=(self._loop,), name="pipeline", daemon=True)
+            self._thread.start()
+
+    def run_now(self):
+        """Run as soon as possible: wake the loop, or run once on a side thread if not started."""
+        if self._thread is not None:
+            self._wake.set()
+        else:
+            ctx = contextvars.copy_context()
+            threading.Thread(target=ctx.run, args=(self.tick,), name="pipeline-once", daemon=True).start()
+
+    def state(self):
+        return {"interval": self.interval, "running": self._thread is not None,
+                "last_run": self.last_run, "last_result": self.last_result,
+                "steps": self.pipeline.status}
+
+
+def marketing_pipeline(market_keys=None, write_files=False, consumer="server"):
+    """collect (all markets) → analyze. With write_files the CLI's report and
+    proposals.json files are written too, for tools that still read them.
+    consumer names the analyzer state file, so each caller's delta is its own."""
+    import analyzer
+    import collector
+
+    def collect():
+        return collector.collect_markets(market_keys, write=write_files)
+
+    def analyze(collect):
+        proposals = analyzer.build_proposals(collect, analyzer.state_path(consumer))
+        if write_files:
+            analyzer.save_proposals(proposals)
+        return proposals
+
+    return Pipeline([
+        Step("collect", collect),
+        # Runs every pass: the analyzer skips unchanged rules itself, and a
+        # reused output would re-serve the previous run's delta
+        Step("analyze", analyze, deps=["collect"], always=True),
+    ])
+
+
+metrics.describe("cm_pipeline_steps_total", "Pipeline step executions by result (ran/skipped/failed)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run collector → analyzer on a schedule")
+    parser.add_argument("--interval", type=int, default=PIPELINE_INTERVAL or 3600, help="seconds between runs")
+    parser.add_argument("--once", action="store_true", help="run once and exit")
+    parser.add_argument("--market", action="append", metavar="KEY", help="collect only this market (repeatable)")
+    args = parser.parse_args()
+    pipe = marketing_pipeline(args.market, write_files=True, consumer="pipeline")
+    while True:
+        started = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"🔁 [{started}] pipeline: {pipe.run()}")
+        if args.once:
+            break
+        time.sleep(args.interval)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - local quote pricing
+Recomputes a quote's totals after an edit without waiting for Airtable's
+formula fields. The starting point is always Airtable's own last values
+for the record, and an edit is applied as a delta:
+
+- an itinerary event's line total scales with its quantity × duration
+- "per person" events without a manual quantity scale with People
+- GST/QST/card-fee rates are read back from the record's own totals
+  (defaults below when a total is missing)
+- the service total, grand total and per-person amounts are derived from
+  those
+
+Airtable's recomputed values confirm the result afterwards; compare()
+reports any field that differs by more than a cent.
+"""
+
+import os
+
+# Service line total on an itinerary event row. Rows without it can't be
+# scaled locally: recompute() then reports exact=False and the quote page
+# waits for Airtable's figures instead of showing the old ones.
+EVENT_TOTAL_FIELD = os.environ.get("PRICING_EVENT_TOTAL_FIELD", "Total Price")
+DEFAULT_RATES = {"hst": 0.05, "qst": 0.09975, "cc_fee": 0.0}
+PER_PERSON_TYPES = {"per person", "person", "people", "pp"}
+TOLERANCE = 0.015
+
+# Pricing block key -> client record field
+FIELDS = {
+    "service_subtotal": "Subtotal",
+    "service_hst": "HST",
+    "service_qst": "QST",
+    "service_cc_fee": "Credit Card Fee",
+    "service_total": "Service Total",
+    "service_pp": "Service Total Per Person",
+    "accom_total": "Accommodation Total",
+    "accom_pp": "Accommodation per Person",
+    "grand_total": "Grand Total",
+    "per_person": "Total Per Person",
+}
+
+
+def money(val):
+    if isinstance(val, list):
+        val = val[0] if val else None
+    if val in (None, ""):
+        return None
+    try:
+        return float(str(val).replace(",", "").replace("$", ""))
+    except ValueError:
+        return None
+
+
+def from_airtable(fields):
+    """The pricing block as Airtable currently computes it."""
+    return {key: money(fields.get(field)) for key, field in FIELDS.items()}
+
+
+def rates(fields):
+    """Tax and card-fee rates implied by the record's own totals."""
+    subtotal = money(fields.get("Subtotal"))
+    hst, qst, cc = (money(fields.get(f)) for f in ("HST", "QST", "Credit Card Fee"))
+    out = dict(DEFAULT_RATES)
+    if subtotal:
+        if hst is not None:
+            out["hst"] = hst / subtotal
+        if qst is not None:
+            out["qst"] = qst / subtotal
+        if cc is not None:
+            out["cc_fee"] = cc / (subtotal + (hst or 0) + (qst or 0))
+    return out
+
+
+def _qty(ev, manual, computed):
+    return money(ev.get(manual)) or money(ev.get(computed))
+
+
+def event_terms(ev):
+    """(unit price, quantity, duration factor) for an event row, or None
+    when the row has no line total to scale."""
+    line = money(ev.get(EVENT_TOTAL_FIELD))
+    if line is None:
+        return None
+    qty = _qty(ev, "Manu Quantity", "Quantity") or 1
+    dur = _qty(ev, "Manual Duration", "Duration") or 1
+    return line / (qty * dur), qty, dur
+
+
+def _per_person(ev):
+    qtype = ev.get("Quantity Type")
+    qtype = (qtype[0] if isinstance(qtype, list) and qtype else qtype) or ""
+    return str(qtype).strip().lower() in PER_PERSON_TYPES and not money(ev.get("Manu Quantity"))
+
+
+def recompute(fields, events=(), people=None, event_id=None, quantity=None, duration=None):
+    """Pricing block after an edit: People -> `people`, and/or one event's
+    quantity/duration. `events` are the quote's event rows (with "_record_id").
+    Returns (block, exact): exact is False when some change couldn't be priced
+    locally and the affected amounts are Airtable's previous values."""
+    block = from_airtable(fields)
+    subtotal = block["service_subtotal"] or 0.0
+    old_people = money(fields.get("People")) or 0
+    new_people = people or old_people
+    exact = True
+    for ev in events:
+        terms = event_terms(ev)
+        if ev.get("_record_id") == event_id and (quantity is not None or duration is not None):
+            if terms is None:
+                exact = False
+                continue
+            unit, qty, dur = terms
+            new_qty = quantity if quantity is not None else qty
+            new_dur = duration if duration is not None else dur
+            subtotal += unit * (new_qty * new_dur - qty * dur)
+        elif people and people != old_people and _per_person(ev):
+            if terms is None:
+                exact = False
+                continue
+            unit, qty, dur = terms
+            subtotal += unit * (new_people - qty) * dur
+
+    r = rates(fields)
+    hst = subtotal * r["hst"]
+    qst = subtotal * r["qst"]
+    cc_fee = (subtotal + hst + qst) * r["cc_fee"]
+    service_total = subtotal + hst + qst + cc_fee
+    accom_total = block["accom_total"] or 0.0
+    grand_total = service_total + accom_total
+    per = (lambda v: v / new_people) if new_people else (lambda v: None)
+    block.update({
+        "service_subtotal": subtotal, "service_hst": hst, "service_qst": qst, "service_cc_fee": cc_fee,
+        "service_total": service_total, "service_pp": per(service_total),
+        "accom_pp": per(accom_total) if block["accom_total"] is not None else block["accom_pp"],
+        "grand_total": grand_total, "per_person": per(grand_total),
+    })
+    return {k: (round(v, 2) if v is not None else None) for k, v in block.items()}, exact
+
+
+def compare(local, airtable):
+    """{key: (local, airtable)} for every amount that disagrees by more than a cent."""
+    return {k: (local[k], airtable.get(k)) for k in local
+            if local[k] is not None and airtable.get(k) is not None and abs(local[k] - airtable[k]) > TOLERANCE}
+
+
+def apply_edit(fields, events, block, people=None, event_id=None, quantity=None, duration=None):
+    """Client fields and event rows as Airtable will hold them after the edit,
+    so a second edit made before Airtable confirms the first builds on it."""
+    fields = {**fields, **{FIELDS[k]: v for k, v in block.items() if v is not None}}
+    if people:
+        fields["People"] = people
+    updated = []
+    for ev in events:
+        terms = event_terms(ev)
+        if ev.get("_record_id") == event_id:
+            ev = dict(ev)
+            if quantity is not None:
+                ev["Manu Quantity"] = quantity
+            if duration is not None:
+                ev["Manual Duration"] = duration
+        elif people and _per_person(ev):
+            ev = {**ev, "Quantity": people}
+        else:
+            updated.append(ev)
+            continue
+        if terms:
+            ev[EVENT_TOTAL_FIELD] = terms[0] * (_qty(ev, "Manu Quantity", "Quantity") or 1) \
+                * (_qty(ev, "Manual Duration", "Duration") or 1)
+        updated.append(ev)
+    return fields, updated
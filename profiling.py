@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - opt-in profiling
+Wraps a single request or CLI run in cProfile and writes a pstats file
+(open with snakeviz, or `flameprof`/`gprof2dot` for a flamegraph) plus a
+JSON timeline of every upstream call made while profiling.
+"""
+
+import contextvars
+import cProfile
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", Path(__file__).parent / "profiles"))
+
+# ContextVar rather than thread-local so worker threads started with
+# contextvars.copy_context() still report into the request's timeline
+_active = contextvars.ContextVar("profiling_active", default=None)
+
+
+def _record_call(upstream, target, method, url, status, start, elapsed):
+    prof = _active.get()
+    if prof is None:
+        return
+    prof.timeline.append({
+        "upstream": upstream,
+        "target": target,
+        "method": method,
+        "url": url.split("?", 1)[0],
+        "status": status,
+        "offset_ms": round((start - prof.started) * 1000, 2),
+        "duration_ms": round(elapsed * 1000, 2),
+    })
+
+
+metrics._call_listeners.append(_record_call)
+
+
+class Profile:
+    """Context manager: profile the enclosed block on the current thread.
+
+    On exit writes <label>-<timestamp>.prof and a matching .timeline.json
+    into out_dir and exposes their paths as .prof_path / .timeline_path."""
+
+    def __init__(self, label, out_dir=None):
+        self.label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label).strip("_") or "run"
+        self.out_dir = Path(out_dir or PROFILE_DIR)
+        self.timeline = []
+        self.prof_path = self.timeline_path = None
+
+    def __enter__(self):
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self._token = _active.set(self)
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        _active.reset(self._token)
+        total = time.perf_counter() - self.started
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"{self.label}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        self.prof_path = self.out_dir / f"{stem}.prof"
+        self.timeline_path = self.out_dir / f"{stem}.timeline.json"
+        self.profiler.dump_stats(str(self.prof_path))
+        upstream_ms = sum(c["duration_ms"] for c in self.timeline)
+        self.timeline_path.write_text(json.dumps({
+            "label": self.label,
+            "total_ms": round(total * 1000, 2),
+            "upstream_ms": round(upstream_ms, 2),
+            "upstream_calls": self.timeline,
+        }, indent=2))
+        return False
+
+
+def list_profiles(out_dir=None):
+    out_dir = Path(out_dir or PROFILE_DIR)
+    if not out_dir.exists():
+        return []
+    files = sorted(out_dir.glob("*.prof"), key=lambda p: p.stat().st_mtime, reverse=True)
+    return [{"name": p.name, "timeline": p.name[:-len(".prof")] + ".timeline.json",
+             "size": p.stat().st_size, "modified": datetime.fromtimestamp(p.stat().st_mtime).isoformat()}
+            for p in files]
@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - shared rate limiting
+Thread-safe pacing for outbound calls (SMS sends, per-market PostHog and
+Airtable requests) so concurrent workers stay inside upstream limits.
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_at = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            at = max(now, self.next_at)
+            self.next_at = at + self.interval
+        if at > now:
+            time.sleep(at - now)
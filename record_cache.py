@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - two-tier read-through cache for Airtable records
+Tier 1 is an in-process LRU bounded by approximate JSON size; tier 2 is a
+SQLite file so warm records survive restarts. Entries are keyed by
+(base, table, record_id, field set) and expire per table.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class RecordCache:
+    def __init__(self, path, ttls, default_ttl=300, max_bytes=32 * 1024 * 1024, max_disk_rows=20000,
+                 max_stale=7 * 86400, on_stale=None):
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        # Expired entries are kept this long as a fallback for when the loader fails
+        self.max_stale = max_stale
+        self.on_stale = on_stale
+        self.max_bytes = max_bytes
+        self.max_disk_rows = max_disk_rows
+        self._mem = OrderedDict()   # key -> (ts, fields, size)
+        self._mem_bytes = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._db = None
+        try:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS records (
+                key TEXT PRIMARY KEY, tbl TEXT, record_id TEXT, ts REAL, body TEXT)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS records_by_id ON records (tbl, record_id)")
+            self._db.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️  Record cache disk tier disabled: {e}")
+            self._db = None
+
+    @staticmethod
+    def make_key(base, table, record_id, fields=None):
+        field_set = ",".join(sorted(fields)) if fields else "*"
+        return f"{base}|{table}|{record_id}|{field_set}"
+
+    def ttl(self, table):
+        return self.ttls.get(table, self.default_ttl)
+
+    def get(self, base, table, record_id, fields=None, loader=None):
+        """Return cached fields, or call loader() on a miss and cache its (non-None) result.
+        If loader() raises, an expired copy is returned instead (and on_stale is called);
+        with no copy to fall back on the exception propagates."""
+        key = self.make_key(base, table, record_id, fields)
+        now = time.time()
+        ttl = self.ttl(table)
+        expired = None
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry and now - entry[0] < ttl:
+                self._mem.move_to_end(key)
+                metrics.inc("cm_cache_requests_total", cache="records", result="hit")
+                return entry[1]
+            if entry:
+                expired = entry[1]
+            row = None
+            if self._db is not None:
+                try:
+                    row = self._db.execute("SELECT ts, body FROM records WHERE key = ?", (key,)).fetchone()
+                except sqlite3.Error:
+                    row = None
+            if row and now - row[0] < ttl:
+                fields_val = json.loads(row[1])
+                self._put_mem(key, row[0], fields_val, len(row[1]))
+                metrics.inc("cm_cache_requests_total", cache="records", result="hit")
+                metrics.inc("cm_record_cache_disk_hits_total", table=table)
+                return fields_val
+            if row and expired is None:
+                expired = json.loads(row[1])
+        metrics.inc("cm_cache_requests_total", cache="records", result="miss")
+        if loader is None:
+            return None
+        try:
+            value = loader()
+        except Exception:
+            if expired is None:
+                raise
+            metrics.inc("cm_cache_requests_total", cache="records", result="stale")
+            if self.on_stale:
+                self.on_stale(table, record_id)
+            return expired
+        if value is not None:
+            self.put(base, table, record_id, value, fields)
+        return value
+
+    def put(self, base, table, record_id, value, fields=None):
+        key = self.make_key(base, table, record_id, fields)
+        body = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._put_mem(key, now, value, len(body))
+            if self._db is not None:
+                try:
+                    self._db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                                     (key, table, record_id, now, body))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+            self._puts += 1
+            due = self._puts % 500 == 0
+        if due:
+            self.prune()
+
+    def invalidate(self, table, record_id):
+        """Drop every field-set variant of one record from both tiers."""
+        prefix_tail = f"|{table}|{record_id}|"
+        with self._lock:
+            for key in [k for k in self._mem if prefix_tail in k]:
+                self._mem_bytes -= self._mem.pop(key)[2]
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM records WHERE tbl = ? AND record_id = ?", (table, record_id))
+                    self._db.commit()
+                except sqlite3.Error:
+                    pass
+
+    def prune(self):
+        """Drop disk rows past their TTL plus max_stale and cap the file at max_disk_rows (oldest first)."""
+        if self._db is None:
+            return
+        oldest_allowed = time.time() - max([self.default_ttl, *self.ttls.values()]) - self.max_stale
+        with self._lock:
+            try:
+                self._db.execute("DELETE FROM records WHERE ts < ?", (oldest_allowed,))
+                self._db.execute("""DELETE FROM records WHERE key IN (
+                    SELECT key FROM records ORDER BY ts DESC LIMIT -1 OFFSET ?)""", (self.max_disk_rows,))
+                self._db.commit()
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {"memory_entries": len(self._mem), "memory_bytes": self._mem_bytes}
+
+    def _put_mem(self, key, ts, value, size):
+        old = self._mem.pop(key, None)
+        if old:
+            self._mem_bytes -= old[2]
+        self._mem[key] = (ts, value, size)
+        self._mem_bytes += size
+        while self._mem_bytes > self.max_bytes and len(self._mem) > 1:
+            _, evicted = self._mem.popitem(last=False)
+            self._mem_bytes -= evicted[2]
+
+
+metrics.describe("cm_record_cache_disk_hits_total", "Record cache hits served from the on-disk tier")
@@ -1,8 +1,18 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, send_file, session, redirect, url_for, make_response, render_template
+from flask import Flask, request, jsonify, send_file, session, redirect, url_for, make_response, render_template, g, send_from_directory
 from flask_cors import CORS
-import requests, json, os, time, uuid, hashlib
+import requests, json, os, re, time, uuid, hashlib, hmac, base64, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
+import metrics, profiling, assets, pipeline, breaker, attribution, export, images, trends, pricing
+from record_cache import RecordCache
+from sms_store import MessageStore, normalize_phone
+from lead_index import LeadIndex, SORTABLE as LEAD_SORTABLE
+from lead_scoring import score_leads
+from metrics import upstream_request
+from ratelimit import RateLimiter
+from markets import MARKETS, DEFAULT_MARKET, get_market, active_markets, limiter
 try:
     from dotenv import load_dotenv
     load_dotenv()
@@ -20,170 +30,1038 @@ AIRTABLE_TOKEN  = os.environ.get("AIRTABLE_TOKEN", "")
 AIRTABLE_BASE   = os.environ.get("AIRTABLE_BASE", "appHT9Re4l53GO16t")
 AIRTABLE_TABLE  = os.environ.get("AIRTABLE_TABLE", "tbl4P7tqdonXv5vcY")
 
+# Admin-only tooling (profiling etc.) is disabled unless this is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Lets a Prometheus scraper read /metrics with "Authorization: Bearer <token>"
+# without holding the admin token
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
 # Dashboard HTML — bundled in repo
 DASHBOARD_PATH = Path(__file__).parent / "dashboard.html"
 
 # Quote token storage
 TOKENS_FILE = Path(__file__).parent / "quote_tokens.json"
 
+# In-memory token index, re-read only when the file's mtime changes
+_tokens_index = {"mtime": None, "tokens": {}}
+_tokens_lock = threading.Lock()  # held across load → add → save when issuing tokens
+
 def load_tokens():
-    if TOKENS_FILE.exists():
+    try:
+        mtime = TOKENS_FILE.stat().st_mtime_ns
+    except OSError:
+        return {}
+    if mtime != _tokens_index["mtime"]:
         try:
-            return json.loads(TOKENS_FILE.read_text())
+            _tokens_index["tokens"] = json.loads(TOKENS_FILE.read_text())
+            _tokens_index["mtime"] = mtime
         except Exception:
             return {}
-    return {}
+    # Shallow copy: callers add tokens before save_tokens()
+    return dict(_tokens_index["tokens"])
 
 def save_tokens(tokens):
-    TOKENS_FILE.write_text(json.dumps(tokens, indent=2))
+    tmp = TOKENS_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(tokens, indent=2))
+    os.replace(tmp, TOKENS_FILE)
+    _tokens_index["tokens"] = dict(tokens)
+    _tokens_index["mtime"] = TOKENS_FILE.stat().st_mtime_ns
 
-_cache = {"data": None, "ts": 0}
+def airtable_call(method, table, record_id="", base=None, **kwargs):
+    """Single chokepoint for Airtable REST calls so every one is metered per table."""
+    url = f"https://api.airtable.com/v0/{base or AIRTABLE_BASE}/{table}"
+    if record_id:
+        url += f"/{record_id}"
+    return upstream_request("airtable", method, url, target=AIRTABLE_TABLE_LABELS.get(table, table), **kwargs)
+
+# One live-data snapshot per market. _cache is the default market's; the
+# webhook, warm-up and quote pages all work against the default base.
+_market_caches = {key: {"data": None, "ts": 0} for key in MARKETS}
+_cache = _market_caches.setdefault(DEFAULT_MARKET, {"data": None, "ts": 0})
 CACHE_FILE = Path(__file__).parent / ".cache.json"
 CACHE_TTL = 1800  # 30 min
+# One refresh at a time per market; concurrent callers wait and reuse its result
+_refresh_locks = {key: threading.Lock() for key in _market_caches}
 
-def fetch_live_data():
-    now = time.time()
-    if _cache["data"] and now - _cache["ts"] < CACHE_TTL:
-        return _cache["data"]
-    data = {}
-    # PostHog
+def cache_file(market_key):
+    if market_key == DEFAULT_MARKET:
+        return CACHE_FILE
+    return CACHE_FILE.with_name(f".cache.{market_key}.json")
+
+def fetch_live_data(market=None):
+    key = market or DEFAULT_MARKET
+    cache = _market_caches[key]
+    if cache["data"] and time.time() - cache["ts"] < cache.get("ttl", CACHE_TTL):
+        metrics.inc("cm_cache_requests_total", cache="live_data", result="hit")
+        return _note_stale(cache["data"])
+    with _refresh_locks[key]:
+        now = time.time()
+        if cache["data"] and now - cache["ts"] < cache.get("ttl", CACHE_TTL):
+            metrics.inc("cm_cache_requests_total", cache="live_data", result="hit")
+            return _note_stale(cache["data"])
+        metrics.inc("cm_cache_requests_total", cache="live_data", result="miss")
+        market = MARKETS.get(key) or get_market()
+        sources = live_data_sources(market)
+        with metrics.timer("cm_cache_refresh_seconds", cache="live_data"):
+            data = _keep_last_good(cache["data"], _build_live_data(market), now, sources)
+        cache["data"] = data
+        cache["ts"] = now
+        # Anything short of a clean refresh is retried after STALE_RETRY, not CACHE_TTL
+        degraded = data.get("stale") or any(f"{src}_error" in data for src in sources)
+        cache["ttl"] = STALE_RETRY if degraded else CACHE_TTL
+    if not any(f"{src}_error" in data for src in sources):
+        save_cache_file(data, now, key)
+    return _note_stale(data)
+
+# Snapshot keys owned by each upstream. When one fails, its keys are carried
+# over from the previous snapshot (marked stale) instead of caching the error.
+LIVE_DATA_SOURCES = {"posthog": ("pageviews_7d", "top_pages"), "airtable": ("pipeline", "leads", "total_leads")}
+STALE_RETRY = 60  # seconds
+
+def live_data_sources(market):
+    """LIVE_DATA_SOURCES this market has configured; the others are absent, not failing."""
+    sources = []
+    if market.get("posthog_project"):
+        sources.append("posthog")
+    if AIRTABLE_TOKEN and market.get("airtable_base") and market.get("customers_table"):
+        sources.append("airtable")
+    return sources
+
+def _keep_last_good(previous, data, now, sources=tuple(LIVE_DATA_SOURCES)):
+    previous = previous or {}
+    as_of, stale = {}, {}
+    for source in sources:
+        keys = LIVE_DATA_SOURCES[source]
+        error = data.get(f"{source}_error")
+        if error is None:
+            as_of[source] = now
+        elif all(k in previous for k in keys):
+            data.pop(f"{source}_error")
+            data.update({k: previous[k] for k in keys})
+            as_of[source] = (previous.get("as_of") or {}).get(source)
+            stale[source] = {"error": error, "as_of": as_of[source]}
+    data["as_of"] = as_of
+    if stale:
+        data["stale"] = stale
+    return data
+
+def _note_stale(data):
+    for source in (data or {}).get("stale") or ():
+        breaker.mark_stale(source)
+    return data
+
+_markets_pool = ThreadPoolExecutor(max_workers=max(len(MARKETS), 1), thread_name_prefix="market")
+
+def fetch_all_markets():
+    """{market_key: snapshot} for every configured market, refreshed concurrently."""
+    keys = [m["key"] for m in active_markets()]
+    futures = {k: _markets_pool.submit(contextvars.copy_context().run, fetch_live_data, k) for k in keys}
+    return {k: f.result() for k, f in futures.items()}
+
+_combined = {"parts": None, "data": None}
+
+def market_snapshot(market=None):
+    """Live data for one market key, or every market merged for "all"."""
+    if market != "all":
+        return fetch_live_data(market)
+    by_market = fetch_all_markets()
+    parts = tuple((k, id(v)) for k, v in sorted(by_market.items()))
+    # Re-merge only when some market's snapshot was replaced
+    if parts != _combined["parts"]:
+        _combined["data"] = combine_live_data(by_market)
+        _combined["parts"] = parts
+    return _combined["data"]
+
+def unknown_market(market):
+    return bool(market) and market != "all" and market not in MARKETS
+
+def combine_live_data(by_market):
+    """Merge per-market snapshots into one; leads and pages are tagged with their market."""
+    from collections import Counter
+    pages = Counter()
+    leads = []
+    for key, data in by_market.items():
+        for p in data.get("top_pages", []):
+            pages[(key, p["url"])] += p["views"]
+        leads += [{**lead, "market": key} for lead in data.get("leads", [])]
+    return {
+        "markets": sorted(by_market),
+        "pageviews_7d": sum(d.get("pageviews_7d", 0) for d in by_market.values()),
+        "top_pages": [{"url": u, "views": c, "market": k} for (k, u), c in pages.most_common(5)],
+        "pipeline": pipeline_counts(leads),
+        "leads": leads,
+        "total_leads": len(leads),
+    }
+
+def save_cache_file(data, ts, market=DEFAULT_MARKET):
     try:
-        headers = {"Authorization": f"Bearer {POSTHOG_API_KEY}"}
-        r = requests.get(f"https://us.posthog.com/api/projects/{POSTHOG_PROJECT}/events/",
-            headers=headers, params={"event": "$pageview", "limit": 500}, timeout=10)
-        events = r.json().get("results", []) if r.ok else []
-        from collections import Counter
-        pages = Counter(e.get("properties", {}).get("$pathname", "/") for e in events)
-        data["pageviews_7d"] = len(events)
-        data["top_pages"] = [{"url": u, "views": c} for u, c in pages.most_common(5)]
-    except Exception as e:
-        data["posthog_error"] = str(e)
+        cache_file(market).write_text(json.dumps({"data": data, "ts": ts}))
+    except Exception:
+        pass
+
+def load_cache_file():
+    for key, cache in _market_caches.items():
+        try:
+            path = cache_file(key)
+            if path.exists():
+                saved = json.loads(path.read_text())
+                cache["data"] = saved.get("data")
+                cache["ts"] = saved.get("ts", 0)
+        except Exception:
+            pass
+
+# Fetch only active statuses — skip No Go (530+ records we don't need)
+LEADS_ACTIVE_FILTER = "OR({Status}='New Request',{Status}='talked to/ quoted',{Status}='Booked')"
+LEAD_FIELDS = ["First Name","Last Name","Status","DOA","People","Created On",
+               "Source of lead","Phone","Email","Tell us what you have in mind?","Contact Type"]
+PIPELINE_STATUS_MAP = {
+    "New Request": "new",
+    "talked to/ quoted": "quoted",
+    "Booked - Deposit": "booked",
+    "Booked": "booked",
+    "No Go": "no_go",
+    "No Go - Coming to Town": "no_go",
+    "No Go - Not Coming to Town": "no_go",
+}
+
+def is_main_contact(rec):
+    return rec.get("fields", {}).get("Contact Type") == "Party Main Contact"
+
+def lead_from_record(rec):
+    fields = rec.get("fields", {})
+    return {
+        "id": rec.get("id", ""),
+        "first_name": fields.get("First Name", ""),
+        "last_name": fields.get("Last Name", ""),
+        "status": fields.get("Status", ""),
+        "doa": fields.get("DOA", ""),
+        "people": fields.get("People", ""),
+        "created_on": fields.get("Created On", ""),
+        "source": fields.get("Source of lead", ""),
+        "phone": fields.get("Phone", ""),
+        "email": fields.get("Email", ""),
+        "notes": fields.get("Tell us what you have in mind?", "")
+    }
+
+def pipeline_counts(leads):
+    pipeline = {"new": 0, "quoted": 0, "booked": 0, "no_go": 0}
+    for lead in leads:
+        bucket = PIPELINE_STATUS_MAP.get(lead["status"])
+        if bucket:
+            pipeline[bucket] += 1
+    return pipeline
+
+def _build_live_data(market):
+    data = {"market": market["key"]}
+    sources = live_data_sources(market)
+    # PostHog
+    if "posthog" in sources:
+        try:
+            headers = {"Authorization": f"Bearer {POSTHOG_API_KEY}"}
+            limiter(market["key"], "posthog").wait()
+            r = upstream_request("posthog", "GET", f"https://us.posthog.com/api/projects/{market['posthog_project']}/events/",
+                target="events", headers=headers, params={"event": "$pageview", "limit": 500}, timeout=10)
+            if not r.ok:
+                raise RuntimeError(f"PostHog returned {r.status_code}")
+            events = r.json().get("results", [])
+            from collections import Counter
+            pages = Counter(e.get("properties", {}).get("$pathname", "/") for e in events)
+            data["pageviews_7d"] = len(events)
+            data["top_pages"] = [{"url": u, "views": c} for u, c in pages.most_common(5)]
+        except Exception as e:
+            data["posthog_error"] = str(e)
     # Airtable
     try:
-        if AIRTABLE_TOKEN:
+        if "airtable" in sources:
             headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
-            # Fetch only active statuses — skip No Go (530+ records we don't need)
-            ACTIVE_FILTER = "OR({Status}='New Request',{Status}='talked to/ quoted',{Status}='Booked')"
-            FIELDS = ["First Name","Last Name","Status","DOA","People","Created On",
-                      "Source of lead","Phone","Email","Tell us what you have in mind?","Contact Type"]
             all_records = []
             offset = None
             while True:
-                params = [("pageSize", "100"), ("filterByFormula", ACTIVE_FILTER)]
-                for field in FIELDS:
+                params = [("pageSize", "100"), ("filterByFormula", LEADS_ACTIVE_FILTER)]
+                for field in LEAD_FIELDS:
                     params.append(("fields[]", field))
                 if offset:
                     params.append(("offset", offset))
-                r = requests.get(f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{AIRTABLE_TABLE}",
-                    headers=headers, params=params, timeout=30)
+                limiter(market["key"], "airtable").wait()
+                r = airtable_call("GET", market["customers_table"], base=market["airtable_base"],
+                                  headers=headers, params=params, timeout=30)
                 if not r.ok:
-                    break
+                    # A partial lead list would replace good data with a short one
+                    raise RuntimeError(f"Airtable returned {r.status_code}")
+                metrics.inc("cm_airtable_pages_total", source="live_data")
                 d = r.json()
                 all_records.extend(d.get("records", []))
                 offset = d.get("offset")
                 if not offset:
                     break
             
-            pipeline = {"new": 0, "quoted": 0, "booked": 0, "no_go": 0}
-            status_map = {
-                "New Request": "new",
-                "talked to/ quoted": "quoted",
-                "Booked - Deposit": "booked",
-                "Booked": "booked",
-                "No Go": "no_go",
-                "No Go - Coming to Town": "no_go",
-                "No Go - Not Coming to Town": "no_go",
-            }
-            main_contacts = [r for r in all_records if r.get("fields", {}).get("Contact Type") == "Party Main Contact"]
+            main_contacts = [r for r in all_records if is_main_contact(r)]
             
             # Extract full lead details
-            leads = []
-            for rec in main_contacts:
-                fields = rec.get("fields", {})
-                status = fields.get("Status", "")
-                bucket = status_map.get(status)
-                if bucket:
-                    pipeline[bucket] += 1
-                
-                lead = {
-                    "id": rec.get("id", ""),
-                    "first_name": fields.get("First Name", ""),
-                    "last_name": fields.get("Last Name", ""),
-                    "status": status,
-                    "doa": fields.get("DOA", ""),
-                    "people": fields.get("People", ""),
-                    "created_on": fields.get("Created On", ""),
-                    "source": fields.get("Source of lead", ""),
-                    "phone": fields.get("Phone", ""),
-                    "email": fields.get("Email", ""),
-                    "notes": fields.get("Tell us what you have in mind?", "")
-                }
-                leads.append(lead)
+            leads = [lead_from_record(rec) for rec in main_contacts]
             
-            data["pipeline"] = pipeline
+            data["pipeline"] = pipeline_counts(leads)
             data["leads"] = leads
             data["total_leads"] = len(main_contacts)
     except Exception as e:
         data["airtable_error"] = str(e)
-    _cache["data"] = data
-    _cache["ts"] = now
-    try:
-        CACHE_FILE.write_text(json.dumps({"data": data, "ts": now}))
-    except Exception:
-        pass
     return data
 
+# ─────────────────────────────────────────────────────────────
+# METRICS
+# ─────────────────────────────────────────────────────────────
+
+def is_admin():
+    if not ADMIN_TOKEN:
+        return False
+    supplied = request.headers.get("X-Admin-Token") or request.args.get("admin_token", "")
+    return hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+def is_metrics_scraper():
+    if not METRICS_TOKEN:
+        return False
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer "):
+        return False
+    return hmac.compare_digest(header[len("Bearer "):].encode(), METRICS_TOKEN.encode())
+
+@app.before_request
+def _metrics_start():
+    g.metrics_start = time.perf_counter()
+    breaker.begin_request()
+    # Opt-in per-request profile: ?_profile=1 plus a valid admin token
+    if request.args.get("_profile") == "1" and is_admin():
+        route = request.url_rule.rule if request.url_rule else request.path
+        g.profile = profiling.Profile(f"{request.method}-{route}").__enter__()
+
+@app.after_request
+def _metrics_record(response):
+    stale = breaker.stale_sources()
+    if stale:
+        response.headers["X-Stale"] = ",".join(stale)
+        response.headers["Warning"] = '110 - "Response is Stale"'
+    prof = g.pop("profile", None)
+    if prof is not None:
+        prof.__exit__(None, None, None)
+        response.headers["X-Profile-File"] = prof.prof_path.name
+        response.headers["X-Profile-Timeline"] = prof.timeline_path.name
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        # Label by URL rule, not path, so quote tokens don't explode cardinality
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("cm_http_request_seconds", time.perf_counter() - start, route=route, method=request.method)
+        metrics.inc("cm_http_requests_total", route=route, method=request.method, status=str(response.status_code))
+    return response
+
+@app.teardown_request
+def _profile_teardown(exc):
+    # Unhandled exceptions skip after_request; still stop the profiler
+    prof = g.pop("profile", None)
+    if prof is not None:
+        prof.__exit__(None, None, None)
+
+def _cache_hit_ratios():
+    out = {}
+    for cache in ("live_data", "events", "catalog", "records"):
+        hits = metrics.counter_value("cm_cache_requests_total", cache=cache, result="hit")
+        misses = metrics.counter_value("cm_cache_requests_total", cache=cache, result="miss")
+        if hits + misses:
+            out[(("cache", cache),)] = round(hits / (hits + misses), 4)
+    return out
+
+metrics.gauge("cm_cache_hit_ratio", _cache_hit_ratios, "Share of cache lookups served without a refresh")
+metrics.gauge("cm_cache_age_seconds",
+              lambda: {(("cache", "live_data"),): round(time.time() - _cache["ts"], 1)} if _cache["ts"] else {},
+              "Seconds since the live-data snapshot was built")
+
+@app.errorhandler(breaker.CircuitOpenError)
+def _circuit_open(e):
+    resp = jsonify({"ok": False, "error": "Upstream temporarily unavailable — try again shortly"})
+    resp.headers["Retry-After"] = str(int(breaker.BREAKER_RESET))
+    return resp, 503
+
+@app.errorhandler(requests.RequestException)
+def _upstream_unavailable(e):
+    # An upstream read failed with no cached copy to serve (e.g. Airtable down on a cold record)
+    return jsonify({"ok": False, "error": "Upstream temporarily unavailable — try again shortly"}), 503
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not (is_admin() or is_metrics_scraper()):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    resp = make_response(metrics.render())
+    resp.headers["Content-Type"] = "text/plain; version=0.0.4; charset=utf-8"
+    return resp
+
+@app.route("/admin/profiles")
+def admin_profiles():
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    return jsonify({"ok": True, "profiles": profiling.list_profiles()})
+
+@app.route("/admin/profiles/<name>")
+def admin_profile_file(name):
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    return send_from_directory(profiling.PROFILE_DIR, name, as_attachment=True)
+
+# ── Dashboard assets ──────────────────────────────────────────
+# dashboard.html is split into a small shell plus content-hashed CSS/JS
+# bundles with precompressed variants (see assets.py). Bundles are cached
+# forever by the browser; only the shell is revalidated, via ETag.
+_dashboard_assets = {"mtime": None, "built": None}
+_dashboard_assets_lock = threading.Lock()
+
+def get_dashboard_assets():
+    try:
+        mtime = DASHBOARD_PATH.stat().st_mtime_ns
+    except OSError:
+        return None
+    with _dashboard_assets_lock:
+        if mtime != _dashboard_assets["mtime"]:
+            try:
+                _dashboard_assets["built"] = assets.build(DASHBOARD_PATH)
+                _dashboard_assets["mtime"] = mtime
+            except Exception as e:
+                print(f"⚠️  Dashboard asset build failed, serving dashboard.html as-is: {e}")
+                return None
+        return _dashboard_assets["built"]
+
+def _encoded_response(variants, mimetype, cache_control):
+    enc = assets.negotiate(request.headers.get("Accept-Encoding"), variants)
+    resp = make_response(variants[enc])
+    resp.headers["Content-Type"] = mimetype
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
 @app.route("/")
 def index():
-    return send_file(DASHBOARD_PATH)
+    built = get_dashboard_assets()
+    if built is None:
+        return send_file(DASHBOARD_PATH)
+    if built["shell_etag"] in request.if_none_match:
+        resp = make_response("", 304)
+        resp.headers["Cache-Control"] = "no-cache"
+        resp.headers["Vary"] = "Accept-Encoding"
+    else:
+        resp = _encoded_response(built["shell"], assets.MIMETYPES[".html"], "no-cache")
+    resp.set_etag(built["shell_etag"])
+    return resp
+
+@app.route("/assets/<name>")
+def dashboard_asset(name):
+    built = get_dashboard_assets()
+    asset = (built or {}).get("files", {}).get(name)
+    if asset is None:
+        return jsonify({"ok": False, "error": "Not found"}), 404
+    # Filenames carry a content hash, so a given URL never changes
+    return _encoded_response(asset["variants"], asset["mimetype"], "public, max-age=31536000, immutable")
+
+@app.route("/api/markets")
+def api_markets():
+    return jsonify({"ok": True, "default": DEFAULT_MARKET, "markets": [
+        {"key": k, "name": m["name"], "city": m["city"], "configured": m in active_markets(),
+         "live_data_age": round(time.time() - _market_caches[k]["ts"], 1) if _market_caches[k]["ts"] else None}
+        for k, m in MARKETS.items()]})
 
 @app.route("/api/data")
 def api_data():
-    return jsonify(fetch_live_data())
+    # ?market=<key> for one market's snapshot, ?market=all for every market merged
+    market = request.args.get("market")
+    if unknown_market(market):
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
+    data = market_snapshot(market)
+    # ?leads=0: pipeline/traffic only — page leads through /api/leads instead
+    if request.args.get("leads") == "0":
+        data = {k: v for k, v in data.items() if k != "leads"}
+    return jsonify(data)
+
+# ── Leads API ─────────────────────────────────────────────────
+# Indexes are rebuilt only when the snapshot's leads list is replaced
+# (full refresh or webhook patch), then every query is served from them.
+_lead_indexes = {}  # market key (or "all") -> {"leads": list, "index": LeadIndex}
+_lead_index_lock = threading.Lock()
+
+def get_lead_index(market=None):
+    key = market or DEFAULT_MARKET
+    leads = (market_snapshot(key) or {}).get("leads") or []
+    with _lead_index_lock:
+        entry = _lead_indexes.setdefault(key, {"leads": None, "index": None})
+        if entry["leads"] is not leads:
+            entry["index"] = LeadIndex(leads)
+            entry["leads"] = leads
+        return entry["index"]
+
+def _csv_arg(name):
+    return [v for v in request.args.get(name, "").split(",") if v] or None
+
+@app.route("/api/leads")
+def api_leads():
+    """Cursor-paginated leads. Filters: status, source (comma lists), doa_from/doa_to
+    (YYYY-MM-DD), people_min/people_max. sort=<field> or -<field>; fields=a,b sparse;
+    market=<key>|all."""
+    market = request.args.get("market")
+    if unknown_market(market):
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
+    sort = request.args.get("sort", "-created_on")
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in LEAD_SORTABLE:
+        return jsonify({"ok": False, "error": f"sort must be one of {', '.join(LEAD_SORTABLE)}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+        people_min = int(request.args["people_min"]) if request.args.get("people_min") else None
+        people_max = int(request.args["people_max"]) if request.args.get("people_max") else None
+        page, next_cursor, total = get_lead_index(market).query(
+            status=_csv_arg("status"), source=_csv_arg("source"),
+            doa_from=request.args.get("doa_from"), doa_to=request.args.get("doa_to"),
+            people_min=people_min, people_max=people_max,
+            sort=sort, descending=descending, cursor=request.args.get("cursor"), limit=limit)
+    except (ValueError, TypeError, IndexError):
+        return jsonify({"ok": False, "error": "Invalid filter, limit or cursor"}), 400
+    fields = _csv_arg("fields")
+    if fields:
+        page = [{f: lead.get(f) for f in fields} for lead in page]
+    return jsonify({"ok": True, "leads": page, "next_cursor": next_cursor, "total": total})
+
+# ── LLM job queue ─────────────────────────────────────────────
+# Chat calls can take 30–90 s, so they run on their own small pool instead of
+# a web worker. Requests return a job id right away (poll /api/llm-jobs/<id>);
+# once LLM_QUEUE_MAX jobs are waiting, new ones are refused immediately.
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 2))
+LLM_QUEUE_MAX   = int(os.environ.get("LLM_QUEUE_MAX", 8))
+LLM_JOB_KEEP = 100  # finished jobs kept for result lookups
+
+_llm_pool = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY, thread_name_prefix="llm")
+_llm_jobs = {}
+_llm_waiting = []  # ids of queued (not yet running) jobs, oldest first
+_llm_jobs_lock = threading.Lock()
+
+def _llm_position(job):
+    """1-based place in the waiting line; 0 once running or finished."""
+    try:
+        return _llm_waiting.index(job["id"]) + 1
+    except ValueError:
+        return 0
+
+def _run_llm_job(job, fn):
+    with _llm_jobs_lock:
+        _llm_waiting.remove(job["id"])
+        job["state"] = "running"
+        job["started_at"] = time.time()
+    metrics.observe("cm_llm_queue_wait_seconds", job["started_at"] - job["created_at"], kind=job["kind"])
+    try:
+        result = fn()
+    except Exception as e:
+        result = {"error": str(e)}
+    with _llm_jobs_lock:
+        job.update(result)
+        job["state"] = "failed" if "error" in result else "done"
+        job["finished_at"] = time.time()
+    metrics.inc("cm_llm_jobs_total", kind=job["kind"], result=job["state"])
+
+def submit_llm_job(kind, fn):
+    """Queue fn() -> {"response": ...} | {"error": ...}. Returns the job, or None if the queue is full."""
+    with _llm_jobs_lock:
+        if len(_llm_waiting) >= LLM_QUEUE_MAX:
+            metrics.inc("cm_llm_jobs_total", kind=kind, result="rejected")
+            return None
+        job_id = uuid.uuid4().hex[:12]
+        job = {"id": job_id, "kind": kind, "state": "queued", "created_at": time.time(),
+               "started_at": None, "finished_at": None}
+        _llm_jobs[job_id] = job
+        _llm_waiting.append(job_id)
+        done = [j for j in _llm_jobs.values() if j["finished_at"]]
+        for old in sorted(done, key=lambda j: j["finished_at"])[:-LLM_JOB_KEEP or None]:
+            _llm_jobs.pop(old["id"], None)
+    _llm_pool.submit(contextvars.copy_context().run, _run_llm_job, job, fn)
+    return job
+
+def _llm_job_response(job):
+    if job is None:
+        resp = jsonify({"ok": False, "error": "Chat is busy — too many requests waiting. Try again shortly."})
+        resp.headers["Retry-After"] = "10"
+        return resp, 503
+    with _llm_jobs_lock:
+        return jsonify({"ok": True, "job_id": job["id"], "state": job["state"], "position": _llm_position(job),
+                        "status_url": f"/api/llm-jobs/{job['id']}"}), 202
+
+def _ollama_chat(messages):
+    # Ollama is local only
+    try:
+        r = upstream_request("ollama", "POST", "http://localhost:11434/api/chat", target="chat",
+            json={"model": "gemma3:4b", "messages": messages, "stream": False}, timeout=90)
+        resp = r.json().get("message", {}).get("content", "")
+        if resp:
+            return {"response": resp}
+    except Exception:
+        pass
+    return {"error": "Ollama not available in cloud mode. Use Ask OpenClaw instead."}
+
+def _openclaw_chat(prefixed):
+    try:
+        r = upstream_request("openclaw", "POST", "http://localhost:9999/api/chat", target="chat",
+            json={"message": prefixed, "channel": "webchat"}, timeout=30)
+        return {"response": r.json().get("response") or r.text}
+    except Exception:
+        return {"error": "OpenClaw is only available when running locally."}
 
 @app.route("/api/chat", methods=["POST"])
 def api_chat():
     body = request.json or {}
     message = body.get("message", "")
     history = body.get("history", [])
-    data = fetch_live_data()
-    system = f"""You are an AI assistant for Connected Montreal, a bachelor party planning business in Montreal and Austin TX.
+    market = body.get("market")
+    if unknown_market(market):
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
+
+    def run():
+        data = market_snapshot(market)
+        system = f"""You are an AI assistant for Connected Montreal, a bachelor party planning business in {' and '.join(m['city'] for m in MARKETS.values())}.
 You have access to live business data. Answer questions about leads, pipeline, traffic, and marketing. Be concise and direct.
 
 LIVE DATA:
 {json.dumps(data, indent=2)}"""
-    messages = [{"role": "system", "content": system}] + history + [{"role": "user", "content": message}]
-    # Try Ollama (local only)
-    try:
-        r = requests.post("http://localhost:11434/api/chat",
-            json={"model": "gemma3:4b", "messages": messages, "stream": False}, timeout=90)
-        resp = r.json().get("message", {}).get("content", "")
-        if resp:
-            return jsonify({"response": resp})
-    except Exception:
-        pass
-    return jsonify({"error": "Ollama not available in cloud mode. Use Ask OpenClaw instead."}), 503
+        messages = [{"role": "system", "content": system}] + history + [{"role": "user", "content": message}]
+        return _ollama_chat(messages)
+
+    return _llm_job_response(submit_llm_job("ollama", run))
 
 @app.route("/api/ask-openclaw", methods=["POST"])
 def api_ask_openclaw():
     body = request.json or {}
     message = body.get("message", "")
-    data = fetch_live_data()
-    summary = json.dumps({"pipeline": data.get("pipeline"), "pageviews_7d": data.get("pageviews_7d"), "top_pages": data.get("top_pages")})
-    prefixed = f"[Connected Montreal Live Data]\n{summary}\n\nQuestion: {message}"
+
+    def run():
+        data = fetch_live_data()
+        summary = json.dumps({"pipeline": data.get("pipeline"), "pageviews_7d": data.get("pageviews_7d"), "top_pages": data.get("top_pages")})
+        return _openclaw_chat(f"[Connected Montreal Live Data]\n{summary}\n\nQuestion: {message}")
+
+    return _llm_job_response(submit_llm_job("openclaw", run))
+
+@app.route("/api/llm-jobs/<job_id>")
+def api_llm_job(job_id):
+    job = _llm_jobs.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+    with _llm_jobs_lock:
+        return jsonify({"ok": True, **job, "position": _llm_position(job)})
+
+metrics.describe("cm_llm_jobs_total", "LLM chat jobs by kind and outcome (done/failed/rejected)")
+metrics.describe("cm_llm_queue_wait_seconds", "Time LLM jobs spent queued before a worker picked them up")
+metrics.gauge("cm_llm_queue_depth", lambda: {(): len(_llm_waiting)}, "LLM jobs waiting for a worker")
+
+@app.route("/api/catalog")
+def api_catalog():
+    """Experience catalog for the dashboard. ?ids=rec1,rec2 limits to specific rows."""
+    ids = [i for i in request.args.get("ids", "").split(",") if i]
+    if ids:
+        records = {i: catalog_get(i) for i in ids}
+    else:
+        records = _catalog["records"]
+    return jsonify({
+        "loaded_at": _catalog["ts"],
+        "records": [{"id": rid, **f} for rid, f in records.items() if f is not None],
+    })
+
+# ── Proposals pipeline ────────────────────────────────────────
+# collector → analyzer run in-process on PIPELINE_INTERVAL; the latest report
+# and proposals live in _pipeline.outputs (analysis is skipped when the
+# collected report hasn't changed).
+_pipeline = pipeline.marketing_pipeline()
+_scheduler = pipeline.Scheduler(_pipeline)
+
+def start_pipeline():
+    if pipeline.PIPELINE_INTERVAL > 0:
+        _scheduler.start()
+
+@app.route("/api/proposals")
+def api_proposals():
+    proposals = _pipeline.outputs.get("analyze")
+    if proposals is None:
+        return jsonify({"ok": False, "error": "Proposals not generated yet", "pipeline": _scheduler.state()}), 503
+    return jsonify({"ok": True, **proposals, "pipeline": _scheduler.state()})
+
+@app.route("/api/report")
+def api_report():
+    report = _pipeline.outputs.get("collect")
+    if report is None:
+        return jsonify({"ok": False, "error": "Report not collected yet", "pipeline": _scheduler.state()}), 503
+    return jsonify({"ok": True, "report": report})
+
+@app.route("/api/proposals/run", methods=["POST"])
+def api_proposals_run():
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    _scheduler.run_now()
+    return jsonify({"ok": True, "pipeline": _scheduler.state()}), 202
+
+# ── Attribution ───────────────────────────────────────────────
+# One AttributionIndex per market, fed incrementally: every ATTRIBUTION_SYNC
+# seconds only PostHog events newer than the index's last event are pulled,
+# and the market's current leads are re-added (unchanged ones are no-ops).
+# The visitor side is saved to .attribution.<market>.json across restarts.
+ATTRIBUTION_SYNC = int(os.environ.get("ATTRIBUTION_SYNC", 600))   # seconds; 0 disables
+ATTRIBUTION_DAYS = int(os.environ.get("ATTRIBUTION_DAYS", 90))    # backfill window for a new index
+ATTRIBUTION_EVENTS = ("$pageview", "$identify")
+
+_attribution = {}  # market key -> AttributionIndex
+_attribution_lock = threading.Lock()
+# Top-level fields cover the whole pass; "markets" holds each market's own result
+_attribution_sync = {"started": False, "last_sync": None, "last_error": None, "markets": {}}
+
+def attribution_file(market_key):
+    return CACHE_FILE.with_name(f".attribution.{market_key}.json")
+
+def get_attribution_index(market_key):
+    with _attribution_lock:
+        if market_key not in _attribution:
+            path = attribution_file(market_key)
+            try:
+                _attribution[market_key] = attribution.AttributionIndex.from_state(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                _attribution[market_key] = attribution.AttributionIndex()
+        return _attribution[market_key]
+
+def _fetch_posthog_events(market, event, after):
+    headers = {"Authorization": f"Bearer {POSTHOG_API_KEY}"}
+    url = f"https://us.posthog.com/api/projects/{market['posthog_project']}/events/"
+    params = {"event": event, "limit": 1000, "after": after}
+    events = []
+    while url:
+        limiter(market["key"], "posthog").wait()
+        r = upstream_request("posthog", "GET", url, target="events", headers=headers, params=params, timeout=30)
+        if not r.ok:
+            raise RuntimeError(f"PostHog returned {r.status_code}")
+        d = r.json()
+        events.extend(d.get("results", []))
+        url, params = d.get("next"), None
+    return events
+
+def sync_attribution(market_key):
+    """Pull new events and the current leads into the market's index; returns events added."""
+    market = MARKETS[market_key]
+    index = get_attribution_index(market_key)
+    added = 0
+    if market["posthog_project"]:
+        after = index.last_event_ts or (datetime.now(timezone.utc) - timedelta(days=ATTRIBUTION_DAYS)).strftime("%Y-%m-%dT%H:%M:%S")
+        # Fetch everything before indexing so a failed page doesn't move the cursor past missed events
+        events = [e for name in ATTRIBUTION_EVENTS for e in _fetch_posthog_events(market, name, after)]
+        with _attribution_lock:
+            index.add_events(events)
+        added = len(events)
+    leads = (market_snapshot(market_key) or {}).get("leads") or []
+    with _attribution_lock:
+        index.add_leads(leads)
+        state = json.dumps(index.to_state())
+    attribution_file(market_key).write_text(state)
+    return added
+
+def _attribution_loop():
+    while True:
+        errors = []
+        for m in active_markets():
+            state = _attribution_sync["markets"].setdefault(m["key"], {"last_sync": None, "last_error": None})
+            try:
+                sync_attribution(m["key"])
+                state["last_sync"] = time.time()
+                state["last_error"] = None
+            except Exception as e:
+                state["last_error"] = str(e)
+                errors.append(f"{m['key']}: {e}")
+                print(f"⚠️  Attribution sync failed for {m['key']}: {e}")
+        _attribution_sync["last_sync"] = time.time()
+        _attribution_sync["last_error"] = "; ".join(errors) or None
+        time.sleep(ATTRIBUTION_SYNC)
+
+def start_attribution_sync():
+    if ATTRIBUTION_SYNC > 0 and not _attribution_sync["started"]:
+        _attribution_sync["started"] = True
+        threading.Thread(target=_attribution_loop, name="attribution-sync", daemon=True).start()
+
+@app.route("/api/attribution")
+def api_attribution():
+    """Conversion per ad landing page and campaign; market=<key>|all."""
+    market = request.args.get("market")
+    if unknown_market(market):
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
     try:
-        r = requests.post("http://localhost:9999/api/chat",
-            json={"message": prefixed, "channel": "webchat"}, timeout=30)
-        resp = r.json().get("response") or r.text
-        return jsonify({"response": resp})
-    except Exception:
-        return jsonify({"error": "OpenClaw is only available when running locally."}), 503
+        limit = max(1, min(int(request.args.get("limit", 20)), 200))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid limit"}), 400
+    keys = list(MARKETS) if market == "all" else [market or DEFAULT_MARKET]
+    reports = {}
+    for k in keys:
+        index = get_attribution_index(k)
+        with _attribution_lock:
+            reports[k] = index.report(limit)
+    report = attribution.merge_reports(reports, limit) if market == "all" else reports[keys[0]]
+    return jsonify({"ok": True, "report": report, "sync": _attribution_sync})
+
+# ── Traffic trends ────────────────────────────────────────────
+@app.route("/api/traffic")
+def api_traffic():
+    """Dashboard traffic panel: range=1d|7d|30d or from/to=YYYY-MM-DD; market=<key>.
+    Served from trends' shared cache, so open tabs don't each query PostHog."""
+    market = get_market(request.args.get("market"))
+    if market is None:
+        return jsonify({"ok": False, "error": f"Unknown market: {request.args.get('market')}"}), 404
+    if not market["posthog_project"]:
+        return jsonify({"ok": False, "error": f"No PostHog project configured for {market['name']}"}), 404
+    try:
+        date_from, date_to, ttl = trends.parse_range(request.args.get("range"), request.args.get("from"),
+                                                     request.args.get("to"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    try:
+        data = trends.get(market, date_from, date_to, ttl)
+    except breaker.CircuitOpenError:
+        raise
+    except (requests.RequestException, RuntimeError) as e:
+        return jsonify({"ok": False, "error": f"PostHog unavailable: {e}"}), 502
+    return jsonify({"ok": True, **data})
+
+# ── Bulk export ───────────────────────────────────────────────
+# Streamed straight from export.stream(); a client that loses the connection
+# resumes with ?after=<cursor of the last row it kept>.
+EXPORT_CONCURRENCY = int(os.environ.get("EXPORT_CONCURRENCY", 2))
+_export_slots = threading.BoundedSemaphore(EXPORT_CONCURRENCY)
+
+@app.route("/api/export/<dataset>")
+def api_export(dataset):
+    """dataset: leads|itineraries|traffic. format=csv|ndjson|parquet, market=<key>,
+    after=<cursor>, since=YYYY-MM-DD (traffic). Admin only."""
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    fmt = request.args.get("format", "csv")
+    after = request.args.get("after") or None
+    try:
+        chunks = export.stream(dataset, fmt, request.args.get("market"), after,
+                               request.args.get("since"), header=not after)
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if not _export_slots.acquire(blocking=False):
+        return jsonify({"ok": False, "error": "Too many exports running — retry shortly"}), 503, {"Retry-After": "30"}
+
+    def generate():
+        try:
+            yield from chunks
+        except Exception as e:
+            # Headers are long gone; the missing trailing rows (and this log) tell the client to resume
+            print(f"⚠️  Export {dataset} stopped: {e}")
+
+    mimetype, ext = export.FORMATS[fmt]
+    resp = app.response_class(generate(), mimetype=mimetype)
+    resp.call_on_close(_export_slots.release)
+    resp.headers["Content-Disposition"] = f'attachment; filename="{dataset}.{ext}"'
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 @app.route("/api/refresh", methods=["POST"])
 def api_refresh():
-    _cache["ts"] = 0
-    return jsonify(fetch_live_data())
+    market = request.args.get("market")
+    if unknown_market(market):
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
+    for key in (MARKETS if market == "all" else [market or DEFAULT_MARKET]):
+        _market_caches[key]["ts"] = 0
+    return jsonify(market_snapshot(market))
+
+
+# ── BlueBubbles (SMS) ─────────────────────────────────────────
+BLUEBUBBLES_DB = os.path.expanduser('~/Library/Application Support/bluebubbles-server/config.db')
+SMS_CONCURRENCY  = int(os.environ.get("SMS_CONCURRENCY", 4))
+SMS_RATE_PER_SEC = float(os.environ.get("SMS_RATE_PER_SEC", 2))
+
+_bb_config = {}
+
+def get_bluebubbles_config(reload=False):
+    """(url, password) from BlueBubbles' config.db, read once and cached."""
+    if reload or not _bb_config.get("url"):
+        import sqlite3
+        conn = sqlite3.connect(BLUEBUBBLES_DB)
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT name, value FROM config WHERE name IN ('server_address','password')")
+            rows = {r[0]: r[1] for r in cur.fetchall()}
+        finally:
+            conn.close()
+        _bb_config["url"] = rows.get('server_address', '').rstrip('/')
+        _bb_config["password"] = rows.get('password', '')
+    return _bb_config["url"], _bb_config["password"]
 
+def send_bluebubbles_text(to, message):
+    """Send one SMS; returns (ok, error). Re-reads config once if the server moved.
+    Sent messages are appended to the local message store straight away."""
+    temp_guid = str(uuid.uuid4())
+    for attempt in (0, 1):
+        try:
+            bb_url, bb_pass = get_bluebubbles_config(reload=attempt == 1)
+        except Exception as e:
+            return False, f"BlueBubbles config error: {e}"
+        if not bb_url:
+            return False, "BlueBubbles URL not found"
+        try:
+            r = upstream_request("bluebubbles", "POST", f"{bb_url}/api/v1/message/text", target="message/text",
+                headers={"Content-Type": "application/json"},
+                params={"password": bb_pass},
+                json={"chatGuid": f"SMS;-;{to}", "message": message,
+                      "method": "private-api", "tempGuid": temp_guid},
+                timeout=15)
+        except requests.ConnectionError as e:
+            if attempt == 0:
+                continue
+            return False, str(e)
+        except Exception as e:
+            return False, str(e)
+        if not r.ok:
+            return False, r.text
+        try:
+            sent = r.json().get("data") or {}
+        except ValueError:
+            sent = {}
+        sms_store.add(sent.get("guid") or temp_guid, to, sent.get("dateCreated") or time.time() * 1000,
+                      True, message, replaces=temp_guid)
+        return True, None
+    return False, "BlueBubbles unreachable"
+
+# ── Follow-up work queue ──────────────────────────────────────
+
+@app.route("/api/lead-queue")
+def api_lead_queue():
+    """All live leads ranked by follow-up priority. Last contact comes from the
+    SMS store when we have texted them, otherwise the lead's created date."""
+    leads = (fetch_live_data() or {}).get("leads") or []
+    statuses = _csv_arg("status")
+    if statuses:
+        leads = [l for l in leads if l.get("status") in statuses]
+    contacted = sms_store.last_contacted()
+    inputs = [{**l, "last_contact": (contacted.get(normalize_phone(l.get("phone"))) or {}).get("last")}
+              for l in leads]
+    ranked = score_leads(inputs)
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 1000))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid limit"}), 400
+    page = ranked[:limit]
+    fields = _csv_arg("fields")
+    if fields:
+        page = [{f: l.get(f) for f in fields} for l in page]
+    return jsonify({"ok": True, "total": len(ranked), "queue": page})
+
+# ── Local message store ───────────────────────────────────────
+# /api/sms-history reads SQLite only; a background loop pulls new messages
+# from BlueBubbles incrementally (by dateCreated) every SMS_SYNC_INTERVAL.
+SMS_STORE_PATH    = Path(os.environ.get("SMS_STORE_PATH", Path(__file__).parent / ".sms_store.sqlite"))
+SMS_SYNC_INTERVAL = int(os.environ.get("SMS_SYNC_INTERVAL", 60))
+SMS_SYNC_PAGE     = 500
+
+sms_store = MessageStore(SMS_STORE_PATH)
+_sms_sync = {"last_sync": 0, "last_error": None, "started": False}
+_sms_sync_lock = threading.Lock()
+
+def _message_phone(m):
+    """Counterparty phone for a BlueBubbles message (1:1 chats only)."""
+    addr = (m.get("handle") or {}).get("address") or ""
+    if not addr:
+        for chat in m.get("chats") or []:
+            if ";-;" in chat.get("guid", ""):
+                addr = chat.get("chatIdentifier", "")
+                break
+    return "" if "@" in addr else addr
+
+def sync_sms_history():
+    """Fetch messages newer than the last synced timestamp. Returns count stored."""
+    if not _sms_sync_lock.acquire(blocking=False):
+        return 0  # another sync is already running
+    try:
+        bb_url, bb_pass = get_bluebubbles_config()
+        if not bb_url:
+            return 0
+        after = int(sms_store.get_state("last_ts", 0))
+        total = 0
+        while True:
+            r = upstream_request("bluebubbles", "POST", f"{bb_url}/api/v1/message/query", target="message/query",
+                params={"password": bb_pass},
+                # -1ms overlap so same-millisecond messages at a page edge aren't skipped
+                json={"limit": SMS_SYNC_PAGE, "offset": 0, "sort": "ASC", "after": max(after - 1, 0),
+                      "with": ["chat", "handle"]},
+                timeout=30)
+            if not r.ok:
+                raise RuntimeError(f"message/query {r.status_code}")
+            msgs = r.json().get("data") or []
+            rows = []
+            for m in msgs:
+                ts = m.get("dateCreated") or 0
+                rows.append((m.get("guid"), _message_phone(m), ts, m.get("isFromMe"), m.get("text"), m.get("tempGuid")))
+                after = max(after, ts)
+            sms_store.add_many(rows)
+            sms_store.set_state("last_ts", after)
+            total += len(rows)
+            if len(msgs) < SMS_SYNC_PAGE:
+                break
+        _sms_sync["last_sync"] = time.time()
+        _sms_sync["last_error"] = None
+        return total
+    except Exception as e:
+        _sms_sync["last_error"] = str(e)
+        return 0
+    finally:
+        _sms_sync_lock.release()
+
+def _sms_sync_loop():
+    while True:
+        sync_sms_history()
+        time.sleep(SMS_SYNC_INTERVAL)
+
+def start_sms_sync():
+    # BlueBubbles only exists on the local Mac; nothing to sync in the cloud
+    if os.path.exists(BLUEBUBBLES_DB) and not _sms_sync["started"]:
+        _sms_sync["started"] = True
+        threading.Thread(target=_sms_sync_loop, name="sms-sync", daemon=True).start()
+
+def _parse_sms_cursor(cursor):
+    """'<ts>|<guid>' → (ts, guid). A bare ms timestamp from older clients keeps
+    its old meaning (strictly older): no guid sorts below ''."""
+    if not cursor:
+        return None
+    ts, _, guid = cursor.partition("|")
+    return int(ts), guid
+
+@app.route("/api/sms-history")
+def api_sms_history():
+    phone = normalize_phone(request.args.get("to", ""))
+    if not phone:
+        return jsonify({"ok": False, "error": "to required"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", 50)), 500))
+        before = _parse_sms_cursor(request.args.get("before"))
+    except ValueError:
+        return jsonify({"ok": False, "error": "Invalid limit or before"}), 400
+    messages = sms_store.history(phone, limit=limit, before=before)
+    return jsonify({
+        "ok": True,
+        "found": bool(messages),
+        "phone": phone,
+        "messages": messages,
+        "next_before": f'{messages[0]["timestamp"]}|{messages[0]["guid"]}' if len(messages) == limit else None,
+        "synced_at": _sms_sync["last_sync"] or None,
+    })
+
+@app.route("/api/sms-last-contacted", methods=["GET", "POST"])
+def api_sms_last_contacted():
+    """Last SMS timestamps for every lead (or the posted phones) in one query."""
+    phones = (request.json or {}).get("phones") if request.method == "POST" else None
+    by_phone = sms_store.last_contacted(phones)
+    by_lead = {}
+    if not phones:
+        for lead in (_cache["data"] or {}).get("leads", []):
+            hit = by_phone.get(normalize_phone(lead.get("phone")))
+            if hit:
+                by_lead[lead["id"]] = hit
+    return jsonify({"ok": True, "by_phone": by_phone, "by_lead": by_lead})
 
 @app.route("/api/send-sms", methods=["POST"])
 def api_send_sms():
@@ -192,35 +1070,124 @@ def api_send_sms():
     message = body.get("message", "").strip()
     if not to or not message:
         return jsonify({"ok": False, "error": "Missing to or message"}), 400
-    # Get BlueBubbles server URL from config DB
-    try:
-        import sqlite3, os
-        db_path = os.path.expanduser('~/Library/Application Support/bluebubbles-server/config.db')
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT name, value FROM config WHERE name IN ('server_address','password')")
-        rows = {r[0]: r[1] for r in cur.fetchall()}
-        conn.close()
-        bb_url = rows.get('server_address', '').rstrip('/')
-        bb_pass = rows.get('password', '')
-    except Exception as e:
-        return jsonify({"ok": False, "error": f"BlueBubbles config error: {e}"}), 500
-    if not bb_url:
-        return jsonify({"ok": False, "error": "BlueBubbles URL not found"}), 500
-    try:
-        import uuid
-        r = requests.post(f"{bb_url}/api/v1/message/text",
-            headers={"Content-Type": "application/json"},
-            params={"password": bb_pass},
-            json={"chatGuid": f"SMS;-;{to}", "message": message,
-                  "method": "private-api", "tempGuid": str(uuid.uuid4())},
-            timeout=15)
-        if r.ok:
-            return jsonify({"ok": True})
-        else:
-            return jsonify({"ok": False, "error": r.text}), 500
-    except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+    ok, error = send_bluebubbles_text(to, message)
+    if ok:
+        return jsonify({"ok": True})
+    return jsonify({"ok": False, "error": error}), 500
+
+# ── Bulk SMS campaigns ────────────────────────────────────────
+# Jobs run on a small shared pool behind a global rate limit, so a 300-lead
+# follow-up never ties up web workers. Progress: GET /api/sms-jobs/<job_id>.
+
+_sms_pool = ThreadPoolExecutor(max_workers=SMS_CONCURRENCY, thread_name_prefix="sms")
+_sms_limiter = RateLimiter(SMS_RATE_PER_SEC)
+_sms_jobs = {}
+_sms_jobs_lock = threading.Lock()
+SMS_JOB_KEEP = 50  # finished jobs kept for status lookups
+
+def render_sms_template(template, recipient):
+    return re.sub(r"\{(\w+)\}", lambda m: str(recipient.get(m.group(1)) or ""), template).strip()
+
+def _sms_recipients_from_filter(lead_filter):
+    leads = fetch_live_data().get("leads", [])
+    statuses = lead_filter.get("status")
+    if isinstance(statuses, str):
+        statuses = [statuses]
+    sources = lead_filter.get("source")
+    if isinstance(sources, str):
+        sources = [sources]
+    ids = set(lead_filter.get("ids") or [])
+    out = []
+    for lead in leads:
+        if statuses and lead.get("status") not in statuses:
+            continue
+        if sources and lead.get("source") not in sources:
+            continue
+        if ids and lead.get("id") not in ids:
+            continue
+        out.append({**lead, "to": lead.get("phone", "")})
+    return out
+
+def _send_sms_job_item(job, item):
+    if job["cancel_requested"]:
+        item["status"] = "cancelled"
+    else:
+        _sms_limiter.wait()
+        ok, error = send_bluebubbles_text(item["to"], item["message"])
+        item["status"] = "sent" if ok else "failed"
+        if error:
+            item["error"] = error
+        metrics.inc("cm_sms_bulk_messages_total", status=item["status"])
+    with _sms_jobs_lock:
+        job["counts"][item["status"]] += 1
+        if sum(job["counts"].values()) >= job["total"]:
+            job["finished_at"] = time.time()
+            job["state"] = "cancelled" if job["cancel_requested"] else "done"
+
+@app.route("/api/send-sms/bulk", methods=["POST"])
+def api_send_sms_bulk():
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    body = request.json or {}
+    template = (body.get("template") or "").strip()
+    if not template:
+        return jsonify({"ok": False, "error": "template required"}), 400
+    if body.get("recipients"):
+        recipients = [r if isinstance(r, dict) else {"to": r} for r in body["recipients"]]
+    elif body.get("lead_filter"):
+        recipients = _sms_recipients_from_filter(body["lead_filter"])
+    else:
+        return jsonify({"ok": False, "error": "recipients or lead_filter required"}), 400
+
+    items, seen, skipped = [], set(), 0
+    for rec in recipients:
+        to = normalize_phone(rec.get("to") or rec.get("phone"))
+        message = render_sms_template(template, rec)
+        if not to or not message or to in seen:
+            skipped += 1
+            continue
+        seen.add(to)
+        items.append({"to": to, "lead_id": rec.get("id", ""), "message": message, "status": "queued"})
+    if not items:
+        return jsonify({"ok": False, "error": "No valid recipients"}), 400
+    if body.get("dry_run"):
+        return jsonify({"ok": True, "dry_run": True, "total": len(items), "skipped": skipped, "recipients": items})
+
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "state": "running", "created_at": time.time(), "finished_at": None,
+           "total": len(items), "skipped": skipped, "counts": {"sent": 0, "failed": 0, "cancelled": 0},
+           "cancel_requested": False, "items": items}
+    with _sms_jobs_lock:
+        _sms_jobs[job_id] = job
+        done = [j for j in _sms_jobs.values() if j["finished_at"]]
+        for old in sorted(done, key=lambda j: j["finished_at"])[:-SMS_JOB_KEEP or None]:
+            _sms_jobs.pop(old["id"], None)
+    for item in items:
+        _sms_pool.submit(_send_sms_job_item, job, item)
+    return jsonify({"ok": True, "job_id": job_id, "total": len(items), "skipped": skipped}), 202
+
+@app.route("/api/sms-jobs/<job_id>")
+def api_sms_job(job_id):
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    job = _sms_jobs.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+    with _sms_jobs_lock:
+        snapshot = {**job, "counts": dict(job["counts"]), "items": [dict(i) for i in job["items"]]}
+    if request.args.get("items") == "0":
+        snapshot.pop("items")
+    return jsonify({"ok": True, **snapshot})
+
+@app.route("/api/sms-jobs/<job_id>/cancel", methods=["POST"])
+def api_sms_job_cancel(job_id):
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Forbidden"}), 403
+    job = _sms_jobs.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+    job["cancel_requested"] = True
+    return jsonify({"ok": True})
 
 # ─────────────────────────────────────────────────────────────
 # CLIENT QUOTE PORTAL
@@ -265,18 +1232,256 @@ def format_cad(val):
         return val or "—"
 
 def fetch_client_record(record_id):
+    return airtable_get_record(AIRTABLE_TABLE, record_id)
+
+EXPERIENCE_TABLE = "tblHsIUTzp0LRGdYD"
+
+# Friendly names for per-table upstream metrics
+AIRTABLE_TABLE_LABELS = {
+    AIRTABLE_TABLE: "customers",
+    EVENTS_TABLE: "events",
+    EXPERIENCE_TABLE: "experience",
+}
+
+# ── Airtable record cache ─────────────────────────────────────
+# Read-through cache for single-record GETs: memory LRU + SQLite file.
+# Our own PATCHes go through airtable_patch_record, which refreshes the entry.
+RECORD_CACHE_PATH = Path(os.environ.get("RECORD_CACHE_PATH", Path(__file__).parent / ".records_cache.sqlite"))
+RECORD_CACHE_TTLS = {
+    AIRTABLE_TABLE:   120,   # client-facing, staff edit these often
+    EVENTS_TABLE:     300,
+    EXPERIENCE_TABLE: 3600,  # catalog rows rarely change
+}
+record_cache = RecordCache(RECORD_CACHE_PATH, RECORD_CACHE_TTLS,
+                           max_bytes=int(os.environ.get("RECORD_CACHE_MAX_MB", 32)) * 1024 * 1024,
+                           on_stale=lambda table, record_id: breaker.mark_stale("airtable"))
+
+def airtable_get_record(table, record_id, fields=None, timeout=15):
+    """Fields of one record via the record cache; None if missing. Raises a
+    requests exception when Airtable is unavailable and nothing is cached."""
+    if not AIRTABLE_TOKEN or not record_id:
+        return None
+
+    def load():
+        # Raise on outages so the cache can fall back to its last copy; None = no such record
+        params = [("fields[]", f) for f in fields] if fields else None
+        r = airtable_call("GET", table, record_id, params=params, timeout=timeout,
+                          headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}"})
+        if r.status_code == 429 or r.status_code >= 500:
+            raise requests.HTTPError(f"Airtable returned {r.status_code}", response=r)
+        return r.json().get("fields", {}) if r.ok else None
+
+    return record_cache.get(AIRTABLE_BASE, table, record_id, fields, load)
+
+def airtable_patch_record(table, record_id, patch_fields, timeout=15):
+    """PATCH one record and replace its cached copy with Airtable's response."""
+    r = airtable_call(
+        "PATCH", table, record_id,
+        headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}", "Content-Type": "application/json"},
+        json={"fields": patch_fields}, timeout=timeout)
+    if r.ok:
+        record_cache.invalidate(table, record_id)
+        try:
+            record_cache.put(AIRTABLE_BASE, table, record_id, r.json().get("fields", {}))
+        except ValueError:
+            pass
+    return r
+
+# ── Experience catalog ────────────────────────────────────────
+# The whole Experience table lives in memory (record_id -> fields) and is
+# reloaded in the background every CATALOG_REFRESH seconds. Rows are shared by
+# every client, so quote pages never need a per-view Experience round trip.
+CATALOG_REFRESH = int(os.environ.get("CATALOG_REFRESH", 900))
+
+_catalog = {"records": {}, "ts": 0}
+_catalog_started = threading.Event()
+
+def load_catalog():
+    """Download every Experience record and swap the catalog in one assignment."""
     if not AIRTABLE_TOKEN:
+        return False
+    headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
+    records, offset = {}, None
+    with metrics.timer("cm_cache_refresh_seconds", cache="catalog"):
+        while True:
+            params = [("pageSize", "100")]
+            if offset:
+                params.append(("offset", offset))
+            r = airtable_call("GET", EXPERIENCE_TABLE, headers=headers, params=params, timeout=30)
+            if not r.ok:
+                return False
+            metrics.inc("cm_airtable_pages_total", source="catalog")
+            d = r.json()
+            for rec in d.get("records", []):
+                records[rec.get("id", "")] = rec.get("fields", {})
+            offset = d.get("offset")
+            if not offset:
+                break
+    _catalog["records"] = records
+    _catalog["ts"] = time.time()
+    return True
+
+def catalog_get(record_id):
+    """O(1) Experience lookup; falls back to a single GET for rows newer than the last load."""
+    if not record_id:
         return None
+    fields = _catalog["records"].get(record_id)
+    if fields is not None:
+        metrics.inc("cm_cache_requests_total", cache="catalog", result="hit")
+        return fields
+    metrics.inc("cm_cache_requests_total", cache="catalog", result="miss")
+    fields = airtable_get_record(EXPERIENCE_TABLE, record_id, timeout=10)
+    if fields is not None:
+        _catalog["records"][record_id] = fields
+    return fields
+
+def _catalog_loop():
+    while True:
+        try:
+            ok = load_catalog()
+        except Exception as e:
+            print(f"⚠️  Catalog refresh failed: {e}")
+            ok = False
+        # Retry sooner while we have never loaded successfully
+        time.sleep(CATALOG_REFRESH if ok or _catalog["ts"] else 60)
+
+def start_catalog_refresher():
+    if AIRTABLE_TOKEN and not _catalog_started.is_set():
+        _catalog_started.set()
+        threading.Thread(target=_catalog_loop, name="catalog-refresh", daemon=True).start()
+
+# ── Shared event-record cache ─────────────────────────────────
+# Rows from EVENTS_TABLE keyed by record ID, shared by itineraries, essential
+# services and the accommodation lookup. Rows older than EVENT_CACHE_TTL are
+# revalidated with a LAST_MODIFIED_TIME() filter, so only changed rows are
+# re-downloaded; rows older than EVENT_CACHE_MAX_AGE are always refetched
+# (lookup fields don't bump the row's modified time). Past EVENT_CACHE_MAX_ROWS
+# the least recently fetched rows are evicted.
+EVENT_CACHE_TTL = 300
+EVENT_CACHE_MAX_AGE = 3600
+EVENT_CACHE_MAX_ROWS = int(os.environ.get("EVENT_CACHE_MAX_ROWS", 5000))
+AIRTABLE_ID_CHUNK = 25      # record IDs per OR(RECORD_ID()=…) formula
+AIRTABLE_FETCH_WORKERS = 4
+
+_event_cache = {}  # record_id -> {"fields": {...}, "ts": fetched_at, "full_ts": last_full_fetch}
+_event_cache_lock = threading.Lock()
+
+def _trim_event_cache():
+    """Drop the oldest rows by fetch time beyond EVENT_CACHE_MAX_ROWS. Caller holds _event_cache_lock."""
+    excess = len(_event_cache) - EVENT_CACHE_MAX_ROWS
+    if excess > 0:
+        for rid in sorted(_event_cache, key=lambda i: _event_cache[i]["ts"])[:excess]:
+            del _event_cache[rid]
+
+def fetch_records_by_id(table, ids, extra_formula=None, fields=None):
+    """Fetch records by ID in bounded-size chunks, concurrently.
+    Returns (records, ok_ids): {id: fields} for returned rows and the set of
+    IDs whose chunk request succeeded (so callers can tell 'unchanged' from 'failed')."""
     headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
-    r = requests.get(
-        f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{AIRTABLE_TABLE}/{record_id}",
-        headers=headers, timeout=15
-    )
-    if r.ok:
-        return r.json().get("fields", {})
-    return None
 
-EXPERIENCE_TABLE = "tblHsIUTzp0LRGdYD"
+    def fetch_chunk(chunk):
+        formula = "OR(" + ",".join(f"RECORD_ID()='{i}'" for i in chunk) + ")"
+        if extra_formula:
+            formula = f"AND({formula},{extra_formula})"
+        out, offset = {}, None
+        while True:
+            params = [("filterByFormula", formula), ("pageSize", "100")]
+            params += [("fields[]", f) for f in fields or []]
+            if offset:
+                params.append(("offset", offset))
+            try:
+                r = airtable_call("GET", table, headers=headers, params=params, timeout=15)
+            except Exception:
+                return chunk, None
+            if not r.ok:
+                return chunk, None
+            d = r.json()
+            for rec in d.get("records", []):
+                out[rec.get("id", "")] = rec.get("fields", {})
+            offset = d.get("offset")
+            if not offset:
+                return chunk, out
+
+    chunks = [ids[i:i + AIRTABLE_ID_CHUNK] for i in range(0, len(ids), AIRTABLE_ID_CHUNK)]
+    if len(chunks) == 1:
+        results = [fetch_chunk(chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(AIRTABLE_FETCH_WORKERS, len(chunks))) as pool:
+            results = list(pool.map(lambda c: contextvars.copy_context().run(fetch_chunk, c), chunks))
+    records, ok_ids = {}, set()
+    for chunk, out in results:
+        if out is not None:
+            records.update(out)
+            ok_ids.update(chunk)
+    return records, ok_ids
+
+def get_event_records(ids):
+    """Return {record_id: fields} for the given EVENTS_TABLE IDs via the shared cache.
+    Only missing or stale IDs go upstream; on upstream failure stale rows are served."""
+    ids = list(dict.fromkeys(i for i in ids if i))
+    now = time.time()
+    with _event_cache_lock:
+        missing = [i for i in ids if i not in _event_cache or now - _event_cache[i]["full_ts"] >= EVENT_CACHE_MAX_AGE]
+        stale = [i for i in ids if i in _event_cache and i not in missing and now - _event_cache[i]["ts"] >= EVENT_CACHE_TTL]
+    metrics.inc("cm_cache_requests_total", len(ids) - len(missing) - len(stale), cache="events", result="hit")
+    metrics.inc("cm_cache_requests_total", len(missing) + len(stale), cache="events", result="miss")
+
+    if AIRTABLE_TOKEN and missing:
+        fetched, ok_ids = fetch_records_by_id(EVENTS_TABLE, missing)
+        if len(ok_ids) < len(missing) and any(i in _event_cache for i in missing):
+            breaker.mark_stale("airtable")
+        with _event_cache_lock:
+            for rid, f in fetched.items():
+                _event_cache[rid] = {"fields": f, "ts": now, "full_ts": now}
+    if AIRTABLE_TOKEN and stale:
+        with _event_cache_lock:
+            oldest = min((_event_cache[i]["ts"] for i in stale if i in _event_cache), default=now)
+        # 60s margin for clock skew between us and Airtable
+        since = datetime.fromtimestamp(oldest - 60, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+        changed, ok_ids = fetch_records_by_id(EVENTS_TABLE, stale, f"IS_AFTER(LAST_MODIFIED_TIME(),'{since}')")
+        if len(ok_ids) < len(stale):
+            breaker.mark_stale("airtable")
+        with _event_cache_lock:
+            for rid in ok_ids:
+                entry = _event_cache.get(rid)
+                if rid in changed:
+                    _event_cache[rid] = {"fields": changed[rid], "ts": now, "full_ts": now}
+                elif entry:
+                    entry["ts"] = now
+
+    with _event_cache_lock:
+        result = {i: _event_cache[i]["fields"] for i in ids if i in _event_cache}
+        _trim_event_cache()
+    return result
+
+def get_event_record(record_id):
+    return get_event_records([record_id]).get(record_id) if record_id else None
+
+def store_event_records(records):
+    """Seed the cache from a list response (raw Airtable records)."""
+    now = time.time()
+    with _event_cache_lock:
+        for rec in records:
+            _event_cache[rec.get("id", "")] = {"fields": rec.get("fields", {}), "ts": now, "full_ts": now}
+        _trim_event_cache()
+
+def invalidate_event_records(ids):
+    with _event_cache_lock:
+        for i in ids:
+            _event_cache.pop(i, None)
+
+def _event_sort_key(fields):
+    """Mirror the old Airtable sort: Day Number, then 24 Hour Clock (blanks first)."""
+    def norm(v):
+        if isinstance(v, list):
+            v = v[0] if v else None
+        if v in (None, ""):
+            return (0, 0, "")
+        try:
+            return (1, float(v), "")
+        except (TypeError, ValueError):
+            return (2, 0, str(v))
+    return (norm(fields.get("Day Number")), norm(fields.get("24 Hour Clock")))
 
 def fetch_accommodation_details(client_fields):
     """Fetch accommodation house stats + PDF URL from the linked Accommodation event
@@ -286,34 +1491,24 @@ def fetch_accommodation_details(client_fields):
               "accom_pdf": "", "checkin": "", "checkout": "", "venue_address": ""}
     if not AIRTABLE_TOKEN:
         return result
-    headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
 
-    # 1. Get stats from Experience record (tblHsIUTzp0LRGdYD)
+    # 1. Get stats from Experience record (in-memory catalog)
     exp_ids = client_fields.get("Accommodation", [])
     exp_id  = exp_ids[0] if isinstance(exp_ids, list) and exp_ids else None
     if exp_id:
-        try:
-            r = requests.get(
-                f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EXPERIENCE_TABLE}/{exp_id}",
-                headers=headers, timeout=10)
-            if r.ok:
-                ef = r.json().get("fields", {})
-                result["bedrooms"]  = ef.get("house bedrooms")
-                result["beds"]      = ef.get("Beds")
-                result["bathrooms"] = ef.get("bathrooms")
-        except Exception:
-            pass
+        ef = catalog_get(exp_id)
+        if ef is not None:
+            result["bedrooms"]  = ef.get("house bedrooms")
+            result["beds"]      = ef.get("Beds")
+            result["bathrooms"] = ef.get("bathrooms")
 
     # 2. Get PDF URL + address from accommodation event record (EVENTS_TABLE)
     accom_link_ids = client_fields.get("Accommodation Link", [])
     accom_link_id  = accom_link_ids[0] if isinstance(accom_link_ids, list) and accom_link_ids else None
     if accom_link_id:
         try:
-            r = requests.get(
-                f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EVENTS_TABLE}/{accom_link_id}",
-                headers=headers, timeout=10)
-            if r.ok:
-                af = r.json().get("fields", {})
+            af = get_event_record(accom_link_id)
+            if af is not None:
                 desc_raw = af.get("Description", [""])
                 desc     = desc_raw[0] if isinstance(desc_raw, list) else desc_raw
                 # Extract PDF URL from description text
@@ -337,7 +1532,7 @@ def fetch_accommodation_details(client_fields):
 def fetch_client_events(record_id, client_fields=None):
     """Fetch itinerary events for a client.
     Uses Day 1/2/3/4 Link fields from the client record to get event IDs,
-    then fetches those event records directly from the events table."""
+    then reads those event records through the shared event cache."""
     if not AIRTABLE_TOKEN:
         return []
     headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}"}
@@ -363,55 +1558,197 @@ def fetch_client_events(record_id, client_fields=None):
             ("sort[1][field]", "24 Hour Clock"),
             ("sort[1][direction]", "asc"),
         ]
-        r = requests.get(
-            f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EVENTS_TABLE}",
-            headers=headers, params=params, timeout=15
-        )
+        r = airtable_call("GET", EVENTS_TABLE, headers=headers, params=params, timeout=15)
         if r.ok:
-            return [{**rec.get("fields", {}), "_record_id": rec.get("id", "")} for rec in r.json().get("records", [])]
+            records = r.json().get("records", [])
+            store_event_records(records)
+            return [{**rec.get("fields", {}), "_record_id": rec.get("id", "")} for rec in records]
         return []
 
-    # Fetch specific event records by ID using OR formula
-    id_conditions = " ,".join([f"RECORD_ID()='{eid}'" for eid in event_ids])
-    formula = f"OR({id_conditions})"
-    params = [
-        ("filterByFormula", formula),
-        ("sort[0][field]", "Day Number"),
-        ("sort[0][direction]", "asc"),
-        ("sort[1][field]", "24 Hour Clock"),
-        ("sort[1][direction]", "asc"),
-    ]
-    r = requests.get(
-        f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EVENTS_TABLE}",
-        headers=headers, params=params, timeout=15
-    )
-    if r.ok:
-        return [{**rec.get("fields", {}), "_record_id": rec.get("id", "")} for rec in r.json().get("records", [])]
-    return []
+    # Fetch specific event records by ID through the shared cache (chunked, concurrent)
+    by_id = get_event_records(event_ids)
+    events = [{**f, "_record_id": rid} for rid, f in by_id.items()]
+    events.sort(key=_event_sort_key)
+    return events
+
+# Quote reads and PATCHes go to the default market's base and tables
+# (fetch_client_record, fetch_client_events, airtable_patch_record), so links
+# for other markets are refused until those follow the token's market.
+QUOTE_MARKET_ERROR = f"Quotes are only available for the {DEFAULT_MARKET} market"
 
 @app.route("/generate-quote", methods=["POST"])
 def generate_quote():
     body = request.json or {}
     record_id = body.get("record_id", "").strip()
     password   = body.get("password", "").strip()
+    market     = (body.get("market") or DEFAULT_MARKET).strip().lower()
     if not record_id or not password:
         return jsonify({"ok": False, "error": "record_id and password required"}), 400
-    tokens = load_tokens()
-    token = str(uuid.uuid4())
-    tokens[token] = {
-        "record_id": record_id,
-        "password": password,
-        "created_at": __import__("datetime").datetime.utcnow().isoformat()
-    }
-    save_tokens(tokens)
+    if market not in MARKETS:
+        return jsonify({"ok": False, "error": f"Unknown market: {market}"}), 404
+    if market != DEFAULT_MARKET:
+        return jsonify({"ok": False, "error": QUOTE_MARKET_ERROR}), 400
+    with _tokens_lock:
+        tokens = load_tokens()
+        token = str(uuid.uuid4())
+        tokens[token] = {
+            "record_id": record_id,
+            "password": password,
+            "market": market,
+            "created_at": __import__("datetime").datetime.utcnow().isoformat()
+        }
+        save_tokens(tokens)
     base_url = request.host_url.rstrip("/")
     return jsonify({"ok": True, "token": token, "url": f"{base_url}/quote/{token}"})
 
+# ── Bulk quote links ──────────────────────────────────────────
+# One request issues every token in a single write of quote_tokens.json, then
+# a background job pulls each quote's client record (in ID chunks), events,
+# accommodation and photo into the caches, paced so a batch of 200 doesn't
+# crowd out live Airtable traffic. Progress: GET /api/quote-warm/<job_id>.
+# Client rows expire from the record cache within minutes, so opening a link
+# (the password gate) warms that quote again before its view is requested.
+BULK_QUOTE_MAX = int(os.environ.get("BULK_QUOTE_MAX", 200))
+QUOTE_WARM_RATE_PER_SEC = float(os.environ.get("QUOTE_WARM_RATE_PER_SEC", 1))  # quotes/s; each is a few Airtable calls
+
+_quote_warm_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="quote-warm")
+_quote_warm_limiter = RateLimiter(QUOTE_WARM_RATE_PER_SEC)
+_quote_warm_jobs = {}
+_quote_warm_lock = threading.Lock()
+QUOTE_WARM_JOB_KEEP = 20
+
+# Gate warm-ups get their own workers so a long bulk job never delays them
+_gate_warm_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="quote-gate")
+_gate_warming = set()  # record ids with a gate-triggered warm in flight
+
+def warm_quote_async(record_id):
+    """warm_quote() in the background, at most one in flight per record."""
+    if not record_id or not AIRTABLE_TOKEN:
+        return
+    with _quote_warm_lock:
+        if record_id in _gate_warming:
+            return
+        _gate_warming.add(record_id)
+
+    def run():
+        try:
+            warm_quote(record_id)
+            metrics.inc("cm_quote_warm_total", result="gate")
+        except Exception as e:
+            print(f"⚠️  Quote warm-up failed for {record_id}: {e}")
+        finally:
+            with _quote_warm_lock:
+                _gate_warming.discard(record_id)
+
+    _gate_warm_pool.submit(contextvars.copy_context().run, run)
+
+def _run_quote_warm_job(job):
+    record_ids = list(dict.fromkeys(item["record_id"] for item in job["items"]))
+    if AIRTABLE_TOKEN:
+        # Client records for the whole batch in a handful of list calls
+        fetched, _ = fetch_records_by_id(AIRTABLE_TABLE, record_ids)
+        for rid, fields in fetched.items():
+            record_cache.put(AIRTABLE_BASE, AIRTABLE_TABLE, rid, fields)
+    for rid in record_ids:
+        _quote_warm_limiter.wait()
+        try:
+            warm_quote(rid)
+            status, error = "warmed", None
+        except Exception as e:
+            status, error = "failed", str(e)
+        metrics.inc("cm_quote_warm_total", result=status)
+        with _quote_warm_lock:
+            for item in job["items"]:
+                if item["record_id"] == rid:
+                    item["status"] = status
+                    if error:
+                        item["error"] = error
+                    job["counts"][status] += 1
+    with _quote_warm_lock:
+        job["state"] = "done"
+        job["finished_at"] = time.time()
+
+@app.route("/generate-quotes", methods=["POST"])
+def generate_quotes():
+    """Issue quote links for many records at once: {"quotes": [{"record_id", "password"}, ...]}.
+    Top-level "password" and "market" apply to entries without one; "warm": false skips pre-fetching."""
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    body = request.json or {}
+    entries = body.get("quotes") or []
+    default_password = (body.get("password") or "").strip()
+    default_market = (body.get("market") or DEFAULT_MARKET).strip().lower()
+    if not isinstance(entries, list) or not entries:
+        return jsonify({"ok": False, "error": "quotes required"}), 400
+    if len(entries) > BULK_QUOTE_MAX:
+        return jsonify({"ok": False, "error": f"At most {BULK_QUOTE_MAX} quotes per request"}), 400
+    invalid = []
+    for i, entry in enumerate(entries):
+        entry = entry if isinstance(entry, dict) else {}
+        if not str(entry.get("record_id") or "").strip() or not (str(entry.get("password") or "").strip() or default_password):
+            invalid.append(i)
+    if invalid:
+        return jsonify({"ok": False, "error": "record_id and password required", "invalid": invalid}), 400
+    markets = [str(entry.get("market") or default_market).strip().lower() for entry in entries]
+    unknown = sorted(set(markets) - set(MARKETS))
+    if unknown:
+        return jsonify({"ok": False, "error": f"Unknown market: {', '.join(unknown)}"}), 404
+    if set(markets) - {DEFAULT_MARKET}:
+        return jsonify({"ok": False, "error": QUOTE_MARKET_ERROR}), 400
+
+    created_at = datetime.utcnow().isoformat()
+    base_url = request.host_url.rstrip("/")
+    issued = []
+    with _tokens_lock:
+        tokens = load_tokens()
+        for entry, market in zip(entries, markets):
+            token = str(uuid.uuid4())
+            record_id = str(entry["record_id"]).strip()
+            tokens[token] = {
+                "record_id": record_id,
+                "password": str(entry.get("password") or "").strip() or default_password,
+                "market": market,
+                "created_at": created_at,
+            }
+            issued.append({"record_id": record_id, "token": token, "url": f"{base_url}/quote/{token}"})
+        save_tokens(tokens)
+    metrics.inc("cm_quote_links_issued_total", len(issued))
+
+    if body.get("warm") is False:
+        return jsonify({"ok": True, "quotes": issued})
+    job_id = uuid.uuid4().hex[:12]
+    job = {"id": job_id, "state": "running", "created_at": time.time(), "finished_at": None,
+           "total": len(issued), "counts": {"warmed": 0, "failed": 0},
+           "items": [{"record_id": q["record_id"], "token": q["token"], "status": "queued"} for q in issued]}
+    with _quote_warm_lock:
+        _quote_warm_jobs[job_id] = job
+        done = [j for j in _quote_warm_jobs.values() if j["finished_at"]]
+        for old in sorted(done, key=lambda j: j["finished_at"])[:-QUOTE_WARM_JOB_KEEP or None]:
+            _quote_warm_jobs.pop(old["id"], None)
+    _quote_warm_pool.submit(contextvars.copy_context().run, _run_quote_warm_job, job)
+    return jsonify({"ok": True, "quotes": issued, "warm_job": job_id})
+
+@app.route("/api/quote-warm/<job_id>")
+def api_quote_warm_job(job_id):
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    job = _quote_warm_jobs.get(job_id)
+    if not job:
+        return jsonify({"ok": False, "error": "Unknown job"}), 404
+    with _quote_warm_lock:
+        snapshot = {**job, "counts": dict(job["counts"]), "items": [dict(i) for i in job["items"]]}
+    return jsonify({"ok": True, **snapshot})
+
+metrics.describe("cm_quote_links_issued_total", "Quote links issued through /generate-quotes")
+metrics.describe("cm_quote_warm_total", "Quote pages pre-fetched after bulk link generation or on the password gate, by result")
+
 @app.route("/quote/<token>", methods=["GET"])
 def quote_gate(token):
     tokens = load_tokens()
     if token not in tokens:
         return "Quote not found.", 404
+    # The password gate always comes before the view: fill the caches while the client types
+    warm_quote_async(tokens[token].get("record_id"))
     html = f"""<!DOCTYPE html>
 <html lang="en">
 <head>
@@ -508,6 +1845,120 @@ def quote_auth(token):
         return jsonify({"ok": True})
     return jsonify({"ok": False, "error": "Wrong password"}), 401
 
+# ── Quote edits: local pricing, Airtable confirms ─────────────
+# An edit returns totals recomputed by pricing.py straight away; the PATCH
+# and a fresh read of Airtable's formula fields run on _pricing_pool. The
+# confirmed values replace the local ones, and any disagreement is logged
+# as drift. Edits made before confirmation build on the pending state.
+PRICING_CONFIRM_DELAY = float(os.environ.get("PRICING_CONFIRM_DELAY", 2))  # seconds for Airtable formulas to settle
+_pricing_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pricing")
+_pricing = {}        # client record id -> {"version", "status", "block", "fields", "events", ...}
+_pricing_lock = threading.Lock()
+_record_locks = {}   # client record id -> Lock; keeps one quote's PATCHes in order
+_edit_locks = {}     # client record id -> Lock; one local read → recompute → store at a time
+_pricing_drift = []  # latest drift reports, newest last
+
+def _pricing_view(state):
+    return {
+        "status": state["status"],
+        "version": state["version"],
+        "exact": state.get("exact", True),
+        "pricing": {k: format_cad(v) for k, v in state["block"].items()},
+        "drift": state.get("drift") or {},
+        "error": state.get("error"),
+    }
+
+def _quote_state(record_id):
+    """(client fields, event rows) including any edits Airtable hasn't confirmed yet."""
+    with _pricing_lock:
+        state = _pricing.get(record_id)
+        if state and state["status"] in ("pending", "unconfirmed"):
+            return state["fields"], state["events"]
+    fields = fetch_client_record(record_id) or {}
+    return fields, fetch_client_events(record_id, client_fields=fields)
+
+def _local_edit(record_id, patches, **edit):
+    """Price the edit locally, queue the PATCHes and confirmation; returns the pending view."""
+    with _pricing_lock:
+        # Separate from _record_locks, which is held through the PATCH and the confirmation wait
+        lock = _edit_locks.setdefault(record_id, threading.Lock())
+    with lock:
+        fields, events = _quote_state(record_id)
+        start = time.perf_counter()
+        block, exact = pricing.recompute(fields, events, **edit)
+        fields, events = pricing.apply_edit(fields, events, block, **edit)
+        metrics.observe("cm_pricing_local_seconds", time.perf_counter() - start)
+        with _pricing_lock:
+            version = _pricing.get(record_id, {}).get("version", 0) + 1
+            _pricing[record_id] = state = {"version": version, "status": "pending", "block": block, "exact": exact,
+                                           "fields": fields, "events": events, "updated_at": time.time()}
+            view = _pricing_view(state)
+        _pricing_pool.submit(contextvars.copy_context().run, _confirm_pricing, record_id, version, block, patches)
+    return view
+
+def _confirm_pricing(record_id, version, local, patches):
+    with _pricing_lock:
+        lock = _record_locks.setdefault(record_id, threading.Lock())
+    with lock:
+        error = None
+        for table, rid, patch in patches:
+            try:
+                r = airtable_patch_record(table, rid, patch)
+                if not r.ok:
+                    error = r.text[:300] or f"Airtable returned {r.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            if table == EVENTS_TABLE:
+                invalidate_event_records([rid])
+            if error:
+                break
+        with _pricing_lock:
+            if _pricing.get(record_id, {}).get("version") != version:
+                superseded = True   # a newer edit is queued; it does the confirming
+            else:
+                superseded = False
+                if error:
+                    _pricing[record_id].update(status="failed", error=error)
+        if error:
+            metrics.inc("cm_pricing_confirmations_total", result="failed")
+            print(f"⚠️  Quote edit for {record_id} failed: {error}")
+            return
+        if superseded:
+            return
+        time.sleep(PRICING_CONFIRM_DELAY)
+        with _pricing_lock:
+            if _pricing.get(record_id, {}).get("version") != version:
+                return
+        record_cache.invalidate(AIRTABLE_TABLE, record_id)
+        try:
+            airtable = pricing.from_airtable(fetch_client_record(record_id) or {})
+        except requests.RequestException as e:
+            # Saved, but Airtable couldn't be re-read: the local figures stand
+            with _pricing_lock:
+                if _pricing.get(record_id, {}).get("version") == version:
+                    _pricing[record_id].update(status="unconfirmed", error=str(e))
+            metrics.inc("cm_pricing_confirmations_total", result="unconfirmed")
+            return
+        drift = pricing.compare(local, airtable)
+        with _pricing_lock:
+            state = _pricing.get(record_id)
+            if not state or state["version"] != version:
+                return
+            # Airtable is the source of truth once it has answered
+            state.update(status="drift" if drift else "confirmed", block=airtable, drift=drift, exact=True,
+                         confirmed_at=time.time())
+            state.pop("fields", None)
+            state.pop("events", None)
+            if drift:
+                _pricing_drift.append({"record_id": record_id, "at": time.time(), "fields": drift})
+                del _pricing_drift[:-100]
+        metrics.inc("cm_pricing_confirmations_total", result="drift" if drift else "confirmed")
+        if drift:
+            print(f"⚠️  Pricing drift on {record_id}: {drift}")
+
+metrics.describe("cm_pricing_local_seconds", "Time to recompute a quote's pricing block locally after an edit")
+metrics.describe("cm_pricing_confirmations_total", "Background Airtable confirmations of quote edits (confirmed/drift/unconfirmed/failed)")
+
 @app.route("/quote/<token>/update-event", methods=["POST"])
 def quote_update_event(token):
     tokens = load_tokens()
@@ -523,25 +1974,25 @@ def quote_update_event(token):
         return jsonify({"ok": False, "error": "event_id required"}), 400
     if not AIRTABLE_TOKEN:
         return jsonify({"ok": False, "error": "No Airtable token"}), 500
-    headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}", "Content-Type": "application/json"}
+    record_id = tokens[token]["record_id"]
     patch_fields = {}
     if start_time:
         patch_fields["Manual Start Time"] = start_time
     quantity = body.get("quantity")
     duration = body.get("duration")
+    edit = {}
     if quantity is not None:
         try:
-            patch_fields["Manu Quantity"] = int(quantity)
+            patch_fields["Manu Quantity"] = edit["quantity"] = int(quantity)
         except (ValueError, TypeError):
             pass
     if duration is not None:
         try:
-            patch_fields["Manual Duration"] = float(duration)
+            patch_fields["Manual Duration"] = edit["duration"] = float(duration)
         except (ValueError, TypeError):
             pass
     if new_day is not None:
         # Look up date for this day from client record
-        record_id = tokens[token]["record_id"]
         client_fields = fetch_client_record(record_id) or {}
         day_field = f"Day {new_day} Date"
         raw_date = client_fields.get(day_field, "")
@@ -557,15 +2008,8 @@ def quote_update_event(token):
                 patch_fields["Date"] = date_str
     if not patch_fields:
         return jsonify({"ok": False, "error": "Nothing to update"}), 400
-    r = requests.patch(
-        f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EVENTS_TABLE}/{event_id}",
-        headers=headers,
-        json={"fields": patch_fields},
-        timeout=15
-    )
-    if r.ok:
-        return jsonify({"ok": True})
-    return jsonify({"ok": False, "error": r.text}), 500
+    view = _local_edit(record_id, [(EVENTS_TABLE, event_id, patch_fields)], event_id=event_id, **edit)
+    return jsonify({"ok": True, **view})
 
 @app.route("/quote/<token>/update-field", methods=["POST"])
 def quote_update_field(token):
@@ -587,16 +2031,61 @@ def quote_update_field(token):
     record_id = tokens[token]["record_id"]
     if not AIRTABLE_TOKEN:
         return jsonify({"ok": False, "error": "No Airtable token"}), 500
-    headers = {"Authorization": f"Bearer {AIRTABLE_TOKEN}", "Content-Type": "application/json"}
-    r = requests.patch(
-        f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{AIRTABLE_TABLE}/{record_id}",
-        headers=headers,
-        json={"fields": {field: value}},
-        timeout=15
-    )
-    if r.ok:
-        return jsonify({"ok": True})
-    return jsonify({"ok": False, "error": r.text}), 500
+    view = _local_edit(record_id, [(AIRTABLE_TABLE, record_id, {field: value})], people=value)
+    return jsonify({"ok": True, **view})
+
+@app.route("/quote/<token>/pricing")
+def quote_pricing(token):
+    """Latest totals for a quote: status pending (local), confirmed, drift or failed."""
+    tokens = load_tokens()
+    if token not in tokens:
+        return jsonify({"ok": False, "error": "Invalid token"}), 404
+    if not session.get(f"quote_{token}"):
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    record_id = tokens[token]["record_id"]
+    with _pricing_lock:
+        state = _pricing.get(record_id)
+        view = _pricing_view(state) if state else None
+    if view is None:
+        block = pricing.from_airtable(fetch_client_record(record_id) or {})
+        view = {"status": "confirmed", "version": 0, "exact": True, "drift": {}, "error": None,
+                "pricing": {k: format_cad(v) for k, v in block.items()}}
+    return jsonify({"ok": True, **view})
+
+@app.route("/api/pricing-drift")
+def api_pricing_drift():
+    if not is_admin():
+        return jsonify({"ok": False, "error": "Unauthorized"}), 401
+    return jsonify({"ok": True, "drift": _pricing_drift[::-1]})
+
+# ── Attachment images ─────────────────────────────────────────
+def _resolve_attachment(source, att_id):
+    """Fresh copy of an attachment whose signed URL expired (bypasses the record cache)."""
+    table, record_id, field = source
+    r = airtable_call("GET", table, record_id, headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}"}, timeout=15)
+    if not r.ok:
+        return None
+    return next((a for a in r.json().get("fields", {}).get(field) or [] if a.get("id") == att_id), None)
+
+images.set_resolver(_resolve_attachment)
+
+@app.route("/img/<att_id>/<int:width>.<fmt>")
+def attachment_image(att_id, width, fmt):
+    etag = f'"{att_id}-{width}.{fmt}"'
+    if request.headers.get("If-None-Match") == etag:
+        return "", 304, {"ETag": etag, "Cache-Control": images.CACHE_CONTROL}
+    try:
+        found = images.variant(att_id, width, fmt)
+    except requests.RequestException:
+        return jsonify({"ok": False, "error": "Image temporarily unavailable"}), 503, {"Retry-After": "30"}
+    except images.AttachmentTooLarge:
+        return jsonify({"ok": False, "error": "Image too large"}), 413
+    if found is None:
+        return jsonify({"ok": False, "error": "Image not found"}), 404
+    data, mimetype = found
+    resp = make_response(data)
+    resp.headers.update({"Content-Type": mimetype, "ETag": etag, "Cache-Control": images.CACHE_CONTROL})
+    return resp
 
 @app.route("/quote/<token>/view", methods=["GET"])
 def quote_view(token):
@@ -629,7 +2118,9 @@ def quote_view(token):
     accom_addr = accom_details.get("venue_address") or _arr(fields.get("Accommodation Address", ""))
     if accom_addr:
         import urllib.parse as _urlparse
-        maps_query = _urlparse.quote(accom_addr + ", Montreal, QC")
+        market = get_market(tokens[token].get("market")) or get_market()
+        city = market["city"] if market else ""
+        maps_query = _urlparse.quote(f"{accom_addr}, {city}" if city else accom_addr)
         accom_maps_url = f"https://www.google.com/maps/search/?api=1&query={maps_query}"
     else:
         accom_maps_url = ""
@@ -651,10 +2142,6 @@ def quote_view(token):
             parts = raw.split("-", 1)
             day_dates[n] = parts[1].strip() if len(parts) > 1 else raw
 
-    # Accommodation photo (first attachment)
-    accom_photos = fields.get("Accommodation Picture", [])
-    accom_photo_url = accom_photos[0].get("url", "") if accom_photos else ""
-
     # ── Build events list for template ────────────────────────
     events = []
     for ev in raw_events:
@@ -690,8 +2177,14 @@ def quote_view(token):
         })
 
     # ── Accommodation ──────────────────────────────────────────
+    # Photo goes through the /img proxy: cached, resized, and valid after Airtable's URL expires
     accom_photos    = fields.get("Accommodation Picture", [])
-    accom_photo_url = accom_photos[0].get("url", "") if accom_photos else ""
+    accom_photo_url = accom_photo_srcset = accom_photo_jpg_srcset = ""
+    if accom_photos:
+        accom_photo_url = images.proxy_url(accom_photos[0], source=(AIRTABLE_TABLE, record_id, "Accommodation Picture"))
+        if accom_photo_url.startswith("/img/"):
+            accom_photo_srcset = images.srcset(accom_photos[0], "webp")
+            accom_photo_jpg_srcset = images.srcset(accom_photos[0], "jpg")
     # Accommodation Link is a linked record — no direct PDF URL in Airtable
     # Use Fillout Rental Agreement link as the "view details" link if available
     accom_pdf       = fields.get("Accommodation PDF URL", "") or ""
@@ -738,12 +2231,8 @@ def quote_view(token):
         if svc_ids and AIRTABLE_TOKEN:
             for sid in svc_ids[:1]:  # just first record — it has the full description
                 try:
-                    sr = requests.get(
-                        f"https://api.airtable.com/v0/{AIRTABLE_BASE}/{EVENTS_TABLE}/{sid}",
-                        headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}"}, timeout=10
-                    )
-                    if sr.ok:
-                        sfields = sr.json().get("fields", {})
+                    sfields = get_event_record(sid)
+                    if sfields is not None:
                         desc_raw = sfields.get("Description", [""])
                         desc = desc_raw[0] if isinstance(desc_raw, list) else desc_raw
                         desc = _re2.sub(r'<[^>]+>', '', str(desc))
@@ -777,6 +2266,7 @@ def quote_view(token):
         accom_maps_url=accom_maps_url,
         accom_bedrooms=accom_bedrooms, accom_beds=accom_beds, accom_bathrooms=accom_bathrooms,
         accom_photo_url=accom_photo_url, accom_pdf=accom_pdf,
+        accom_photo_srcset=accom_photo_srcset, accom_photo_jpg_srcset=accom_photo_jpg_srcset,
         accom_desc=accom_desc,
         checkin=checkin, checkout=checkout,
         services_list=services_list,
@@ -798,14 +2288,251 @@ def quote_view(token):
     )
 
 
-# Warm cache from disk on startup
-try:
-    if CACHE_FILE.exists():
-        saved = json.loads(CACHE_FILE.read_text())
-        _cache["data"] = saved.get("data")
-        _cache["ts"] = saved.get("ts", 0)
-except Exception:
-    pass
+# ─────────────────────────────────────────────────────────────
+# AIRTABLE WEBHOOKS
+# ─────────────────────────────────────────────────────────────
+# Airtable POSTs a bare "something changed" ping to /airtable/webhook; we then
+# pull the change payloads from its payloads API (cursor persisted on disk)
+# and evict/patch only the records they name. Register the webhook with
+# `python webhook_notifier.py --register <public url>`.
+
+AIRTABLE_WEBHOOK_ID     = os.environ.get("AIRTABLE_WEBHOOK_ID", "")
+AIRTABLE_WEBHOOK_SECRET = os.environ.get("AIRTABLE_WEBHOOK_SECRET", "")  # macSecretBase64
+WEBHOOK_CURSOR_FILE = Path(__file__).parent / ".webhook_cursor.json"
+
+_webhook = {"running": False, "pending": False, "inline": [], "last_notification": None,
+            "records_changed": 0, "last_error": None}
+_webhook_lock = threading.Lock()
+
+def verify_webhook_mac(body, header):
+    if not AIRTABLE_WEBHOOK_SECRET or not header.startswith("hmac-sha256="):
+        return False
+    try:
+        key = base64.b64decode(AIRTABLE_WEBHOOK_SECRET)
+    except ValueError:
+        return False
+    expected = hmac.new(key, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len("hmac-sha256="):])
+
+def _load_webhook_cursor():
+    try:
+        return int(json.loads(WEBHOOK_CURSOR_FILE.read_text()).get("cursor", 1))
+    except Exception:
+        return 1
+
+def _fetch_webhook_payloads():
+    """Drain Airtable's payload queue from the stored cursor."""
+    cursor = _load_webhook_cursor()
+    payloads = []
+    while True:
+        r = upstream_request(
+            "airtable", "GET",
+            f"https://api.airtable.com/v0/bases/{AIRTABLE_BASE}/webhooks/{AIRTABLE_WEBHOOK_ID}/payloads",
+            target="webhook_payloads", headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}"},
+            params={"cursor": cursor}, timeout=15)
+        if not r.ok:
+            raise RuntimeError(f"payloads {r.status_code}: {r.text[:200]}")
+        d = r.json()
+        payloads.extend(d.get("payloads", []))
+        cursor = d.get("cursor", cursor)
+        if not d.get("mightHaveMore"):
+            break
+    return payloads, cursor
+
+def changes_from_payloads(payloads):
+    """Collapse webhook payloads into {table_id: {"changed": set, "destroyed": set}}."""
+    changes = {}
+    for p in payloads:
+        for table_id, t in (p.get("changedTablesById") or {}).items():
+            c = changes.setdefault(table_id, {"changed": set(), "destroyed": set()})
+            c["changed"].update((t.get("changedRecordsById") or {}).keys())
+            c["changed"].update((t.get("createdRecordsById") or {}).keys())
+            c["destroyed"].update(t.get("destroyedRecordIds") or [])
+    for c in changes.values():
+        c["changed"] -= c["destroyed"]
+    return changes
+
+def _patch_live_leads(changed, destroyed):
+    """Re-read just the changed customers and splice them into the live snapshot."""
+    data = _cache["data"]
+    if not data or "leads" not in data:
+        return
+    fresh = {}
+    if changed:
+        records, ok_ids = fetch_records_by_id(AIRTABLE_TABLE, sorted(changed), LEADS_ACTIVE_FILTER, LEAD_FIELDS)
+        if len(ok_ids) < len(changed):
+            # Partial failure: let the next poll rebuild rather than guess
+            _cache["ts"] = 0
+            return
+        fresh = {rid: lead_from_record({"id": rid, "fields": f}) for rid, f in records.items()
+                 if f.get("Contact Type") == "Party Main Contact"}
+    gone = set(destroyed) | (set(changed) - set(fresh))
+    leads = []
+    for lead in data["leads"]:
+        if lead["id"] in fresh:
+            leads.append(fresh.pop(lead["id"]))
+        elif lead["id"] not in gone:
+            leads.append(lead)
+    leads.extend(fresh.values())  # newly active leads
+    new_data = {**data, "leads": leads, "pipeline": pipeline_counts(leads), "total_leads": len(leads)}
+    _cache["data"] = new_data
+    save_cache_file(new_data, _cache["ts"])
+
+def apply_airtable_changes(changes):
+    for table_id, c in changes.items():
+        ids = c["changed"] | c["destroyed"]
+        for rid in ids:
+            record_cache.invalidate(table_id, rid)
+        if table_id == AIRTABLE_TABLE:
+            _patch_live_leads(c["changed"], c["destroyed"])
+        elif table_id == EVENTS_TABLE:
+            invalidate_event_records(ids)
+        elif table_id == EXPERIENCE_TABLE:
+            for rid in c["destroyed"]:
+                _catalog["records"].pop(rid, None)
+            if c["changed"]:
+                records, _ = fetch_records_by_id(EXPERIENCE_TABLE, sorted(c["changed"]))
+                _catalog["records"].update(records)
+        _webhook["records_changed"] += len(ids)
+        metrics.inc("cm_webhook_records_total", len(ids), table=AIRTABLE_TABLE_LABELS.get(table_id, table_id))
+
+def _drain_webhook():
+    while True:
+        with _webhook_lock:
+            if not _webhook["pending"]:
+                _webhook["running"] = False
+                return
+            _webhook["pending"] = False
+            inline, _webhook["inline"] = _webhook["inline"], []
+        try:
+            if inline:
+                apply_airtable_changes(changes_from_payloads(inline))
+            elif AIRTABLE_WEBHOOK_ID and AIRTABLE_TOKEN:
+                payloads, cursor = _fetch_webhook_payloads()
+                apply_airtable_changes(changes_from_payloads(payloads))
+                WEBHOOK_CURSOR_FILE.write_text(json.dumps({"cursor": cursor}))
+            _webhook["last_error"] = None
+        except Exception as e:
+            _webhook["last_error"] = str(e)
+            print(f"⚠️  Webhook processing failed: {e}")
+
+@app.route("/airtable/webhook", methods=["POST"])
+def airtable_webhook():
+    if not AIRTABLE_WEBHOOK_SECRET:
+        return jsonify({"ok": False, "error": "Webhook not configured"}), 503
+    if not verify_webhook_mac(request.get_data(), request.headers.get("X-Airtable-Content-MAC", "")):
+        metrics.inc("cm_webhook_notifications_total", result="bad_mac")
+        return jsonify({"ok": False, "error": "Invalid signature"}), 401
+    body = request.get_json(silent=True) or {}
+    hook_id = (body.get("webhook") or {}).get("id")
+    if AIRTABLE_WEBHOOK_ID and hook_id and hook_id != AIRTABLE_WEBHOOK_ID:
+        metrics.inc("cm_webhook_notifications_total", result="unknown_webhook")
+        return jsonify({"ok": False, "error": "Unknown webhook"}), 404
+    metrics.inc("cm_webhook_notifications_total", result="ok")
+    with _webhook_lock:
+        _webhook["last_notification"] = time.time()
+        # Signed stand-in notifications (webhook_notifier.py) carry payloads inline
+        _webhook["inline"].extend(body.get("payloads") or [])
+        _webhook["pending"] = True
+        start = not _webhook["running"]
+        _webhook["running"] = True
+    if start:
+        threading.Thread(target=_drain_webhook, name="airtable-webhook", daemon=True).start()
+    return "", 204
+
+# ─────────────────────────────────────────────────────────────
+# STARTUP WARM-UP
+# ─────────────────────────────────────────────────────────────
+# Nothing slow runs at import: the port binds immediately and this thread
+# loads the disk snapshot, refreshes it if stale, indexes quote tokens and
+# pre-fetches pages for recently issued quotes. /readyz reports progress.
+
+WARM_QUOTE_DAYS  = int(os.environ.get("WARM_QUOTE_DAYS", 14))
+WARM_QUOTE_LIMIT = int(os.environ.get("WARM_QUOTE_LIMIT", 50))
+
+_warmup = {
+    "started_at": None,
+    "finished_at": None,
+    "steps": {name: {"status": "pending"} for name in ("dashboard_assets", "disk_snapshot", "live_data", "quote_tokens", "quote_pages")},
+    "quotes_warmed": 0,
+    "quotes_total": 0,
+}
+
+def _warm_step(name, fn):
+    step = _warmup["steps"][name]
+    step["status"] = "running"
+    start = time.perf_counter()
+    try:
+        fn()
+        step["status"] = "done"
+    except Exception as e:
+        step["status"] = "failed"
+        step["error"] = str(e)
+    step["seconds"] = round(time.perf_counter() - start, 3)
+
+def warm_quote(record_id):
+    """Pull everything quote_view needs for one client into the caches."""
+    fields = fetch_client_record(record_id) or {}
+    fetch_client_events(record_id, client_fields=fields)
+    fetch_accommodation_details(fields)
+    photos = fields.get("Accommodation Picture") or []
+    if photos:
+        images.register(photos[0], source=(AIRTABLE_TABLE, record_id, "Accommodation Picture"))
+
+def _recent_quote_records():
+    cutoff = datetime.utcnow().timestamp() - WARM_QUOTE_DAYS * 86400
+    recent = []
+    for info in load_tokens().values():
+        try:
+            created = datetime.fromisoformat(info.get("created_at", "")).timestamp()
+        except ValueError:
+            continue
+        if created >= cutoff and info.get("record_id"):
+            recent.append((created, info["record_id"]))
+    recent.sort(reverse=True)
+    return list(dict.fromkeys(rid for _, rid in recent))[:WARM_QUOTE_LIMIT]
+
+def _warm_quote_pages():
+    record_ids = _recent_quote_records() if AIRTABLE_TOKEN else []
+    _warmup["quotes_total"] = len(record_ids)
+    for rid in record_ids:
+        try:
+            warm_quote(rid)
+        except Exception:
+            pass
+        _warmup["quotes_warmed"] += 1
+
+def _run_warmup():
+    _warmup["started_at"] = time.time()
+    _warm_step("dashboard_assets", get_dashboard_assets)
+    _warm_step("disk_snapshot", load_cache_file)
+    _warm_step("live_data", fetch_all_markets)
+    _warm_step("quote_tokens", load_tokens)
+    _warm_step("quote_pages", _warm_quote_pages)
+    _warmup["finished_at"] = time.time()
+
+def start_warmup():
+    if _warmup["started_at"] is None:
+        _warmup["started_at"] = time.time()
+        threading.Thread(target=_run_warmup, name="warmup", daemon=True).start()
+
+@app.route("/readyz")
+def readyz():
+    ready = _warmup["finished_at"] is not None
+    body = {
+        "ready": ready,
+        **_warmup,
+        "live_data_age": round(time.time() - _cache["ts"], 1) if _cache["ts"] else None,
+        "catalog_loaded": bool(_catalog["ts"]),
+        "breakers": breaker.states(),
+    }
+    return jsonify(body), (200 if ready else 503)
+
+start_catalog_refresher()
+start_sms_sync()
+start_warmup()
+start_pipeline()
+start_attribution_sync()
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5050))
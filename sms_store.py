@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - local SMS message store
+SQLite copy of BlueBubbles messages, indexed by normalized phone number and
+timestamp, so /api/sms-history and last-contacted lookups never hit BlueBubbles.
+"""
+
+import sqlite3
+import threading
+
+
+def normalize_phone(phone):
+    """'(514) 555-1234' / '15145551234' / '+1 514…' → '+15145551234'."""
+    digits = "".join(c for c in str(phone or "") if c.isdigit())
+    if len(digits) == 10:
+        digits = "1" + digits
+    return "+" + digits if digits else ""
+
+
+class MessageStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                guid TEXT PRIMARY KEY,
+                phone TEXT NOT NULL,
+                ts INTEGER NOT NULL,          -- ms since epoch (BlueBubbles dateCreated)
+                is_from_me INTEGER NOT NULL,
+                text TEXT
+            );
+            DROP INDEX IF EXISTS messages_by_phone_ts;
+            CREATE INDEX IF NOT EXISTS messages_by_phone_ts_guid ON messages (phone, ts, guid);
+            CREATE INDEX IF NOT EXISTS messages_by_ts ON messages (ts);
+            CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+        """)
+        self._db.commit()
+
+    def add(self, guid, phone, ts, is_from_me, text, replaces=None):
+        """Insert or update one message. `replaces` drops a provisional row (e.g. our tempGuid)."""
+        self.add_many([(guid, phone, ts, is_from_me, text, replaces)])
+
+    def add_many(self, rows):
+        """rows: iterable of (guid, phone, ts, is_from_me, text, replaces)."""
+        with self._lock:
+            for guid, phone, ts, is_from_me, text, replaces in rows:
+                phone = normalize_phone(phone)
+                if not phone or not guid:
+                    continue
+                if replaces and replaces != guid:
+                    self._db.execute("DELETE FROM messages WHERE guid = ?", (replaces,))
+                self._db.execute("INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+                                 (guid, phone, int(ts), 1 if is_from_me else 0, text or ""))
+            self._db.commit()
+
+    def history(self, phone, limit=50, before=None):
+        """Newest `limit` messages for a phone, oldest first.
+        `before` is a (ts, guid) keyset from the previous page's oldest message;
+        guid breaks ties so messages sharing a millisecond aren't skipped."""
+        phone = normalize_phone(phone)
+        sql = "SELECT guid, ts, is_from_me, text FROM messages WHERE phone = ?"
+        args = [phone]
+        if before:
+            ts, guid = before
+            sql += " AND (ts < ? OR (ts = ? AND guid < ?))"
+            args += [int(ts), int(ts), guid]
+        sql += " ORDER BY ts DESC, guid DESC LIMIT ?"
+        args.append(int(limit))
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        rows.reverse()
+        return [{"guid": g, "timestamp": ts, "sender": "me" if me else "them", "text": text}
+                for g, ts, me, text in rows]
+
+    def last_contacted(self, phones=None):
+        """{phone: {last, last_outbound, last_inbound}} for every phone (or the given ones) in one query."""
+        sql = """SELECT phone, MAX(ts),
+                        MAX(CASE WHEN is_from_me = 1 THEN ts END),
+                        MAX(CASE WHEN is_from_me = 0 THEN ts END)
+                 FROM messages"""
+        args = []
+        if phones:
+            phones = sorted({normalize_phone(p) for p in phones if normalize_phone(p)})
+            sql += f" WHERE phone IN ({','.join('?' * len(phones))})"
+            args = phones
+        sql += " GROUP BY phone"
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return {p: {"last": last, "last_outbound": out, "last_inbound": inb} for p, last, out, inb in rows}
+
+    def get_state(self, key, default=None):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, str(value)))
+            self._db.commit()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - cached PostHog traffic trends
+The dashboard's traffic panel needs three PostHog trend queries per date
+range: the pageview series, pageviews by URL, and pageviews by referring
+domain. They run here, side by side, once per market and range. The combined
+result is cached with a TTL matched to the range's granularity, and
+concurrent requests for the same range wait for the one fetch in flight.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import breaker
+import markets
+import metrics
+from metrics import upstream_request
+
+POSTHOG_API_KEY = os.environ.get("POSTHOG_API_KEY", "")
+
+RANGES = {"1d": 1, "7d": 7, "30d": 30}
+# Today's numbers move; a 1-day view is worth refreshing more often than a month
+RANGE_TTLS = {"1d": 300, "7d": 900, "30d": 3600}
+CLOSED_RANGE_TTL = 86400   # custom ranges that end before today no longer change
+OPEN_RANGE_TTL = 900
+MAX_ENTRIES = 64
+MAX_DAYS = 366
+
+_PAGEVIEWS = [{"id": "$pageview", "type": "events", "math": "total"}]
+QUERIES = {
+    "series": {"insight": "TRENDS", "events": _PAGEVIEWS, "interval": "day"},
+    "pages": {"insight": "TRENDS", "events": _PAGEVIEWS, "breakdown": "$current_url", "breakdown_type": "event"},
+    "sources": {"insight": "TRENDS", "events": _PAGEVIEWS, "breakdown": "$referring_domain", "breakdown_type": "event"},
+}
+
+_entries = {}   # (market, date_from, date_to) -> {"data", "ts", "ttl"}
+_locks = {}     # same keys as _entries; dropped with them on eviction
+_locks_lock = threading.Lock()
+_pool = ThreadPoolExecutor(max_workers=len(QUERIES) * 2, thread_name_prefix="trends")
+
+
+def parse_range(range_key=None, date_from=None, date_to=None):
+    """(date_from, date_to, ttl) for a preset range or a custom YYYY-MM-DD pair; ValueError if invalid."""
+    if date_from or date_to:
+        start, end = date.fromisoformat(date_from or ""), date.fromisoformat(date_to or "")
+        if start > end or (end - start).days > MAX_DAYS:
+            raise ValueError(f"from must be on or before to, at most {MAX_DAYS} days apart")
+        return start.isoformat(), end.isoformat(), CLOSED_RANGE_TTL if end < date.today() else OPEN_RANGE_TTL
+    range_key = range_key or "7d"
+    if range_key not in RANGES:
+        raise ValueError(f"range must be one of {', '.join(RANGES)}")
+    return f"-{RANGES[range_key]}d", None, RANGE_TTLS[range_key]
+
+
+def _trend(market, query, date_from, date_to):
+    markets.limiter(market["key"], "posthog").wait()
+    r = upstream_request("posthog", "POST", f"https://us.posthog.com/api/projects/{market['posthog_project']}/insights/trend/",
+                         target="trend", headers={"Authorization": f"Bearer {POSTHOG_API_KEY}"},
+                         json={**query, "date_from": date_from, "date_to": date_to}, timeout=30)
+    if not r.ok:
+        raise RuntimeError(f"PostHog returned {r.status_code}")
+    return r.json().get("results") or []
+
+
+def _count(item):
+    if item.get("count") is not None:
+        return item["count"]
+    return sum(p.get("count", 0) if isinstance(p, dict) else (p or 0) for p in item.get("data") or [])
+
+
+def _breakdown(results, key):
+    rows = [{key: str(item.get("breakdown_value") or item.get("label") or "unknown"), "count": _count(item)}
+            for item in results]
+    return sorted(rows, key=lambda r: r["count"], reverse=True)
+
+
+def _fetch(market, date_from, date_to):
+    futures = {name: _pool.submit(contextvars.copy_context().run, _trend, market, q, date_from, date_to)
+               for name, q in QUERIES.items()}
+    results = {name: f.result() for name, f in futures.items()}
+    series = results["series"][0] if results["series"] else {}
+    total, days = _count(series), len(series.get("data") or [])
+    return {
+        "market": market["key"],
+        "date_from": date_from,
+        "date_to": date_to,
+        "total_pageviews": total,
+        "avg_pageviews": round(total / days, 1) if days else 0,
+        "days": series.get("days") or [],
+        "daily": series.get("data") or [],
+        "pages": [{"url": r["url"], "views": r["count"]} for r in _breakdown(results["pages"], "url")],
+        "sources": [{"source": r["source"], "sessions": r["count"]} for r in _breakdown(results["sources"], "source")],
+        "fetched_at": time.time(),
+    }
+
+
+def get(market, date_from, date_to, ttl):
+    """Combined traffic payload for one market and range, from cache when fresh.
+    On a failed refresh the previous result is served and marked stale."""
+    key = (market["key"], date_from, date_to)
+    entry = _entries.get(key)
+    if entry and time.time() - entry["ts"] < entry["ttl"]:
+        metrics.inc("cm_cache_requests_total", cache="trends", result="hit")
+        return entry["data"]
+    with _locks_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    waited = not lock.acquire(blocking=False)
+    if waited:
+        lock.acquire()
+    try:
+        entry = _entries.get(key)
+        if entry and time.time() - entry["ts"] < entry["ttl"]:
+            # Another request fetched this range while we waited
+            metrics.inc("cm_cache_requests_total", cache="trends", result="coalesced" if waited else "hit")
+            return entry["data"]
+        metrics.inc("cm_cache_requests_total", cache="trends", result="miss")
+        try:
+            with metrics.timer("cm_cache_refresh_seconds", cache="trends"):
+                data = _fetch(market, date_from, date_to)
+        except Exception:
+            if entry:
+                breaker.mark_stale("posthog")
+                return {**entry["data"], "stale": True}
+            with _locks_lock:
+                _locks.pop(key, None)   # nothing cached for this range; don't keep its lock either
+            raise
+        _entries[key] = {"data": data, "ts": time.time(), "ttl": ttl}
+        if len(_entries) > MAX_ENTRIES:
+            oldest = min(_entries, key=lambda k: _entries[k]["ts"])
+            _entries.pop(oldest, None)
+            with _locks_lock:
+                # A request still holding the old lock finishes normally; the next one makes a new lock
+                _locks.pop(oldest, None)
+        return data
+    finally:
+        lock.release()
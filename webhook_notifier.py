@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Connected Montreal - Airtable webhook helper
+  --register URL   create the Airtable webhook pointing at URL/airtable/webhook
+  (default)        act as a local stand-in for Airtable: POST a signed
+                   notification with inline change payloads to the server
+"""
+
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+from datetime import datetime, timezone
+
+import requests
+
+AIRTABLE_TOKEN = os.environ.get("AIRTABLE_TOKEN", "")
+AIRTABLE_BASE  = os.environ.get("AIRTABLE_BASE", "appHT9Re4l53GO16t")
+TABLES = {
+    "customers":  os.environ.get("AIRTABLE_TABLE", "tbl4P7tqdonXv5vcY"),
+    "events":     "tblLuq2c0C405bP3g",
+    "experience": "tblHsIUTzp0LRGdYD",
+}
+
+
+def register(public_url):
+    r = requests.post(
+        f"https://api.airtable.com/v0/bases/{AIRTABLE_BASE}/webhooks",
+        headers={"Authorization": f"Bearer {AIRTABLE_TOKEN}", "Content-Type": "application/json"},
+        json={"notificationUrl": public_url.rstrip("/") + "/airtable/webhook",
+              "specification": {"options": {"filters": {"dataTypes": ["tableData"]}}}},
+        timeout=15)
+    if not r.ok:
+        print(f"❌ Airtable error {r.status_code}: {r.text}")
+        return
+    d = r.json()
+    print("✅ Webhook created — set these on the server:")
+    print(f"   AIRTABLE_WEBHOOK_ID={d['id']}")
+    print(f"   AIRTABLE_WEBHOOK_SECRET={d['macSecretBase64']}")
+    print(f"   (expires {d.get('expirationTime')}; listing payloads keeps it alive)")
+
+
+def notify(server_url, table, changed, destroyed, secret):
+    table_id = TABLES.get(table, table)
+    payload = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "changedTablesById": {table_id: {
+            "changedRecordsById": {rid: {"current": {"cellValuesByFieldId": {}}} for rid in changed},
+            "destroyedRecordIds": destroyed,
+        }},
+    }
+    body = json.dumps({
+        "base": {"id": AIRTABLE_BASE},
+        "webhook": {"id": os.environ.get("AIRTABLE_WEBHOOK_ID", "")},
+        "timestamp": payload["timestamp"],
+        "payloads": [payload],
+    }).encode()
+    mac = hmac.new(base64.b64decode(secret), body, hashlib.sha256).hexdigest()
+    r = requests.post(server_url.rstrip("/") + "/airtable/webhook", data=body, timeout=10,
+                      headers={"Content-Type": "application/json", "X-Airtable-Content-MAC": f"hmac-sha256={mac}"})
+    print(f"{'✅' if r.ok else '❌'} {r.status_code} {r.text}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Airtable webhook registration and local stand-in notifier")
+    parser.add_argument("--register", metavar="PUBLIC_URL", help="create the webhook on Airtable")
+    parser.add_argument("--url", default="http://localhost:5050", help="server to notify (stand-in mode)")
+    parser.add_argument("--table", default="customers", help="customers | events | experience | tbl… id")
+    parser.add_argument("--changed", default="", help="comma-separated record IDs that changed")
+    parser.add_argument("--destroyed", default="", help="comma-separated record IDs that were deleted")
+    args = parser.parse_args()
+    if args.register:
+        register(args.register)
+    else:
+        secret = os.environ.get("AIRTABLE_WEBHOOK_SECRET", "")
+        if not secret:
+            raise SystemExit("Set AIRTABLE_WEBHOOK_SECRET (any base64 string works locally, same value as the server)")
+        split = lambda v: [x for x in v.split(",") if x]
+        notify(args.url, args.table, split(args.changed), split(args.destroyed), secret)